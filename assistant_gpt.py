@@ -5,25 +5,61 @@ from openai import AsyncOpenAI  # Ensure you have an asynchronous OpenAI client
 import os
 # Ideally your openai_api_key should be stored as an environment variable
 # Replace OPENAI_API_KEY with os.environ.get("OPENAI_API_KEY")
-from configure import user_name, prompt, tools  # Import your configuration
+from configure import user_name, prompt  # Import your configuration
 import sys
 import json
 import re
-import backoff
 from openai import OpenAIError, APIError
+from rate_limiter import scheduler
+import cassette
+from tool_selector import tool_selector
+import usage
 # Set event loop policy on Windows
 if sys.platform.startswith('win'):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+class AssistantTurn:
+    """Per-turn streaming state, kept off the assistant so concurrent turns don't share replies or tool calls."""
+    def __init__(self):
+        self.assistant_reply = ""
+        self.is_tool_called = False
+        self.tools_called = None
+
 class GPTAssistant:
-    def __init__(self, ai_model="gpt-3.5-turbo-0125"):
+    def __init__(self, ai_model="gpt-3.5-turbo-0125", openai_client=None):
         self.model = ai_model
         # Replace OPENAI_API_KEY with os.environ.get("OPENAI_API_KEY")
-        self.openai_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY")) 
+        # Sessions in server mode pass in one shared client so they share its connection pool
+        self.openai_client = openai_client or AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"),
+                                                          http_client=cassette.http_client("openai"))
         self.messages = [prompt,]  # Initialize messages with the starting prompt
-        self.assistant_reply = ""
-        self.is_tool_called = False
-        self.tools_called=None
+        self.tool_names = frozenset()  # Tools offered in this conversation so far, see ToolSelector
+        self.current_turn = AssistantTurn()
+
+    @property
+    def assistant_reply(self):
+        return self.current_turn.assistant_reply
+
+    @property
+    def is_tool_called(self):
+        return self.current_turn.is_tool_called
+
+    @property
+    def tools_called(self):
+        return self.current_turn.tools_called
+
+    def new_turn(self):
+        self.current_turn = AssistantTurn()
+        return self.current_turn
+
+    def checkpoint(self):
+        """Marks the current end of the conversation so an interrupted turn can be undone."""
+        return len(self.messages)
+
+    def rollback(self, checkpoint):
+        """Drops every message added since checkpoint, e.g. after a barge-in cancelled the turn."""
+        del self.messages[checkpoint:]
+
     async def parse_to_json(self, input_str):
         pattern = re.compile(r'(\w+)\s*({.*?})(?=\w+\s*{|\Z)', re.DOTALL)
         data = [
@@ -47,25 +83,35 @@ class GPTAssistant:
         else:
             self.messages.append(message)
 
-    async def process_transcript(self, transcript):
+    async def process_transcript(self, transcript, turn=None):
+        if len(self.messages) <= 1:
+            self.tool_names = frozenset()  # The history was cleared, so the tool set starts over too
+        self.tool_names = tool_selector.select(transcript, self.tool_names)
         await self.append_message("user", transcript)
-        async for response_chunk in self.get_response_from_openai():
+        async for response_chunk in self.get_response_from_openai(turn):
             yield response_chunk
-    @backoff.on_exception(backoff.expo,
-                          (OpenAIError, APIError),  # Retry on general API errors as well
-                          max_tries=5,)
     async def get_response_from_openai_with_retry(self):
-        try:
-            stream = await self.openai_client.chat.completions.create(
+        # Retries are left to the shared scheduler, which honours rate-limit headers and a retry budget
+        client = self.openai_client.with_options(max_retries=0)
+        request_tools = tool_selector.schemas(self.tool_names)
+        # With nothing relevant to offer, tools and tool_choice are left out of the request altogether
+        tool_options = {"tools": request_tools, "tool_choice": "auto"} if request_tools else {}
+
+        async def send():
+            return await client.chat.completions.with_raw_response.create(
                 model=self.model,
-                tools=tools,
                 temperature=0.8,
                 messages=self.messages,
-                tool_choice="auto",
                 max_tokens=3000,
                 stream=True,
+                # Adds a final chunk with no choices carrying the token usage
+                extra_body={"stream_options": {"include_usage": True}},
+                **tool_options,
             )
-            return stream
+
+        try:
+            raw_response = await scheduler.call("openai", send)
+            return raw_response.parse()
         except APIError as e:
             print(f"API error occurred: {e}")
             raise
@@ -73,54 +119,62 @@ class GPTAssistant:
             print(f"OpenAI error occurred: {e}")
             raise
 
-    async def get_response_from_openai(self):
-        self.is_tool_called=False
+    async def get_response_from_openai(self, turn=None):
+        turn = turn or self.new_turn()
+        turn.is_tool_called=False
         # Replace your existing get_response_from_openai with a call to the new method
         stream = await self.get_response_from_openai_with_retry()
 
         chunk_content = ""  # Initialize chunk_content outside of the loop for tool_calls handling
-        async for chunk in stream:
-        
-        #Handle regular assistant response
-            if chunk.choices[0].delta.content is not None:
+        try:
+            async for chunk in stream:
+                usage.record_stream_chunk("openai", chunk)
+                if not chunk.choices:
+                    continue
+            #Handle regular assistant response
+                if chunk.choices[0].delta.content is not None:
                 
-                chunk_content = chunk.choices[0].delta.content
-                #print(chunk_content, end="", flush=True)
-                yield chunk_content
-                self.assistant_reply += chunk_content
+                    chunk_content = chunk.choices[0].delta.content
+                    #print(chunk_content, end="", flush=True)
+                    yield chunk_content
+                    turn.assistant_reply += chunk_content
                 
-            #Handle tool call with no yielding
-            elif chunk.choices[0].delta.tool_calls:
-                # Handle the tool_calls without yielding
-                for tool_call in chunk.choices[0].delta.tool_calls:
-                    if tool_call.function.name: 
-                        self.is_tool_called=True
-                        chunk_content += tool_call.function.name
-                    chunk_content += str(tool_call.function.arguments)  # Convert arguments to string for concatenation
-            
-                    
+                #Handle tool call with no yielding
+                elif chunk.choices[0].delta.tool_calls:
+                    # Handle the tool_calls without yielding
+                    for tool_call in chunk.choices[0].delta.tool_calls:
+                        if tool_call.function.name: 
+                            turn.is_tool_called=True
+                            chunk_content += tool_call.function.name
+                        chunk_content += str(tool_call.function.arguments)  # Convert arguments to string for concatenation
+        finally:
+            # Closing the HTTP response stops token generation (and billing) when the turn is cancelled mid-stream
+            await stream.response.aclose()
+            usage.record("openai", bytes=stream.response.num_bytes_downloaded)
+
         #print(chunk_content)
         # Append any accumulated tool call data to assistant reply after processing all chunks
-        if self.assistant_reply and not self.is_tool_called:
-            await self.append_message("assistant", self.assistant_reply)
-        elif chunk_content and self.is_tool_called:
-            self.tools_called=await self.parse_to_json(chunk_content)
-            #print(self.tools_called["calls"])
-        self.assistant_reply=""
+        if turn.assistant_reply and not turn.is_tool_called:
+            await self.append_message("assistant", turn.assistant_reply)
+        elif chunk_content and turn.is_tool_called:
+            turn.tools_called=await self.parse_to_json(chunk_content)
+            #print(turn.tools_called["calls"])
 
 # Modified main function to handle multiple transcripts concurrently
 async def main():
-    gpt_processor = GPTAssistant()  # Instantiate a single GPTProcessor
+    openai_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))  # One client shared by every session
     transcripts = ["How are you doing?", "What is the weather like?", "Tell me a joke."]  # List of transcripts
 
-    # Create a list of tasks, each processing a different transcript
-    tasks = [asyncio.create_task(process_transcript_concurrently(gpt_processor, transcript)) for transcript in transcripts]
+    # Each transcript gets its own session (conversation) and turn so replies and tool state don't interleave
+    tasks = [asyncio.create_task(process_transcript_concurrently(GPTAssistant(openai_client=openai_client), transcript))
+             for transcript in transcripts]
 
     # Wait for all tasks to complete
     await asyncio.gather(*tasks)
 
 async def process_transcript_concurrently(gpt_processor, transcript):
-    async for response in gpt_processor.process_transcript(transcript):
+    turn = gpt_processor.new_turn()
+    async for response in gpt_processor.process_transcript(transcript, turn):
         print(f"{response}", end = "", flush=True)
 
 # Run the modified main function in the asyncio event loop
@@ -1,11 +1,17 @@
 #async_spotify.py
 
+import requests
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 from contextlib import asynccontextmanager
 import sys
 import asyncio
 import os
+import usage
+import cassette
+
+# Base URL override so benchmarks and tests can point the client at a local stand-in
+SPOTIFY_API_PREFIX = os.environ.get('SPOTIFY_API_PREFIX')
 
 # Set event loop policy on Windows for Python 3.8+
 if sys.platform.startswith('win'):
@@ -20,6 +26,13 @@ class AsyncSpotifyClient:
         self.scope = 'user-modify-playback-state user-read-playback-state user-read-currently-playing playlist-read-private playlist-modify-public playlist-modify-private'
         self.device_id = None
         self.oauth_object = SpotifyOAuth(self.clientID, self.clientSecret, self.redirect_uri, scope=self.scope)
+        # Calls run in asyncio.to_thread, which carries the turn's context into the hook
+        self.session = cassette.requests_session("spotify", requests.Session())
+        self.session.hooks['response'].append(self.record_usage)
+
+    @staticmethod
+    def record_usage(response, *args, **kwargs):
+        usage.record("spotify", calls=1, bytes=len(response.content))
 
     def authenticate_client(self):
         token_dict = self.oauth_object.get_cached_token()
@@ -31,7 +44,10 @@ class AsyncSpotifyClient:
             print("Token expired; refreshing.")
             # Refresh the token if it's expired
             token_dict = self.oauth_object.refresh_access_token(token_dict['refresh_token'])
-        return spotipy.Spotify(auth=token_dict['access_token'])
+        spotify = spotipy.Spotify(auth=token_dict['access_token'], requests_session=self.session)
+        if SPOTIFY_API_PREFIX:
+            spotify.prefix = SPOTIFY_API_PREFIX
+        return spotify
 
     async def async_init(self):
         self.spotifyObject = self.authenticate_client()
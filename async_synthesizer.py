@@ -1,43 +1,108 @@
 #async_synthesizer.py
 
 import asyncio
+import io
 import os
 import sys
 import re
+import time
+from typing import Iterator, List, Optional, Union
+from xml.sax.saxutils import escape
 from google.cloud import texttospeech_v1
 import pyaudio
 from configure import sentences
+import usage
+import cassette
 import numpy as np
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.texttospeech_v1.services.text_to_speech.transports.rest import TextToSpeechRestTransport
+try:
+    import av  # Optional: only needed to decode OGG_OPUS or MP3 speech
+except ImportError:
+    av = None
 
 # Set the path to your Google Cloud credentials JSON file using an environment variable
-os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = os.environ.get("GOOGLE_CREDENTIALS_PATH")
+if os.environ.get("GOOGLE_CREDENTIALS_PATH"):
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = os.environ.get("GOOGLE_CREDENTIALS_PATH")
+# Optional plain-HTTP REST endpoint (host:port) for a local TTS stand-in, used by benchmarks and tests
+TTS_API_ENDPOINT = os.environ.get("TTS_API_ENDPOINT")
+# LINEAR16 (uncompressed), or OGG_OPUS / MP3 to keep speech compressed until just before playback
+TTS_AUDIO_ENCODING = os.environ.get("TTS_AUDIO_ENCODING", "LINEAR16")
+COMPRESSED_ENCODINGS = ("OGG_OPUS", "MP3")
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
 
 # Set event loop policy on Windows for Python 3.8+
 if sys.platform.startswith('win'):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+def create_tts_client(endpoint=TTS_API_ENDPOINT) -> texttospeech_v1.TextToSpeechClient:
+    """Creates the Google TTS client, or a REST client for a local unauthenticated endpoint if one is given."""
+    def create():
+        if endpoint:
+            transport = TextToSpeechRestTransport(host=endpoint, url_scheme='http', credentials=AnonymousCredentials())
+            return texttospeech_v1.TextToSpeechClient(transport=transport)
+        return texttospeech_v1.TextToSpeechClient()
+    # Records or replays through the active cassette, if one is in use
+    return cassette.tts_client(create)
+
 class AsyncAudioSynthesizer:
-    def __init__(self):
-        self.tts_client = texttospeech_v1.TextToSpeechClient()
+    # Fragment coalescing: once enough audio is buffered ahead of playback, short queued sentences are
+    # sent as one TTS request, joined with SSML breaks ('ssml') or plain spaces ('text').
+    SHORT_FRAGMENT_CHARS = 80
+    MAX_COALESCED_CHARS = 400
+    MAX_COALESCE_WAIT = 0.5
+    COALESCE_SAFETY_MARGIN = 0.15
+    SENTENCE_BREAK = '250ms'
+
+    def __init__(self, tts_client=None, play_audio=True, coalesce_mode: Optional[str] = 'ssml',
+                 audio_encoding: str = TTS_AUDIO_ENCODING):
+        # Server sessions share one TTS client and drain audio_queue themselves instead of playing locally
+        self.tts_client = tts_client or create_tts_client()
         self.audio_format = pyaudio.paInt16  # Typical for PCM 16-bit
         self.channels = 1  # Mono audio
         self.rate = 16000  # Sample rate, adjust based on the TTS output
+        if audio_encoding in COMPRESSED_ENCODINGS and av is None:
+            print(f"PyAV is not installed, so {audio_encoding} speech can't be decoded; using LINEAR16")
+            audio_encoding = "LINEAR16"
+        # Compressed speech stays compressed in audio_queue and is decoded while it plays
+        self.audio_encoding = audio_encoding
         self.audio_queue = asyncio.Queue()
         self.sentence_queue = asyncio.Queue()  # Queue for sentences to be synthesized
-        self.p = pyaudio.PyAudio()
         self.done_flag = True
-        
-        # Open the stream here and keep it open
-        self.stream = self.p.open(format=self.audio_format, channels=self.channels,
-                                  rate=self.rate, output=True)
-        
-        self.playing_task = asyncio.create_task(self.play_from_queue())
+        # Bumped by interrupt(); audio synthesized or queued under an older generation is discarded
+        self.generation = 0
+        self.playback_chunk_frames = self.rate // 50  # 20 ms, so playback can stop almost immediately
+        self.is_playing = False
+        self.p = None
+        self.stream = None
+        self.playing_task = None
+        self.coalesce_mode = coalesce_mode
+        self.held_fragment = None  # Taken off sentence_queue but too long to join the previous request
+        self.playback_ends_at = 0.0  # Loop time at which the audio queued so far will have finished playing
+        self.synthesis_latency = 0.3  # Smoothed TTS request time, seeded with a typical value
+        self.requests_sent = 0
+        self.fragments_synthesized = 0
+        # Usage counters of the turn whose sentences are queued; the worker task runs outside the turn's context
+        self.usage = None
+
+        if play_audio:
+            self.p = pyaudio.PyAudio()
+            # Open the stream here and keep it open
+            self.stream = self.p.open(format=self.audio_format, channels=self.channels,
+                                      rate=self.rate, output=True)
+            self.playing_task = asyncio.create_task(self.play_from_queue())
+
         self.synthesizing_task = asyncio.create_task(self.synthesize_from_queue())
 
-    def _prepare_synthesis_input(self, text: str) -> texttospeech_v1.SynthesisInput:
-        cleaned_text = self._clean_text(text)
-        print(cleaned_text)
-        return texttospeech_v1.SynthesisInput(text=cleaned_text)
+    def _prepare_synthesis_input(self, fragments: List[str]) -> texttospeech_v1.SynthesisInput:
+        cleaned_fragments = [self._clean_text(fragment).strip() for fragment in fragments]
+        print(' '.join(cleaned_fragments))
+        if len(cleaned_fragments) > 1 and self.coalesce_mode == 'ssml':
+            pause = f'<break time="{self.SENTENCE_BREAK}"/>'
+            return texttospeech_v1.SynthesisInput(
+                ssml=f"<speak>{pause.join(escape(fragment) for fragment in cleaned_fragments)}</speak>")
+        return texttospeech_v1.SynthesisInput(text=' '.join(cleaned_fragments))
 
     def _select_voice(self) -> texttospeech_v1.VoiceSelectionParams:
         # Here we specify the studio voice 'en-GB-Studio-C'
@@ -49,71 +114,234 @@ class AsyncAudioSynthesizer:
 
     def _configure_audio_settings(self) -> texttospeech_v1.AudioConfig:
         return texttospeech_v1.AudioConfig(
-            audio_encoding=texttospeech_v1.AudioEncoding.LINEAR16,
+            audio_encoding=texttospeech_v1.AudioEncoding[self.audio_encoding],
             sample_rate_hertz=self.rate
         )
 
+    @property
+    def compressed(self) -> bool:
+        return self.audio_encoding in COMPRESSED_ENCODINGS
+
     
 
 
-    async def synthesize_speech(self, text: str) -> bytes:
-        synthesis_input = self._prepare_synthesis_input(text)
+    async def synthesize_speech(self, text: Union[str, List[str]], smoothing: float = 0.2) -> bytes:
+        generation = self.generation
+        fragments = [text] if isinstance(text, str) else text
+        synthesis_input = self._prepare_synthesis_input(fragments)
         voice = self._select_voice()
         audio_config = self._configure_audio_settings()
 
         try:
+            usage.record("tts", self.usage, calls=1, characters=len(synthesis_input.ssml or synthesis_input.text))
+            start_time = time.perf_counter()
             response = await asyncio.to_thread(
                 self.tts_client.synthesize_speech,
                 input=synthesis_input,
                 voice=voice,
                 audio_config=audio_config
             )
+            self.synthesis_latency += smoothing * (time.perf_counter() - start_time - self.synthesis_latency)
+            self.requests_sent += 1
+            self.fragments_synthesized += len(fragments)
 
             audio_content = response.audio_content
-            # Apply fade in and fade out effects
-            faded_audio_content = self.apply_fade_effects(audio_content)
-            await self.audio_queue.put(faded_audio_content)
+            usage.record("tts", self.usage, audio_bytes=len(audio_content))
+            if generation != self.generation:
+                return  # Interrupted while the request was in flight
+            if self.compressed:
+                # Fades are applied as it is decoded for playback
+                queued_audio, seconds = audio_content, self.compressed_duration(audio_content)
+            else:
+                # Apply fade in and fade out effects
+                queued_audio = self.apply_fade_effects(audio_content)
+                seconds = len(queued_audio) / (2 * self.rate)
+            now = asyncio.get_running_loop().time()
+            self.playback_ends_at = max(now, self.playback_ends_at) + seconds
+            await self.audio_queue.put(queued_audio)
         except Exception as e:
             print(f"Error synthesizing speech: {e}")
 
+    def buffered_audio_seconds(self) -> float:
+        """Roughly how much synthesized audio is still ahead of the listener."""
+        return max(0.0, self.playback_ends_at - asyncio.get_running_loop().time())
+
+    def coalescing_slack(self) -> float:
+        # Time we can spend gathering fragments and still have the next request back before the buffer runs dry
+        return self.buffered_audio_seconds() - self.synthesis_latency - self.COALESCE_SAFETY_MARGIN
+
+    async def collect_fragments(self, fragments: List[str]):
+        """
+        Adds further short fragments to this request while the buffered audio covers it. The first
+        fragment of an utterance finds nothing buffered, so it always goes out alone.
+        """
+        total_chars = len(fragments[0])
+        if total_chars > self.SHORT_FRAGMENT_CHARS:
+            return
+        while total_chars < self.MAX_COALESCED_CHARS:
+            slack = self.coalescing_slack()
+            if slack <= 0:
+                return
+            if self.sentence_queue.empty():
+                try:
+                    fragment = await asyncio.wait_for(self.sentence_queue.get(), timeout=min(slack, self.MAX_COALESCE_WAIT))
+                except asyncio.TimeoutError:
+                    return
+            else:
+                fragment = self.sentence_queue.get_nowait()
+            if total_chars + len(fragment) > self.MAX_COALESCED_CHARS:
+                self.held_fragment = fragment
+                return
+            fragments.append(fragment)
+            total_chars += len(fragment)
+            if len(fragment) > self.SHORT_FRAGMENT_CHARS:
+                return
+
     def apply_fade_effects(self, audio_content: bytes, fade_duration=0.1) -> bytes:
         # Convert bytes to numpy array for manipulation
         # Ensure the array is writable by making a copy
         audio_array = np.frombuffer(audio_content, dtype=np.int16).copy()
 
-        # Calculate fade in and fade out samples count
-        fade_in_samples = fade_out_samples = int(self.rate * fade_duration)
-
-        # Apply fade in
-        for i in range(fade_in_samples):
-            audio_array[i] = int(audio_array[i] * (i / fade_in_samples))
-
-        # Apply fade out
-        for i in range(fade_out_samples):
-            audio_array[-i - 1] = int(audio_array[-i - 1] * (i / fade_out_samples))
+        # Calculate fade in and fade out samples count; clips shorter than both fades share them
+        fade_samples = min(int(self.rate * fade_duration), len(audio_array) // 2)
+        if fade_samples:
+            ramp = np.arange(fade_samples) / fade_samples
+            audio_array[:fade_samples] = (audio_array[:fade_samples] * ramp).astype(np.int16)
+            audio_array[-fade_samples:] = (audio_array[-fade_samples:] * ramp[::-1]).astype(np.int16)
 
         # Convert numpy array back to bytes
         return audio_array.tobytes()
 
+    def compressed_duration(self, audio_content: bytes) -> float:
+        """Playing time of compressed speech from its container, without decoding it."""
+        try:
+            with av.open(io.BytesIO(audio_content)) as container:
+                if container.duration:
+                    return container.duration / av.time_base
+        except av.error.FFmpegError:
+            pass
+        return len(audio_content) * 8 / 32000  # Typical speech bitrate
+
+    def decode_blocks(self, audio_content: bytes) -> Iterator[np.ndarray]:
+        """Decodes compressed speech frame by frame into 16-bit mono PCM at self.rate."""
+        resampler = av.AudioResampler(format='s16', layout='mono', rate=self.rate)
+        with av.open(io.BytesIO(audio_content)) as container:
+            for frame in container.decode(audio=0):
+                for resampled in resampler.resample(frame):
+                    yield resampled.to_ndarray().reshape(-1)
+            for resampled in resampler.resample(None):
+                yield resampled.to_ndarray().reshape(-1)
+
+    def playback_chunks(self, audio_content: bytes, fade_duration=0.1) -> Iterator[bytes]:
+        """
+        Splits one queued item into playback-sized PCM chunks. Compressed speech is decoded only as
+        far as the next chunk needs, with the fades applied on the way; the last fade_duration is held
+        back until the end of the stream is known.
+        """
+        chunk_samples = self.playback_chunk_frames
+        if not self.compressed:
+            for offset in range(0, len(audio_content), chunk_samples * 2):
+                yield audio_content[offset:offset + chunk_samples * 2]
+            return
+
+        fade_samples = int(self.rate * fade_duration)
+        fade_in = np.arange(fade_samples) / fade_samples
+        pending = np.empty(0, dtype=np.int16)
+        position = 0  # Samples already yielded
+        for block in self.decode_blocks(audio_content):
+            pending = np.concatenate((pending, block))
+            while len(pending) - fade_samples >= chunk_samples:
+                chunk, pending = pending[:chunk_samples].copy(), pending[chunk_samples:]
+                if position < fade_samples:
+                    ramp = fade_in[position:position + chunk_samples]
+                    chunk[:len(ramp)] = (chunk[:len(ramp)] * ramp).astype(np.int16)
+                position += chunk_samples
+                yield chunk.tobytes()
+        if len(pending):
+            # Whatever is left falls within the fade out (and, for very short clips, the fade in)
+            tail = pending.copy()
+            if position < fade_samples:
+                ramp = fade_in[position:position + len(tail)]
+                tail[:len(ramp)] = (tail[:len(ramp)] * ramp).astype(np.int16)
+            tail = (tail * (np.arange(len(tail), 0, -1) - 1) / len(tail)).astype(np.int16)
+            for offset in range(0, len(tail), chunk_samples):
+                yield tail[offset:offset + chunk_samples].tobytes()
+
+    def play_next_chunk(self, chunks: Iterator[bytes]) -> bool:
+        """Runs in a worker thread: decodes (if needed) and writes the next chunk; False at the end."""
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        self.stream.write(chunk)
+        return True
+
 
 
 
     async def play_from_queue(self):
         while True:
             audio_content = await self.audio_queue.get()
+            generation = self.generation
+            self.is_playing = True
             try:
-                self.stream.write(audio_content)
+                # Write in small pieces off the loop thread so an interrupt takes effect between pieces
+                chunks = self.playback_chunks(audio_content)
+                while generation == self.generation:
+                    if not await asyncio.to_thread(self.play_next_chunk, chunks):
+                        break
+                chunks.close()  # Releases the decoder of an interrupted item
             except Exception as e:
                 print(f"Error playing audio: {e}")
             finally:
+                self.is_playing = False
                 self.audio_queue.task_done()
             
 
     async def synthesize_from_queue(self):
         while True:
-            sentence = await self.sentence_queue.get()
-            await self.synthesize_speech(sentence)
+            if self.held_fragment is not None:
+                fragments, self.held_fragment = [self.held_fragment], None
+            else:
+                fragments = [await self.sentence_queue.get()]
+            try:
+                if self.coalesce_mode:
+                    await self.collect_fragments(fragments)
+                await self.synthesize_speech(fragments)
+            finally:
+                for _ in fragments:
+                    self.sentence_queue.task_done()
+
+    def is_busy(self) -> bool:
+        return (self.is_playing or self.held_fragment is not None
+                or not self.sentence_queue.empty() or not self.audio_queue.empty())
+
+    def stats(self):
+        return {
+            "tts_requests": self.requests_sent,
+            "fragments": self.fragments_synthesized,
+            "fragments_per_request": self.fragments_synthesized / self.requests_sent if self.requests_sent else 0.0,
+            "synthesis_latency": self.synthesis_latency,
+        }
+
+    def interrupt(self):
+        """
+        Barge-in: drops queued sentences and audio, abandons the in-flight synthesis request
+        and stops playback within one playback chunk.
+        """
+        self.generation += 1
+        self.playback_ends_at = 0.0
+        if self.held_fragment is not None:
+            self.held_fragment = None
             self.sentence_queue.task_done()
+        for pending in (self.sentence_queue, self.audio_queue):
+            while not pending.empty():
+                pending.get_nowait()
+                pending.task_done()
+        # Restarting the worker stops it waiting on the current request; its late result is discarded
+        self.synthesizing_task.cancel()
+        self.synthesizing_task = asyncio.create_task(self.synthesize_from_queue())
+        self.done_flag = True
+
     def _clean_text(self, text: str) -> str:
         # Regular expression to match emojis and other non-ASCII characters; you might need to adjust it
         emoji_pattern = re.compile("["
@@ -133,7 +361,33 @@ class AsyncAudioSynthesizer:
         return cleaned_text
         
     def enqueue_sentence(self, sentence: str):
-        asyncio.create_task(self.sentence_queue.put(sentence))
+        # The queue is unbounded, so put synchronously; a queued put task could land after interrupt()
+        self.usage = usage.current()
+        self.sentence_queue.put_nowait(sentence)
+
+    async def speak_stream(self, chunks) -> str:
+        """
+        Enqueues a stream of text chunks sentence by sentence as they arrive.
+
+        Returns:
+        - The full text, once the stream is exhausted.
+        """
+        text = ""
+        pending = ""
+        async for chunk in chunks:
+            text += chunk
+            pending += chunk
+            *sentences, pending = SENTENCE_BOUNDARY.split(pending)
+            # A chunk that ends a sentence is spoken right away rather than waiting for the next token
+            if pending.rstrip().endswith(('.', '!', '?')):
+                sentences.append(pending)
+                pending = ""
+            for sentence in sentences:
+                if sentence.strip():
+                    self.enqueue_sentence(sentence.strip())
+        if pending.strip():
+            self.enqueue_sentence(pending.strip())
+        return text
 
     def close(self):
         if self.playing_task:
@@ -143,7 +397,8 @@ class AsyncAudioSynthesizer:
         if self.stream:
             self.stream.stop_stream()
             self.stream.close()
-        self.p.terminate()
+        if self.p:
+            self.p.terminate()
 
 async def main():
     synthesizer = AsyncAudioSynthesizer()
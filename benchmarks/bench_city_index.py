@@ -0,0 +1,66 @@
+#benchmarks/bench_city_index.py
+#
+# ZIP -> city and nearest-city lookups from the in-memory CityIndex, compared with the
+# equivalent SQL against uscities.db.
+#
+# python -m benchmarks.bench_city_index --lookups 5000
+
+import argparse
+import random
+import sqlite3
+import time
+from city_index import CityIndex
+
+
+def time_per_call(function, arguments):
+    start_time = time.perf_counter()
+    for argument in arguments:
+        function(*argument)
+    return (time.perf_counter() - start_time) / len(arguments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CityIndex lookup benchmark")
+    parser.add_argument("--db", default="uscities.db")
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--sql-lookups", type=int, default=200, help="SQL is slow; time fewer of those")
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    start_time = time.perf_counter()
+    index = CityIndex(args.db)
+    print(f"Build: {(time.perf_counter() - start_time) * 1000:.0f} ms for {len(index.records)} places, "
+          f"{len(index.zip_index)} ZIPs, {len(index.nodes)} KD-tree nodes")
+
+    zip_codes = rng.choices(list(index.zip_index), k=args.lookups)
+    # Random points inside the contiguous US, plus points jittered around real places
+    points = [(rng.uniform(25.0, 49.0), rng.uniform(-124.0, -67.0)) for _ in range(args.lookups // 2)]
+    points += [(record.latitude + rng.uniform(-0.2, 0.2), record.longitude + rng.uniform(-0.2, 0.2))
+               for record in rng.choices(index.records, k=args.lookups - len(points))]
+
+    zip_time = time_per_call(index.lookup_zip, [(zip_code,) for zip_code in zip_codes])
+    nearest_time = time_per_call(index.nearest, points)
+
+    connection = sqlite3.connect(args.db)
+    try:
+        def sql_zip(zip_code):
+            return connection.execute(
+                "SELECT city_ascii, state_name FROM uscities WHERE ' ' || zips || ' ' LIKE ? ORDER BY ranking LIMIT 1",
+                (f"% {zip_code} %",)).fetchone()
+
+        def sql_nearest(latitude, longitude):
+            return connection.execute(
+                "SELECT city_ascii, state_name FROM uscities ORDER BY (lat - ?) * (lat - ?) + (lng - ?) * (lng - ?) LIMIT 1",
+                (latitude, latitude, longitude, longitude)).fetchone()
+
+        sql_zip_time = time_per_call(sql_zip, [(zip_code,) for zip_code in zip_codes[:args.sql_lookups]])
+        sql_nearest_time = time_per_call(sql_nearest, points[:args.sql_lookups])
+    finally:
+        connection.close()
+
+    print(f"{'lookup':<10} {'index us':>10} {'sql us':>10} {'speedup':>9}")
+    print(f"{'zip':<10} {zip_time * 1e6:>10.2f} {sql_zip_time * 1e6:>10.0f} {sql_zip_time / zip_time:>8.0f}x")
+    print(f"{'nearest':<10} {nearest_time * 1e6:>10.2f} {sql_nearest_time * 1e6:>10.0f} {sql_nearest_time / nearest_time:>8.0f}x")
+
+if __name__ == "__main__":
+    main()
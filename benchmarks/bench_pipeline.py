@@ -0,0 +1,234 @@
+#benchmarks/bench_pipeline.py
+#
+# End-to-end load and latency benchmark. Runs process_query_with_assistant and the tool
+# functions against the local stand-ins in fake_services.py at a controlled concurrency and
+# reports throughput, time-to-first-token, time-to-first-audio and turn latency percentiles.
+#
+# python -m benchmarks.bench_pipeline --concurrency 8 --turns 5 --json results.json
+#
+# With --record the provider responses are saved to a cassette (see cassette.py); --replay runs
+# the same turns from the cassette without starting the stand-ins, so runs on different commits
+# see identical provider timing.
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+from typing import Dict, List
+import spotipy
+from openai import AsyncOpenAI
+from benchmarks.fake_services import FakeServiceConfig, FakeServices
+
+# Spotify OAuth refuses to construct without credentials; the stand-in never checks them
+for name in ("SPOTIFY_USERNAME", "SPOTIFY_CLIENT_ID", "SPOTIFY_CLIENT_SECRET", "OPENAI_API_KEY", "GROQ_API_KEY"):
+    os.environ.setdefault(name, "benchmark")
+
+from assistant_gpt import GPTAssistant
+from async_spotify import AsyncSpotifyClient
+from async_synthesizer import AsyncAudioSynthesizer, create_tts_client
+from main import process_query_with_assistant, register_tools, run_function_async
+from rate_limiter import scheduler
+import cassette
+import usage
+from weather import WeatherAPI
+
+# Placeholder endpoints for replay; nothing is listening and nothing needs to be
+REPLAY_ENVIRONMENT = {
+    "OPENAI_BASE_URL": "http://replay.invalid/v1",
+    "GROQ_BASE_URL": "http://replay.invalid/v1",
+    "NWS_BASE_URL": "http://replay.invalid",
+    "SPOTIFY_API_PREFIX": "http://replay.invalid/v1/",
+    "TTS_API_ENDPOINT": "replay.invalid",
+}
+
+QUERIES = [
+    "Tell me a joke.",
+    "What's the weather like in Boise, Idaho?",
+    "Play Happiness by Ahssake.",
+    "How are you doing today?",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+class TurnProbe:
+    def __init__(self, query: str):
+        self.query = query
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.first_audio = None
+        self.end = None
+        self.error = None
+
+
+async def run_session(session_id: int, turns: int, model: str, openai_client, tts_client, probes: List[TurnProbe],
+                      session_usage: usage.SessionUsage):
+    assistant = GPTAssistant(ai_model=model, openai_client=openai_client)
+    synthesizer = AsyncAudioSynthesizer(tts_client=tts_client, play_audio=False)
+    current = {"probe": None}
+
+    original_get_response = assistant.get_response_from_openai
+
+    async def timed_get_response(turn=None):
+        async for chunk in original_get_response(turn):
+            probe = current["probe"]
+            if probe.first_token is None:
+                probe.first_token = time.perf_counter()
+            yield chunk
+
+    assistant.get_response_from_openai = timed_get_response
+
+    async def drain_audio():
+        while True:
+            await synthesizer.audio_queue.get()
+            probe = current["probe"]
+            if probe is not None and probe.first_audio is None:
+                probe.first_audio = time.perf_counter()
+            synthesizer.audio_queue.task_done()
+
+    drain_task = asyncio.create_task(drain_audio())
+    try:
+        for turn_index in range(turns):
+            probe = TurnProbe(QUERIES[(session_id + turn_index) % len(QUERIES)])
+            current["probe"] = probe
+            try:
+                with usage.track_turn(session_usage, label=probe.query):
+                    await process_query_with_assistant(assistant, probe.query, synthesizer)
+                    await synthesizer.sentence_queue.join()
+                    await synthesizer.audio_queue.join()
+            except Exception as e:
+                probe.error = repr(e)
+            probe.end = time.perf_counter()
+            probes.append(probe)
+    finally:
+        drain_task.cancel()
+        synthesizer.close()
+
+
+async def run_tool_calls(concurrency: int, calls: int) -> Dict[str, List[float]]:
+    latencies: Dict[str, List[float]] = {"get_weather_information": [], "search_and_play_song": []}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed_call(function_name, arguments, query):
+        async with semaphore:
+            start_time = time.perf_counter()
+            await run_function_async(function_name, arguments, query)
+            latencies[function_name].append(time.perf_counter() - start_time)
+
+    tasks = []
+    for index in range(calls):
+        tasks.append(timed_call("get_weather_information", {"city": "Boise", "state": "Idaho"}, "Will it rain tomorrow?"))
+        tasks.append(timed_call("search_and_play_song", {"song_name": "Happiness", "artist_name": "Ahssake"}, ""))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def summarize(name: str, values: List[float]) -> Dict[str, float]:
+    return {
+        "metric": name, "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000, "p90_ms": percentile(values, 90) * 1000,
+        "p99_ms": percentile(values, 99) * 1000, "max_ms": max(values) * 1000 if values else float("nan"),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark against local service stand-ins")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent sessions")
+    parser.add_argument("--turns", type=int, default=5, help="Turns per session")
+    parser.add_argument("--model", default="gpt-4-turbo-preview")
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    parser.add_argument("--chunk-interval", type=float, default=0.03, help="Seconds between streamed tokens")
+    parser.add_argument("--tts-latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Error rate injected into every service")
+    parser.add_argument("--json", help="Write the summary to this file for comparison across commits")
+    parser.add_argument("--usage-log", default="", help="Also append per-turn usage lines to this file")
+    parser.add_argument("--record", help="Save the stand-ins' responses and timing to this cassette")
+    parser.add_argument("--replay", help="Serve every provider response from this cassette instead")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="Replay pace multiplier; 0 means no waiting")
+    args = parser.parse_args()
+    usage.usage_log.path = args.usage_log
+    if args.record or args.replay:
+        cassette.use(cassette.Cassette(args.record or args.replay, "record" if args.record else "replay", args.replay_speed))
+
+    configs = {
+        "openai": FakeServiceConfig(latency=args.openai_latency, chunk_interval=args.chunk_interval, error_rate=args.error_rate),
+        "groq": FakeServiceConfig(latency=0.4, error_rate=args.error_rate),
+        "nws": FakeServiceConfig(latency=0.15, error_rate=args.error_rate),
+        "spotify": FakeServiceConfig(latency=0.1, error_rate=args.error_rate),
+        "tts": FakeServiceConfig(latency=args.tts_latency, error_rate=args.error_rate),
+    }
+    services = None if args.replay else FakeServices(configs)
+    if services:
+        await services.start()
+    environment = services.environment() if services else REPLAY_ENVIRONMENT
+
+    openai_client = AsyncOpenAI(api_key="benchmark", base_url=environment["OPENAI_BASE_URL"],
+                                http_client=cassette.http_client("openai"))
+    tts_client = create_tts_client(environment["TTS_API_ENDPOINT"])
+    weather_api = WeatherAPI(groq_base_url=environment["GROQ_BASE_URL"], nws_base_url=environment["NWS_BASE_URL"])
+    spotify_client = AsyncSpotifyClient()
+    spotify_client.spotifyObject = spotipy.Spotify(auth="benchmark", requests_session=spotify_client.session)
+    spotify_client.spotifyObject.prefix = environment["SPOTIFY_API_PREFIX"]
+    spotify_client.device_id = "fake-device"
+    register_tools(weather_api, spotify_client)
+
+    probes: List[TurnProbe] = []
+    sessions = [usage.SessionUsage(session_id) for session_id in range(args.concurrency)]
+    try:
+        start_time = time.perf_counter()
+        await asyncio.gather(*(run_session(session.session_id, args.turns, args.model, openai_client, tts_client, probes, session)
+                               for session in sessions))
+        wall_time = time.perf_counter() - start_time
+        tool_latencies = await run_tool_calls(args.concurrency, args.turns)
+    finally:
+        await weather_api.close()
+        if services:
+            await services.stop()
+        if cassette.active:
+            cassette.active.save()
+
+    completed = [probe for probe in probes if probe.error is None]
+    rows = [
+        summarize("time_to_first_token", [p.first_token - p.start for p in completed if p.first_token]),
+        summarize("time_to_first_audio", [p.first_audio - p.start for p in completed if p.first_audio]),
+        summarize("turn_latency", [p.end - p.start for p in completed]),
+    ] + [summarize(f"tool:{name}", values) for name, values in tool_latencies.items()]
+
+    print(f"\n{len(probes)} turns, {args.concurrency} concurrent sessions, {len(probes) - len(completed)} errors, "
+          f"{len(completed) / wall_time:.2f} turns/s")
+    print(f"{'metric':<32} {'count':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for row in rows:
+        print(f"{row['metric']:<32} {row['count']:>6} {row['p50_ms']:>9.1f} {row['p90_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+    if services:
+        print(f"Requests served: {services.request_counts()}")
+    if cassette.active:
+        print(f"Cassette: {cassette.active.stats()}")
+    for provider, stats in scheduler.stats().items():
+        delays = stats["queue_delay"]["interactive"]
+        print(f"Scheduler {provider}: queue delay p95 {delays['p95_ms']:.1f} ms, max {delays['max_ms']:.1f} ms, "
+              f"{stats['retries']} retries, {stats['throttled']} throttled")
+    turn_usage = usage.UsageCounters()
+    for session in sessions:
+        turn_usage.merge(session.totals)
+    for provider, counters in turn_usage.snapshot().items():
+        print(f"Usage {provider} per turn: " + ", ".join(f"{name} {value / len(probes):.1f}" for name, value in counters.items()))
+    for probe in probes:
+        if probe.error:
+            print(f"Error in {probe.query!r}: {probe.error}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "wall_time": wall_time, "turns": len(probes),
+                       "errors": len(probes) - len(completed), "throughput": len(completed) / wall_time,
+                       "metrics": rows, "requests": services.request_counts() if services else {},
+                       "scheduler": scheduler.stats(), "usage": turn_usage.snapshot()}, f, indent=2)
+
+if __name__ == "__main__":
+    asyncio.run(main())
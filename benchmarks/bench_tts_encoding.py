@@ -0,0 +1,83 @@
+#benchmarks/bench_tts_encoding.py
+#
+# LINEAR16 against OGG_OPUS and MP3 speech from the TTS stand-in: bytes transferred, bytes held in
+# audio_queue, decode CPU per second of audio and time-to-first-audio (request sent to the first
+# playback chunk ready for the sound card) over a link of the given bandwidth.
+#
+# python -m benchmarks.bench_tts_encoding --sentences 20 --bandwidth 200000
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+from async_synthesizer import AsyncAudioSynthesizer, create_tts_client
+from benchmarks.fake_services import FakeServiceConfig, FakeTextToSpeechService
+
+SENTENCES = [
+    "It's sixty two degrees in Boise right now with a light breeze from the northwest.",
+    "Tomorrow looks sunny.",
+    "There's a forty percent chance of rain on Thursday afternoon, so you may want an umbrella.",
+    "Playing Happiness by Ahssake.",
+]
+
+
+def median(values: List[float]) -> float:
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2] if ordered else float("nan")
+
+
+async def run_encoding(encoding: str, endpoint: str, service: FakeTextToSpeechService, sentences: int) -> Dict[str, float]:
+    synthesizer = AsyncAudioSynthesizer(tts_client=create_tts_client(endpoint), play_audio=False,
+                                        audio_encoding=encoding, coalesce_mode=None)
+    bytes_before = service.bytes_sent
+    first_audio, queued_bytes, pcm_seconds, decode_cpu = [], 0, 0.0, 0.0
+    try:
+        for index in range(sentences):
+            start_time = time.perf_counter()
+            synthesizer.enqueue_sentence(SENTENCES[index % len(SENTENCES)])
+            audio_content = await synthesizer.audio_queue.get()
+            queued_bytes += len(audio_content)
+
+            cpu_start = time.process_time()
+            chunks = synthesizer.playback_chunks(audio_content)
+            first_chunk = next(chunks)
+            first_audio.append(time.perf_counter() - start_time)
+            pcm_bytes = len(first_chunk) + sum(len(chunk) for chunk in chunks)
+            decode_cpu += time.process_time() - cpu_start
+            pcm_seconds += pcm_bytes / (2 * synthesizer.rate)
+            synthesizer.audio_queue.task_done()
+    finally:
+        synthesizer.close()
+    return {
+        "encoding": encoding,
+        "transfer_kb": (service.bytes_sent - bytes_before) / 1024,
+        "queued_kb_per_s": queued_bytes / 1024 / pcm_seconds,
+        "decode_cpu_ms_per_s": decode_cpu * 1000 / pcm_seconds,
+        "first_audio_ms": median(first_audio) * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="TTS audio encoding benchmark against the local stand-in")
+    parser.add_argument("--sentences", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="Stand-in TTS latency in seconds")
+    parser.add_argument("--bandwidth", type=float, default=250_000, help="Download bytes per second; 0 for unlimited")
+    parser.add_argument("--encodings", nargs="+", default=["LINEAR16", "OGG_OPUS", "MP3"])
+    args = parser.parse_args()
+
+    service = FakeTextToSpeechService("tts", FakeServiceConfig(latency=args.latency, jitter=0.0),
+                                      bandwidth=args.bandwidth or None)
+    await service.start()
+    try:
+        rows = [await run_encoding(encoding, f"127.0.0.1:{service.port}", service, args.sentences)
+                for encoding in args.encodings]
+    finally:
+        await service.stop()
+
+    print(f"\n{'encoding':<10} {'transfer KB':>12} {'queued KB/s':>12} {'decode ms/s':>12} {'first audio ms':>15}")
+    for row in rows:
+        print(f"{row['encoding']:<10} {row['transfer_kb']:>12.1f} {row['queued_kb_per_s']:>12.1f} "
+              f"{row['decode_cpu_ms_per_s']:>12.2f} {row['first_audio_ms']:>15.1f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+#benchmarks/bench_wake_engine.py
+#
+# How many concurrent 16 kHz streams can one host run wake word detection on?
+# Feeds synthetic audio into MultiStreamWakeWordEngine at real-time rate and reports,
+# per stream count, whether the worker pool kept up.
+#
+# python -m benchmarks.bench_wake_engine --model path/to/jarvis.tflite --workers 4
+
+import argparse
+import asyncio
+import os
+import time
+import numpy as np
+from wake_engine import MultiStreamWakeWordEngine
+
+
+async def run_streams(model_path, num_streams, num_workers, duration, inference_framework):
+    engine = MultiStreamWakeWordEngine(model_path=model_path, num_streams=num_streams, num_workers=num_workers,
+                                       inference_framework=inference_framework)
+    engine.start()
+    await engine.wait_until_ready()
+
+    rng = np.random.default_rng(0)
+    # Low-level noise: realistic inference cost without triggering detections
+    frames = rng.normal(0, 300, size=(num_streams, 16, engine.chunk_size)).astype(np.int16)
+    frame_interval = engine.chunk_size / engine.rate
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    late_ticks = 0
+
+    for tick in range(int(duration / frame_interval)):
+        for stream_id in range(num_streams):
+            engine.feed(stream_id, frames[stream_id, tick % frames.shape[1]])
+        next_tick += frame_interval
+        delay = next_tick - loop.time()
+        if delay < 0:
+            late_ticks += 1
+        await asyncio.sleep(max(0.0, delay))
+
+    # Let the workers drain what is already in the rings
+    await asyncio.sleep(4 * frame_interval)
+    await engine.stop()
+    stats = engine.stats()
+    stats["late_ticks"] = late_ticks
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default=os.environ.get("WAKE_WORD_MODEL_PATH"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of audio per stream count")
+    parser.add_argument("--max-streams", type=int, default=256)
+    parser.add_argument("--framework", default="tflite")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.workers} workers, {args.duration:.0f}s of audio per run")
+    print(f"{'streams':>8} {'fed':>8} {'processed':>10} {'dropped':>8} {'backlog':>8} {'RTF/stream':>11}  result")
+
+    num_streams, sustained = 1, 0
+    while num_streams <= args.max_streams:
+        start_time = time.perf_counter()
+        stats = await run_streams(args.model, num_streams, args.workers, args.duration, args.framework)
+        audio_seconds = stats["frames_processed"] * 0.08
+        real_time_factor = stats["inference_seconds"] / audio_seconds if audio_seconds else float("inf")
+        ok = (stats["frames_dropped"] == 0 and stats["frames_processed"] >= stats["frames_written"] - num_streams
+              and stats["late_ticks"] == 0)
+        print(f"{num_streams:>8} {stats['frames_written']:>8} {stats['frames_processed']:>10} {stats['frames_dropped']:>8} "
+              f"{stats['max_backlog_frames']:>8} {real_time_factor:>11.4f}  {'ok' if ok else 'FALLING BEHIND'} "
+              f"({time.perf_counter() - start_time:.1f}s)")
+        if not ok:
+            break
+        sustained = num_streams
+        num_streams *= 2
+
+    print(f"Sustained {sustained} concurrent 16 kHz streams with {args.workers} workers on {os.cpu_count()} cores")
+
+if __name__ == "__main__":
+    asyncio.run(main())
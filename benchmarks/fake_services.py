@@ -0,0 +1,326 @@
+#benchmarks/fake_services.py
+#
+# Local stand-ins for OpenAI, Groq, api.weather.gov, Spotify and Google TTS, so the
+# pipeline can be load tested offline. Each service runs on its own port with its own
+# latency, streaming chunk timing and error rate.
+
+import asyncio
+import base64
+import io
+import json
+import random
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+import numpy as np
+from aiohttp import web
+try:
+    import av  # Only needed to serve OGG_OPUS or MP3 speech
+except ImportError:
+    av = None
+
+
+class FakeServiceConfig:
+    def __init__(self, latency=0.05, jitter=0.01, chunk_interval=0.02, error_rate=0.0, error_status=500, retry_after=1):
+        self.latency = latency  # Seconds before the first byte of the response
+        self.jitter = jitter  # Uniform +/- jitter added to latency
+        self.chunk_interval = chunk_interval  # Seconds between streamed chunks
+        self.error_rate = error_rate  # Fraction of requests answered with error_status
+        self.error_status = error_status
+        self.retry_after = retry_after  # Retry-After header sent with 429 errors
+
+    async def delay(self):
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def error_response(self) -> Optional[web.Response]:
+        if random.random() >= self.error_rate:
+            return None
+        headers = {"Retry-After": str(self.retry_after)} if self.error_status == 429 else {}
+        return web.json_response({"error": {"message": "Injected failure", "type": "server_error"}},
+                                 status=self.error_status, headers=headers)
+
+
+class FakeService:
+    """One aiohttp application on an ephemeral localhost port."""
+
+    def __init__(self, name: str, config: FakeServiceConfig):
+        self.name = name
+        self.config = config
+        self.app = web.Application(middlewares=[self.inject_faults])
+        self.runner = None
+        self.port = None
+        self.requests = 0
+
+    @web.middleware
+    async def inject_faults(self, request, handler):
+        self.requests += 1
+        await self.config.delay()
+        error = self.config.error_response()
+        if error is not None:
+            return error
+        return await handler(request)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+
+class FakeChatCompletions(FakeService):
+    """
+    OpenAI-compatible /v1/chat/completions, also used for Groq. Streams a tool call when the
+    last user message asks about weather or music and tools were offered, otherwise a short reply.
+    """
+
+    REPLY = ("Sure, here is a simulated answer from the stand-in model. "
+             "It is long enough to span a few sentences. That way sentence splitting and speech synthesis both get exercised.")
+
+    def __init__(self, name: str, config: FakeServiceConfig):
+        super().__init__(name, config)
+        self.app.router.add_post("/v1/chat/completions", self.chat_completions)
+
+    @staticmethod
+    def choose_tool_call(body: Dict) -> Optional[Dict]:
+        if not body.get("tools"):
+            return None
+        last = body["messages"][-1]
+        if last.get("role") != "user":
+            return None
+        text = str(last.get("content", "")).lower()
+        if "weather" in text:
+            return {"name": "get_weather_information", "arguments": json.dumps({"city": "Boise", "state": "Idaho"})}
+        if text.startswith("play"):
+            return {"name": "search_and_play_song", "arguments": json.dumps({"song_name": "Happiness", "artist_name": "Ahssake"})}
+        return None
+
+    @staticmethod
+    def chunk(body: Dict, delta: Dict, finish_reason=None) -> bytes:
+        payload = {
+            "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload)}\n\n".encode()
+
+    async def chat_completions(self, request: web.Request):
+        body = await request.json()
+        tool_call = self.choose_tool_call(body)
+        # Leading-space tokens like real models emit, so sentence-final tokens end with punctuation
+        words = [(" " if index else "") + word for index, word in enumerate(self.REPLY.split(" "))]
+        usage = {"prompt_tokens": len(json.dumps(body["messages"])) // 4, "completion_tokens": len(words),
+                 "total_tokens": len(json.dumps(body["messages"])) // 4 + len(words)}
+
+        if not body.get("stream"):
+            return web.json_response({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": self.REPLY}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(self.chunk(body, {"role": "assistant", "content": ""}))
+
+        if tool_call:
+            await response.write(self.chunk(body, {"tool_calls": [{"index": 0, "id": "call_fake", "type": "function",
+                                                                    "function": {"name": tool_call["name"], "arguments": ""}}]}))
+            arguments = tool_call["arguments"]
+            for start in range(0, len(arguments), 8):
+                await asyncio.sleep(self.config.chunk_interval)
+                await response.write(self.chunk(body, {"tool_calls": [{"index": 0, "function": {"arguments": arguments[start:start + 8]}}]}))
+            await response.write(self.chunk(body, {}, "tool_calls"))
+        else:
+            for word in words:
+                await asyncio.sleep(self.config.chunk_interval)
+                await response.write(self.chunk(body, {"content": word}))
+            await response.write(self.chunk(body, {}, "stop"))
+
+        if (body.get("stream_options") or {}).get("include_usage"):
+            payload = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                       "model": body.get("model", "fake"), "choices": [], "usage": usage}
+            await response.write(f"data: {json.dumps(payload)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+class FakeWeatherService(FakeService):
+    """api.weather.gov points and hourly forecast endpoints with a generated week of periods."""
+
+    def __init__(self, name: str, config: FakeServiceConfig, forecast_ttl=3600):
+        super().__init__(name, config)
+        self.forecast_ttl = forecast_ttl
+        self.app.router.add_get("/points/{coords}", self.points)
+        self.app.router.add_get("/gridpoints/{grid_id}/{grid_xy}/forecast/hourly", self.hourly_forecast)
+
+    async def points(self, request: web.Request):
+        return web.json_response({"properties": {"gridId": "BOI", "gridX": 132, "gridY": 87}})
+
+    async def hourly_forecast(self, request: web.Request):
+        now = datetime.now(timezone(timedelta(hours=-6))).replace(minute=0, second=0, microsecond=0)
+        periods = []
+        for hour in range(156):
+            start = now + timedelta(hours=hour)
+            periods.append({
+                "number": hour + 1,
+                "startTime": start.isoformat(),
+                "endTime": (start + timedelta(hours=1)).isoformat(),
+                "isDaytime": 6 <= start.hour < 18,
+                "temperature": 50 + int(15 * random.random()) + (10 if 10 <= start.hour < 18 else 0),
+                "temperatureUnit": "F",
+                "temperatureTrend": None,
+                "probabilityOfPrecipitation": {"unitCode": "wmoUnit:percent", "value": random.choice([0, 5, 20, 60])},
+                "relativeHumidity": {"unitCode": "wmoUnit:percent", "value": random.randint(20, 90)},
+                "windSpeed": f"{random.randint(0, 20)} mph",
+                "windDirection": random.choice(["N", "NE", "E", "SE", "S", "SW", "W", "NW"]),
+                "shortForecast": random.choice(["Sunny", "Mostly Cloudy", "Chance Rain Showers", "Clear"]),
+            })
+        expires = datetime.now(timezone.utc) + timedelta(seconds=self.forecast_ttl)
+        return web.json_response(
+            {"properties": {"updated": now.isoformat(), "updateTime": now.isoformat(), "periods": periods}},
+            headers={"Expires": expires.strftime("%a, %d %b %Y %H:%M:%S GMT"), "Cache-Control": f"max-age={self.forecast_ttl}"},
+        )
+
+
+class FakeSpotifyService(FakeService):
+    def __init__(self, name: str, config: FakeServiceConfig):
+        super().__init__(name, config)
+        self.app.router.add_get("/v1/search", self.search)
+        self.app.router.add_get("/v1/me/player/devices", self.devices)
+        self.app.router.add_put("/v1/me/player/play", self.no_content)
+        self.app.router.add_put("/v1/me/player/pause", self.no_content)
+
+    async def search(self, request: web.Request):
+        item = {"uri": "spotify:track:fake", "name": "Happiness", "artists": [{"name": "Ahssake"}]}
+        return web.json_response({"tracks": {"items": [item]}})
+
+    async def devices(self, request: web.Request):
+        return web.json_response({"devices": [{"id": "fake-device", "name": "Your Speaker"}]})
+
+    async def no_content(self, request: web.Request):
+        return web.Response(status=204)
+
+
+def speech_like_pcm(seconds: float, sample_rate: int = 16000) -> np.ndarray:
+    """Voiced harmonics under a syllable-rate envelope plus breath noise, so codecs compress it like speech."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 140 + 25 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voiced = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 12))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t + random.random() * 6), 0, None)
+    signal = voiced * envelope + 0.05 * np.random.standard_normal(len(t))
+    return (signal / np.abs(signal).max() * 12000).astype(np.int16)
+
+
+def encode_pcm(pcm: np.ndarray, sample_rate: int, encoding: str) -> bytes:
+    """Encodes 16-bit mono PCM as Ogg Opus or MP3 the way the TTS service returns them."""
+    codec, container_format = {"OGG_OPUS": ("libopus", "ogg"), "MP3": ("libmp3lame", "mp3")}[encoding]
+    output = io.BytesIO()
+    with av.open(output, "w", format=container_format) as container:
+        stream = container.add_stream(codec, rate=sample_rate if codec != "libopus" else 48000)
+        stream.layout = "mono"
+        stream.bit_rate = 32000  # Roughly what the service uses for speech
+        resampler = av.AudioResampler(format=stream.format.name, layout="mono", rate=stream.rate)
+        frame = av.AudioFrame.from_ndarray(pcm.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = sample_rate
+        for resampled in resampler.resample(frame) + resampler.resample(None):
+            for packet in stream.encode(resampled):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return output.getvalue()
+
+
+class FakeTextToSpeechService(FakeService):
+    """
+    Google TTS REST text:synthesize, returning speech-like audio sized like real speech, as LINEAR16
+    or (with PyAV installed) OGG_OPUS or MP3. With bandwidth set (bytes per second) the response
+    takes as long as it would to download over that link.
+    """
+
+    def __init__(self, name: str, config: FakeServiceConfig, chars_per_second=15, sample_rate=16000,
+                 bandwidth: Optional[float] = None):
+        super().__init__(name, config)
+        self.chars_per_second = chars_per_second
+        self.sample_rate = sample_rate
+        self.bandwidth = bandwidth
+        self.bytes_sent = 0
+        self.app.router.add_post("/v1/text:synthesize", self.synthesize)
+
+    async def synthesize(self, request: web.Request):
+        body = await request.json()
+        text = body.get("input", {}).get("text") or re.sub(r"<[^>]+>", "", body.get("input", {}).get("ssml", ""))
+        seconds = max(0.3, len(text) / self.chars_per_second)
+        encoding = body.get("audioConfig", {}).get("audioEncoding", "LINEAR16")
+        pcm = speech_like_pcm(seconds, self.sample_rate)
+        if encoding in ("OGG_OPUS", "MP3"):
+            if av is None:
+                return web.json_response({"error": {"message": f"{encoding} needs PyAV in the stand-in"}}, status=400)
+            audio = encode_pcm(pcm, self.sample_rate, encoding)
+        else:
+            audio = pcm.tobytes()
+        payload = json.dumps({"audioContent": base64.b64encode(audio).decode("ascii")})
+        self.bytes_sent += len(payload)
+        if self.bandwidth:
+            await asyncio.sleep(len(payload) / self.bandwidth)
+        return web.Response(text=payload, content_type="application/json")
+
+
+class FakeServices:
+    """Starts all stand-ins and exposes the base URLs to wire into the real clients."""
+
+    def __init__(self, configs: Optional[Dict[str, FakeServiceConfig]] = None):
+        configs = configs or {}
+        self.openai = FakeChatCompletions("openai", configs.get("openai", FakeServiceConfig(latency=0.3, chunk_interval=0.03)))
+        self.groq = FakeChatCompletions("groq", configs.get("groq", FakeServiceConfig(latency=0.4)))
+        self.nws = FakeWeatherService("nws", configs.get("nws", FakeServiceConfig(latency=0.15)))
+        self.spotify = FakeSpotifyService("spotify", configs.get("spotify", FakeServiceConfig(latency=0.1)))
+        self.tts = FakeTextToSpeechService("tts", configs.get("tts", FakeServiceConfig(latency=0.2)))
+        self.services = [self.openai, self.groq, self.nws, self.spotify, self.tts]
+
+    async def start(self):
+        for service in self.services:
+            await service.start()
+
+    async def stop(self):
+        for service in self.services:
+            await service.stop()
+
+    def environment(self) -> Dict[str, str]:
+        """Environment variables that point a normal `python main.py` run at these stand-ins."""
+        return {
+            "OPENAI_BASE_URL": f"{self.openai.base_url}/v1",
+            "GROQ_BASE_URL": f"{self.groq.base_url}/v1",
+            "NWS_BASE_URL": self.nws.base_url,
+            "SPOTIFY_API_PREFIX": f"{self.spotify.base_url}/v1/",
+            "TTS_API_ENDPOINT": f"127.0.0.1:{self.tts.port}",
+        }
+
+    def request_counts(self) -> Dict[str, int]:
+        return {service.name: service.requests for service in self.services}
+
+
+async def main():
+    services = FakeServices()
+    await services.start()
+    for name, value in services.environment().items():
+        print(f"export {name}={value}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await services.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
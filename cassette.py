@@ -0,0 +1,402 @@
+#cassette.py
+#
+# Record/replay of provider traffic for reproducible performance runs. In record mode the real
+# OpenAI/Groq (httpx), NWS (aiohttp), Spotify (requests) and Google TTS calls go out as usual and
+# every response is saved with its timing: time to headers and the arrival time of each body
+# chunk, so streamed tokens and tool-call deltas keep their original pacing. In replay mode no
+# request leaves the process; responses are served from the cassette at the recorded pace,
+# scaled by a speed factor (0 replays without waiting, for profiling CPU-side overhead).
+#
+# ASSISTANT_CASSETTE=run.json.gz ASSISTANT_CASSETTE_MODE=record python main.py
+# python -m benchmarks.bench_pipeline --replay run.json.gz --replay-speed 4
+
+import asyncio
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+import aiohttp
+import httpx
+import requests
+from google.cloud import texttospeech_v1
+from multidict import CIMultiDict, CIMultiDictProxy
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from yarl import URL
+
+CASSETTE_PATH = os.environ.get("ASSISTANT_CASSETTE")
+CASSETTE_MODE = os.environ.get("ASSISTANT_CASSETTE_MODE", "replay")  # "record" or "replay"
+CASSETTE_SPEED = float(os.environ.get("ASSISTANT_CASSETTE_SPEED", "1"))
+
+# Set event loop policy on Windows for Python 3.8+
+if sys.platform.startswith('win'):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode for a request the cassette has no response for."""
+
+
+def body_digest(body: Any) -> str:
+    """Hash of a request body; JSON is canonicalised so key order doesn't matter."""
+    if body is None or body == b"":
+        return ""
+    if isinstance(body, (bytes, bytearray)):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return hashlib.sha256(body).hexdigest()
+    if not isinstance(body, str):
+        body = json.dumps(body, sort_keys=True)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def endpoint_of(url: Any) -> str:
+    """Path and query only, so a cassette recorded against one host replays against another."""
+    parts = urlsplit(str(url))
+    return parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+class Cassette:
+    """
+    A recording of provider responses. Each interaction holds the provider name, method,
+    endpoint, request body digest, status, headers, time to headers ("latency") and the body
+    as a list of [seconds since the request started, base64 chunk].
+
+    Replay matches requests by provider, method and endpoint, preferring the same body and
+    interactions not served yet, so concurrent turns and retries come back in recorded order.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", speed: float = 1.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.interactions: List[Dict[str, Any]] = []
+        self.served = set()  # Indexes of interactions already replayed
+        self.misses = 0
+        self.lock = threading.Lock()  # Spotify and TTS calls run in worker threads
+        if mode == "replay":
+            self.load()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def load(self):
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "rt") as f:
+            self.interactions = json.load(f)["interactions"]
+
+    def save(self):
+        if self.replaying:
+            return
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with self.lock, opener(self.path, "wt") as f:
+            json.dump({"version": 1, "recorded_at": time.time(), "interactions": self.interactions}, f)
+
+    def scaled(self, seconds: float) -> float:
+        return seconds / self.speed if self.speed > 0 else 0.0
+
+    def start_interaction(self, provider: str, method: str, url: Any, body: Any) -> Dict[str, Any]:
+        """Adds an interaction whose response is filled in as it arrives (record mode)."""
+        interaction = {"provider": provider, "method": method, "endpoint": endpoint_of(url), "body": body_digest(body),
+                       "status": None, "headers": [], "latency": None, "chunks": [], "complete": False}
+        with self.lock:
+            self.interactions.append(interaction)
+        return interaction
+
+    def match(self, provider: str, method: str, url: Any, body: Any) -> Dict[str, Any]:
+        endpoint, digest = endpoint_of(url), body_digest(body)
+        with self.lock:
+            candidates = [(index, interaction) for index, interaction in enumerate(self.interactions)
+                          if (interaction["provider"], interaction["method"], interaction["endpoint"]) == (provider, method, endpoint)]
+            # Unserved with the same body, then any unserved, then a repeat of the closest recording
+            for fresh, same_body in ((True, True), (True, False), (False, True), (False, False)):
+                for index, interaction in candidates:
+                    if (index not in self.served) == fresh and (interaction["body"] == digest or not same_body):
+                        self.served.add(index)
+                        return interaction
+            self.misses += 1
+        raise CassetteMiss(f"No recorded {provider} response for {method} {endpoint}")
+
+    def stats(self) -> Dict[str, Any]:
+        providers: Dict[str, Dict[str, int]] = {}
+        for interaction in self.interactions:
+            counts = providers.setdefault(interaction["provider"], {"interactions": 0, "chunks": 0, "bytes": 0})
+            counts["interactions"] += 1
+            counts["chunks"] += len(interaction["chunks"])
+            counts["bytes"] += sum(len(base64.b64decode(chunk)) for _, chunk in interaction["chunks"])
+        return {"mode": self.mode, "speed": self.speed, "served": len(self.served), "misses": self.misses,
+                "providers": providers}
+
+
+def record_chunk(interaction: Dict[str, Any], started: float, chunk: bytes):
+    interaction["chunks"].append([round(time.perf_counter() - started, 4), base64.b64encode(chunk).decode("ascii")])
+
+
+def recorded_chunks(interaction: Dict[str, Any]):
+    return [(offset, base64.b64decode(chunk)) for offset, chunk in interaction["chunks"]]
+
+
+# OpenAI and Groq: an httpx transport under the openai client
+
+class RecordingByteStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, interaction: Dict[str, Any], started: float):
+        self.stream = stream
+        self.interaction = interaction
+        self.started = started
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            record_chunk(self.interaction, self.started, chunk)
+            yield chunk
+        self.interaction["complete"] = True
+
+    async def aclose(self):
+        await self.stream.aclose()
+
+
+class ReplayByteStream(httpx.AsyncByteStream):
+    def __init__(self, cassette: Cassette, interaction: Dict[str, Any], started: float):
+        self.cassette = cassette
+        self.interaction = interaction
+        self.started = started  # Loop time the request was made
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        for offset, chunk in recorded_chunks(self.interaction):
+            delay = self.started + self.cassette.scaled(offset) - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield chunk
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette, provider: str):
+        self.cassette = cassette
+        self.provider = provider
+        self.transport = None if cassette.replaying else httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        if self.cassette.replaying:
+            started = asyncio.get_running_loop().time()
+            interaction = self.cassette.match(self.provider, request.method, request.url, body)
+            await asyncio.sleep(self.cassette.scaled(interaction["latency"]))
+            return httpx.Response(interaction["status"], headers=interaction["headers"],
+                                  stream=ReplayByteStream(self.cassette, interaction, started), request=request)
+
+        started = time.perf_counter()
+        interaction = self.cassette.start_interaction(self.provider, request.method, request.url, body)
+        response = await self.transport.handle_async_request(request)
+        interaction.update(status=response.status_code,
+                           headers=[[name.decode("latin-1"), value.decode("latin-1")] for name, value in response.headers.raw],
+                           latency=round(time.perf_counter() - started, 4))
+        return httpx.Response(response.status_code, headers=response.headers,
+                              stream=RecordingByteStream(response.stream, interaction, started),
+                              extensions=response.extensions, request=request)
+
+    async def aclose(self):
+        if self.transport:
+            await self.transport.aclose()
+
+
+# NWS: a stand-in for the aiohttp session's get()
+
+class CassetteClientResponse:
+    """The parts of aiohttp.ClientResponse the NWS calls use, served from an interaction."""
+
+    def __init__(self, cassette: Cassette, interaction: Dict[str, Any], method: str, url: str, started: float):
+        self.cassette = cassette
+        self.interaction = interaction
+        self.method = method
+        self.url = URL(url)
+        self.started = started
+        self.status = interaction["status"]
+        self.headers = CIMultiDictProxy(CIMultiDict(interaction["headers"]))
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            request_info = aiohttp.RequestInfo(self.url, self.method, CIMultiDictProxy(CIMultiDict()), self.url)
+            raise aiohttp.ClientResponseError(request_info, (), status=self.status, message="Recorded error",
+                                              headers=self.headers)
+
+    async def read(self) -> bytes:
+        chunks = recorded_chunks(self.interaction)
+        if self.cassette.replaying and chunks:
+            delay = self.started + self.cassette.scaled(chunks[-1][0]) - asyncio.get_running_loop().time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        return b"".join(chunk for _, chunk in chunks)
+
+    async def text(self) -> str:
+        return (await self.read()).decode()
+
+    async def json(self) -> Any:
+        return json.loads(await self.read())
+
+
+class CassetteClientSession:
+    def __init__(self, cassette: Cassette, provider: str, session: aiohttp.ClientSession):
+        self.cassette = cassette
+        self.provider = provider
+        self.session = session
+
+    @property
+    def closed(self) -> bool:
+        return self.session.closed
+
+    async def close(self):
+        await self.session.close()
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs):
+        body = kwargs.get("json", kwargs.get("data"))
+        if self.cassette.replaying:
+            started = asyncio.get_running_loop().time()
+            interaction = self.cassette.match(self.provider, method, url, body)
+            await asyncio.sleep(self.cassette.scaled(interaction["latency"]))
+            yield CassetteClientResponse(self.cassette, interaction, method, url, started)
+            return
+
+        started = time.perf_counter()
+        interaction = self.cassette.start_interaction(self.provider, method, url, body)
+        async with self.session.request(method, url, **kwargs) as response:
+            interaction.update(status=response.status, headers=[[name, value] for name, value in response.headers.items()],
+                               latency=round(time.perf_counter() - started, 4))
+            async for chunk in response.content.iter_any():
+                record_chunk(interaction, started, chunk)
+            interaction["complete"] = True
+        yield CassetteClientResponse(self.cassette, interaction, method, url, started)
+
+
+# Spotify: a requests adapter mounted on spotipy's session
+
+class CassetteAdapter(HTTPAdapter):
+    def __init__(self, cassette: Cassette, provider: str):
+        super().__init__()
+        self.cassette = cassette
+        self.provider = provider
+
+    def send(self, request, **kwargs):
+        if not self.cassette.replaying:
+            started = time.perf_counter()
+            interaction = self.cassette.start_interaction(self.provider, request.method, request.url, request.body)
+            response = super().send(request, **kwargs)
+            body = response.content
+            interaction.update(status=response.status_code, headers=list(map(list, response.headers.items())),
+                               latency=round(time.perf_counter() - started, 4), complete=True)
+            if body:
+                record_chunk(interaction, started, body)
+            return response
+
+        started = time.perf_counter()
+        interaction = self.cassette.match(self.provider, request.method, request.url, request.body)
+        chunks = recorded_chunks(interaction)
+        time.sleep(max(0.0, started + self.cassette.scaled(chunks[-1][0] if chunks else interaction["latency"]) - time.perf_counter()))
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        # The body is stored decoded, so the encoding header would only mislead
+        response.headers = CaseInsensitiveDict({name: value for name, value in interaction["headers"]
+                                                if name.lower() != "content-encoding"})
+        response._content = b"".join(chunk for _, chunk in chunks)
+        response.url = request.url
+        response.request = request
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+
+# Google TTS: a proxy for the client's synthesize_speech
+
+class CassetteTTSClient:
+    def __init__(self, cassette: Cassette, provider: str, client=None):
+        self.cassette = cassette
+        self.provider = provider
+        self.client = client  # None when replaying, so no credentials are needed
+
+    def synthesize_speech(self, input, voice, audio_config, **kwargs):
+        request = {"text": input.text, "ssml": input.ssml, "voice": voice.name,
+                   "encoding": int(audio_config.audio_encoding), "sample_rate": audio_config.sample_rate_hertz}
+        if self.cassette.replaying:
+            interaction = self.cassette.match(self.provider, "POST", "synthesize_speech", request)
+            time.sleep(self.cassette.scaled(interaction["latency"]))
+            audio = b"".join(chunk for _, chunk in recorded_chunks(interaction))
+            return texttospeech_v1.SynthesizeSpeechResponse(audio_content=audio)
+
+        started = time.perf_counter()
+        interaction = self.cassette.start_interaction(self.provider, "POST", "synthesize_speech", request)
+        response = self.client.synthesize_speech(input=input, voice=voice, audio_config=audio_config, **kwargs)
+        interaction.update(status=200, latency=round(time.perf_counter() - started, 4), complete=True)
+        record_chunk(interaction, started, response.audio_content)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+active: Optional[Cassette] = None
+
+
+def use(cassette: Optional[Cassette]) -> Optional[Cassette]:
+    """Makes cassette the one clients created from now on record to or replay from."""
+    global active
+    active = cassette
+    if cassette is not None and not cassette.replaying:
+        atexit.register(cassette.save)
+    return cassette
+
+
+def http_client(provider: str) -> Optional[httpx.AsyncClient]:
+    """An httpx client for AsyncOpenAI(http_client=...), or None (the default client) without a cassette."""
+    if active is None:
+        return None
+    return httpx.AsyncClient(transport=CassetteTransport(active, provider), timeout=httpx.Timeout(600.0, connect=5.0))
+
+
+def client_session(provider: str, session: aiohttp.ClientSession):
+    return session if active is None else CassetteClientSession(active, provider, session)
+
+
+def requests_session(provider: str, session: requests.Session) -> requests.Session:
+    if active is not None:
+        adapter = CassetteAdapter(active, provider)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    return session
+
+
+def tts_client(create: Callable[[], Any], provider: str = "tts"):
+    if active is None:
+        return create()
+    return CassetteTTSClient(active, provider, None if active.replaying else create())
+
+
+if CASSETTE_PATH:
+    use(Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_SPEED))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarise a cassette")
+    parser.add_argument("path")
+    args = parser.parse_args()
+    cassette = Cassette(args.path)
+    for provider, counts in cassette.stats()["providers"].items():
+        print(f"{provider:<14} {counts['interactions']:>5} responses {counts['chunks']:>6} chunks {counts['bytes']:>10} bytes")
+
+if __name__ == "__main__":
+    main()
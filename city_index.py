@@ -0,0 +1,144 @@
+#city_index.py
+
+import math
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+class CityRecord:
+    __slots__ = ("city", "state_id", "state_name", "latitude", "longitude", "ranking")
+
+    def __init__(self, city, state_id, state_name, latitude, longitude, ranking):
+        self.city = city
+        self.state_id = state_id
+        self.state_name = state_name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.ranking = ranking
+
+    def coords(self) -> Dict[str, float]:
+        return {'latitude': self.latitude, 'longitude': self.longitude}
+
+    def __repr__(self):
+        return f"CityRecord({self.city!r}, {self.state_id!r}, {self.latitude}, {self.longitude})"
+
+
+def haversine_km(lat1, lng1, lat2, lng2) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def unit_vector(latitude: float, longitude: float) -> Tuple[float, float, float]:
+    lat, lng = math.radians(latitude), math.radians(longitude)
+    return math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat)
+
+
+class CityIndex:
+    """
+    In-memory indexes over the uscities table, built once at startup:
+
+    - an inverted ZIP -> city index from the space-separated `zips` column, and
+    - a KD-tree over the places' unit-sphere coordinates for nearest-city lookups
+      (chord length orders points exactly like great-circle distance).
+
+    Both answer without SQL. Where several places list the same ZIP, the better-ranked one wins.
+    """
+
+    LEAF_SIZE = 8
+
+    def __init__(self, db_path: str = 'uscities.db'):
+        self.records: List[CityRecord] = []
+        self.zip_index: Dict[str, CityRecord] = {}
+        self.points: List[Tuple[float, float, float]] = []
+        # Flat KD-tree: per node, either a split (axis, value, left, right) or a leaf (-1, indices, ...)
+        self.nodes: List[tuple] = []
+        self._load(db_path)
+        self.root = self._build(list(range(len(self.records))))
+
+    def _load(self, db_path: str):
+        connection = sqlite3.connect(db_path)
+        try:
+            rows = connection.execute(
+                "SELECT city_ascii, state_id, state_name, lat, lng, ranking, zips FROM uscities ORDER BY ranking"
+            )
+            for city, state_id, state_name, lat, lng, ranking, zips in rows:
+                record = CityRecord(city, state_id, state_name, lat, lng, ranking)
+                self.records.append(record)
+                self.points.append(unit_vector(lat, lng))
+                for zip_code in (zips or '').split():
+                    self.zip_index.setdefault(zip_code, record)
+        finally:
+            connection.close()
+
+    def _build(self, indices: List[int]) -> int:
+        node = len(self.nodes)
+        if len(indices) <= self.LEAF_SIZE:
+            self.nodes.append((-1, indices, -1, -1))
+            return node
+
+        # Split along the widest axis; the points lie on a sphere, so cycling axes wastes levels
+        axis = max(range(3), key=lambda axis: max(self.points[index][axis] for index in indices)
+                                              - min(self.points[index][axis] for index in indices))
+        indices.sort(key=lambda index: self.points[index][axis])
+        middle = len(indices) // 2
+        self.nodes.append(None)
+        left = self._build(indices[:middle])
+        right = self._build(indices[middle:])
+        self.nodes[node] = (axis, self.points[indices[middle]][axis], left, right)
+        return node
+
+    def lookup_zip(self, zip_code: str) -> Optional[CityRecord]:
+        return self.zip_index.get(zip_code.strip()[:5])
+
+    def nearest(self, latitude: float, longitude: float) -> Optional[CityRecord]:
+        if not self.records:
+            return None
+        query = unit_vector(latitude, longitude)
+        points, nodes = self.points, self.nodes
+        best, best_distance = -1, float('inf')
+        # Each entry carries a lower bound on the squared distance to anything under the node,
+        # built from the per-axis offsets to the splitting planes crossed on the way down
+        stack = [(self.root, 0.0, (0.0, 0.0, 0.0))]
+
+        while stack:
+            node, bound, offsets = stack.pop()
+            if bound >= best_distance:
+                continue
+            axis, value, left, right = nodes[node]
+            if axis < 0:
+                for index in value:
+                    x, y, z = points[index]
+                    distance = (x - query[0]) ** 2 + (y - query[1]) ** 2 + (z - query[2]) ** 2
+                    if distance < best_distance:
+                        best, best_distance = index, distance
+                continue
+            gap = query[axis] - value
+            near, far = (left, right) if gap < 0 else (right, left)
+            far_offsets = offsets[:axis] + (gap,) + offsets[axis + 1:]
+            # Push the far side first so the near side is searched first and the far side usually pruned
+            stack.append((far, bound - offsets[axis] ** 2 + gap * gap, far_offsets))
+            stack.append((near, bound, offsets))
+
+        return self.records[best]
+
+
+def main():
+    start_time = time.perf_counter()
+    index = CityIndex()
+    print(f"Indexed {len(index.records)} places and {len(index.zip_index)} ZIP codes "
+          f"in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+
+    print(index.lookup_zip("83702"))
+    latitude = float(os.environ.get("HOME_LATITUDE", "43.6150"))
+    longitude = float(os.environ.get("HOME_LONGITUDE", "-116.2023"))
+    home = index.nearest(latitude, longitude)
+    print(f"Nearest to {latitude}, {longitude}: {home} "
+          f"({haversine_km(latitude, longitude, home.latitude, home.longitude):.1f} km)")
+
+if __name__ == "__main__":
+    main()
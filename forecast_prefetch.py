@@ -0,0 +1,177 @@
+#forecast_prefetch.py
+
+import asyncio
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Tuple
+from rate_limiter import BACKGROUND, request_priority
+
+# Set event loop policy on Windows for Python 3.8+
+if sys.platform.startswith('win'):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+
+class LocationStats:
+    def __init__(self, coords):
+        self.coords = coords
+        self.score = 0.0
+        self.last_seen = time.time()
+        self.retry_at = 0.0  # Set after a failed prefetch so one bad location can't spin the loop
+        self.prefetched_at = 0.0
+        self.update_time = None  # updateTime of the last forecast prefetched
+        self.refresh_interval = 0.0  # Minimum wait before the next prefetch; grows while updateTime doesn't change
+
+    def decayed_score(self, now, half_life):
+        return self.score * 0.5 ** ((now - self.last_seen) / half_life)
+
+
+class ForecastPrefetcher:
+    """
+    Keeps the hourly forecasts of frequently asked-about locations fresh in WeatherAPI's
+    forecast cache, so the common morning questions skip the NWS round trips.
+
+    Query frequency is tracked with exponentially decaying counts. A hot location is refreshed
+    shortly before its cached forecast expires (per the NWS Expires/Cache-Control headers),
+    never more than one request per min_request_interval, and only while no user turn is active.
+    Each location also waits at least min_refresh_interval between prefetches, however short the
+    Expires NWS sent, doubling up to max_refresh_interval while the forecast's updateTime stays the same.
+    """
+
+    def __init__(self, weather_api, max_locations=3, min_score=1.5, half_life=3 * 86400,
+                 min_request_interval=10.0, refresh_lead=120.0, idle_poll=600.0, retry_delay=300.0,
+                 min_refresh_interval=300.0, max_refresh_interval=3600.0):
+        self.weather_api = weather_api
+        weather_api.prefetcher = self
+        self.max_locations = max_locations
+        self.min_score = min_score  # 1.5: asked about at least twice within roughly a half-life
+        self.half_life = half_life
+        self.min_request_interval = min_request_interval
+        self.refresh_lead = refresh_lead
+        self.idle_poll = idle_poll
+        self.retry_delay = retry_delay
+        self.min_refresh_interval = min_refresh_interval
+        self.max_refresh_interval = max_refresh_interval
+        self.locations: Dict[Tuple[str, str], LocationStats] = {}
+        self.active_turns = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.wakeup = asyncio.Event()
+        self.last_request = 0.0
+        self.prefetches = 0
+        self.failures = 0
+        self.task = None
+
+    def record_query(self, city, state, coords):
+        now = time.time()
+        key = (city, state)
+        stats = self.locations.get(key)
+        if stats is None:
+            stats = self.locations[key] = LocationStats(coords)
+        stats.score = stats.decayed_score(now, self.half_life) + 1
+        stats.last_seen = now
+        self.wakeup.set()
+
+    def hot_locations(self) -> List[Tuple[Tuple[str, str], LocationStats]]:
+        now = time.time()
+        scored = [(stats.decayed_score(now, self.half_life), key, stats) for key, stats in self.locations.items()]
+        scored = sorted((item for item in scored if item[0] >= self.min_score), key=lambda item: item[0], reverse=True)
+        return [(key, stats) for _, key, stats in scored[:self.max_locations]]
+
+    def due_time(self, stats: LocationStats) -> float:
+        key = (round(stats.coords['latitude'], 4), round(stats.coords['longitude'], 4))
+        grid = self.weather_api.grid_cache.get(key)
+        cached = self.weather_api.forecast_cache.get(grid) if grid else None
+        due = cached.expires_at - self.refresh_lead if cached else 0.0
+        return max(due, stats.retry_at, stats.prefetched_at + stats.refresh_interval)
+
+    def record_prefetch(self, stats: LocationStats, forecast):
+        """Backs off while NWS keeps serving the same forecast, resets once it publishes a new one."""
+        if stats.update_time is not None and forecast.update_time == stats.update_time:
+            stats.refresh_interval = min(stats.refresh_interval * 2, self.max_refresh_interval)
+        else:
+            stats.refresh_interval = self.min_refresh_interval
+        stats.update_time = forecast.update_time
+        stats.prefetched_at = time.time()
+
+    @asynccontextmanager
+    async def foreground(self):
+        """Wrap each user turn in this so prefetching stays out of its way."""
+        self.active_turns += 1
+        self.idle.clear()
+        try:
+            yield
+        finally:
+            self.active_turns -= 1
+            if self.active_turns == 0:
+                self.idle.set()
+
+    async def run(self):
+        # This task's NWS requests queue behind any from user turns
+        request_priority.set(BACKGROUND)
+        while True:
+            now = time.time()
+            schedule = sorted((self.due_time(stats), key, stats) for key, stats in self.hot_locations())
+            if not schedule or schedule[0][0] > now:
+                timeout = schedule[0][0] - now if schedule else self.idle_poll
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=min(max(timeout, 1.0), self.idle_poll))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self.idle.wait()
+            delay = self.last_request + self.min_request_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue  # A turn may have started meanwhile; re-check everything
+
+            _, (city, state), stats = schedule[0]
+            self.last_request = time.monotonic()
+            try:
+                forecast = await self.weather_api.fetch_forecast(force=True, **stats.coords)
+                self.prefetches += 1
+                self.record_prefetch(stats, forecast)
+                print(f"Prefetched forecast for {city}, {state} (fresh until {time.ctime(forecast.expires_at)})")
+            except Exception as e:
+                self.failures += 1
+                stats.retry_at = time.time() + self.retry_delay
+                print(f"Forecast prefetch for {city}, {state} failed: {e}")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self):
+        return {
+            "tracked_locations": len(self.locations),
+            "hot_locations": [f"{city}, {state}" for (city, state), _ in self.hot_locations()],
+            "prefetches": self.prefetches,
+            "failures": self.failures,
+        }
+
+
+async def main():
+    from weather import WeatherAPI
+
+    async with WeatherAPI() as weather_api:
+        prefetcher = ForecastPrefetcher(weather_api, min_request_interval=1.0, min_refresh_interval=2.0)
+        prefetcher.start()
+        for _ in range(2):
+            await weather_api.process_weather_query('Boise', 'Idaho', "what's the actual temperature?")
+        await asyncio.sleep(5)
+        await prefetcher.stop()
+        print(prefetcher.stats())
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,172 @@
+#hedging.py
+
+import asyncio
+import bisect
+import math
+import random
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Set event loop policy on Windows for Python 3.8+
+if sys.platform.startswith('win'):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+
+class LatencyHistogram:
+    """Log-spaced latency buckets (about 12% wide) from 10 ms to a minute."""
+
+    def __init__(self, minimum: float = 0.01, maximum: float = 60.0, growth: float = 1.12):
+        steps = int(math.log(maximum / minimum) / math.log(growth)) + 1
+        self.bounds = [minimum * growth ** step for step in range(steps + 1)]
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+
+    def percentile(self, pct: float) -> float:
+        """Upper bound of the bucket holding the pct-th percentile sample."""
+        if not self.count:
+            return float('nan')
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.bounds[min(index, len(self.bounds) - 1)]
+        return self.bounds[-1]
+
+
+class Endpoint:
+    """One way of answering a request, e.g. a base URL and model, with its own latency history."""
+
+    def __init__(self, name: str, client: Any, model: str, provider: str):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.provider = provider  # Limiter name in rate_limiter.scheduler
+        self.latency = LatencyHistogram()
+        self.wins = 0
+        self.failures = 0
+
+
+class HedgedCaller:
+    """
+    Sends a request to the primary endpoint and, if no answer has arrived after the primary's
+    observed latency percentile, the same request to the secondary. The first successful answer
+    wins and the other request is cancelled. With no secondary configured it is a plain call.
+    """
+
+    def __init__(self, primary: Endpoint, secondary: Optional[Endpoint] = None, percentile: float = 90.0,
+                 min_samples: int = 20, default_delay: float = 1.5, min_delay: float = 0.1):
+        self.primary = primary
+        self.secondary = secondary
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay = default_delay  # Used until the primary has min_samples latencies
+        self.min_delay = min_delay
+        self.requests = 0
+        self.hedges = 0
+
+    @property
+    def endpoints(self) -> List[Endpoint]:
+        return [self.primary] + ([self.secondary] if self.secondary else [])
+
+    def hedge_delay(self) -> float:
+        if self.primary.latency.count < self.min_samples:
+            return self.default_delay
+        return max(self.min_delay, self.primary.latency.percentile(self.percentile))
+
+    async def timed(self, endpoint: Endpoint, send: Callable[[Endpoint], Awaitable[Any]]):
+        start_time = time.perf_counter()
+        try:
+            result = await send(endpoint)
+        except asyncio.CancelledError:
+            # Losing a race still says the endpoint took at least this long; dropping it would hide the tail
+            endpoint.latency.record(time.perf_counter() - start_time)
+            raise
+        except Exception:
+            endpoint.failures += 1
+            raise
+        endpoint.latency.record(time.perf_counter() - start_time)
+        return result
+
+    async def call(self, send: Callable[[Endpoint], Awaitable[Any]], discard: Optional[Callable[[Any], None]] = None):
+        """
+        Parameters:
+        - send: Makes the request against the given Endpoint and returns its result.
+        - discard: Called with a losing result that completed anyway, e.g. to close an open stream.
+
+        Returns:
+        - The first successful result. If every attempt fails, the primary's error is raised.
+        """
+        self.requests += 1
+        primary_task = asyncio.create_task(self.timed(self.primary, send))
+        if self.secondary is None:
+            result = await primary_task
+            self.primary.wins += 1
+            return result
+
+        tasks = {primary_task: self.primary}
+        winner = None
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=self.hedge_delay())
+            if not done or primary_task.exception() is not None:
+                # Too slow, or failed fast: either way the secondary gets a go
+                self.hedges += 1
+                tasks[asyncio.create_task(self.timed(self.secondary, send))] = self.secondary
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        tasks[task].wins += 1
+                        return task.result()
+            return primary_task.result()  # Everything failed; surface the primary's error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif task is not winner and discard and not task.cancelled() and task.exception() is None:
+                    discard(task.result())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_delay": self.hedge_delay(),
+            "endpoints": {
+                endpoint.name: {
+                    "samples": endpoint.latency.count, "wins": endpoint.wins, "failures": endpoint.failures,
+                    "p50": endpoint.latency.percentile(50), "p90": endpoint.latency.percentile(90),
+                    "p99": endpoint.latency.percentile(99),
+                }
+                for endpoint in self.endpoints
+            },
+        }
+
+
+async def main():
+    async def send(endpoint):
+        # Primary is usually quick with a slow tail; the secondary is steady
+        delay = random.choice([0.05] * 9 + [1.0]) if endpoint is caller.primary else 0.15
+        await asyncio.sleep(delay)
+        return endpoint.name
+
+    caller = HedgedCaller(Endpoint("primary", None, "model-a", "demo"), Endpoint("secondary", None, "model-b", "demo"),
+                          min_samples=10)
+    latencies = []
+    for _ in range(200):
+        start_time = time.perf_counter()
+        await caller.call(send)
+        latencies.append(time.perf_counter() - start_time)
+    latencies = sorted(latencies[100:])  # After the histogram has warmed up
+    print(f"p50 {latencies[49] * 1000:.0f} ms, p99 {latencies[98] * 1000:.0f} ms")
+    print(caller.stats())
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,270 @@
+#intent_router.py
+
+import asyncio
+import re
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from city_index import CityIndex, CityRecord
+
+# Set event loop policy on Windows for Python 3.8+
+if sys.platform.startswith('win'):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+# Rough cost of a streamed GPT round trip that ends in a tool call; replaced by
+# measured values as soon as the LLM path reports some.
+DEFAULT_LLM_TOOL_LATENCY = 1.5
+
+
+class IntentMatch:
+    def __init__(self, function_name: str, parameters: Dict[str, Any], confidence: float):
+        self.function_name = function_name
+        self.parameters = parameters
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f"IntentMatch({self.function_name!r}, {self.parameters!r}, confidence={self.confidence})"
+
+
+class CityGazetteer:
+    """
+    In-memory city/state lookup over the CityIndex records (the uscities table is read
+    once, by CityIndex), used to fill the location slots of weather commands without
+    touching the database per turn.
+    """
+
+    def __init__(self, records: Iterable[CityRecord]):
+        self.cities: Dict[str, List[Tuple[str, str, str, int]]] = {}
+        self.states: Dict[str, Tuple[str, str]] = {}
+        for record in records:
+            self.cities.setdefault(record.city.lower(), []).append(
+                (record.city, record.state_id, record.state_name, record.ranking or 5))
+            self.states[record.state_id.lower()] = (record.state_id, record.state_name)
+            self.states[record.state_name.lower()] = (record.state_id, record.state_name)
+
+    def resolve(self, location: str) -> Optional[Tuple[str, str, float]]:
+        """
+        Resolves a spoken location such as "Boise, Idaho", "Boise ID" or "Boise".
+
+        Returns:
+            A (city, state_name, confidence) tuple, or None if the city is unknown.
+        """
+        location = location.strip(" ,.").lower()
+        city_part, state_part = location, None
+
+        if ',' in location:
+            city_part, state_part = [part.strip() for part in location.rsplit(',', 1)]
+        else:
+            # Try the longest trailing state name first so "new york new york" splits correctly
+            words = location.split()
+            for size in range(min(3, len(words) - 1), 0, -1):
+                candidate = ' '.join(words[-size:])
+                if candidate in self.states and ' '.join(words[:-size]) in self.cities:
+                    city_part, state_part = ' '.join(words[:-size]), candidate
+                    break
+
+        candidates = self.cities.get(city_part)
+        if not candidates:
+            return None
+
+        if state_part:
+            state = self.states.get(state_part)
+            if not state:
+                return None
+            for city, state_id, state_name, _ in candidates:
+                if state_id == state[0]:
+                    return city, state_name, 1.0
+            return None
+
+        if len(candidates) == 1:
+            city, _, state_name, _ = candidates[0]
+            return city, state_name, 0.9
+
+        # Ambiguous city name without a state: only trust it if one place clearly dominates
+        ranked = sorted(candidates, key=lambda candidate: candidate[3])
+        if ranked[0][3] == 1 and ranked[1][3] > 1:
+            city, _, state_name, _ = ranked[0]
+            return city, state_name, 0.85
+        city, _, state_name, _ = ranked[0]
+        return city, state_name, 0.5
+
+
+class IntentRouter:
+    """
+    Local fast path for simple device commands. Transcripts that match the grammar
+    with high confidence are dispatched straight to the tool functions; everything
+    else falls through to the LLM.
+    """
+
+    FILLER_PATTERN = re.compile(r"^(?:(?:hey |ok |okay )?jarvis[, ]*)?(?:please |can you |could you |would you )*", re.IGNORECASE)
+    PAUSE_PATTERN = re.compile(r"^(?:pause|stop)(?: the)?(?: music| song| playback| playing)?(?: please)?$", re.IGNORECASE)
+    RESUME_PATTERN = re.compile(r"^(?:resume|unpause|continue|play)(?: the)?(?: music| song| playback| playing)?(?: please)?$", re.IGNORECASE)
+    PLAY_PATTERN = re.compile(r"^play (?:the song )?(?P<song>.+?)(?: by (?P<artist>.+))?$", re.IGNORECASE)
+    HOME_WEATHER_PATTERN = re.compile(
+        r"^(?:what(?:'s| is) the |how(?:'s| is) the )?(?:weather|forecast)(?: like)?(?: (?:today|outside|right now|here))?$",
+        re.IGNORECASE,
+    )
+    ZIP_PATTERN = re.compile(r"^\d{5}$")
+    WEATHER_PATTERN = re.compile(
+        r"^(?:what(?:'s| is) the |how(?:'s| is) the )?(?:weather|forecast)(?: like)? (?:in|for) (?P<location>.+)$",
+        re.IGNORECASE,
+    )
+    # Phrases that look like "play X" but need the LLM to work out what to do
+    AMBIGUOUS_PLAY_PATTERN = re.compile(r"\b(?:playlist|something|some|music|album|radio)\b", re.IGNORECASE)
+
+    def __init__(self, gazetteer: Optional[CityGazetteer] = None, confidence_threshold: float = 0.85,
+                 city_index=None, home_city=None):
+        if gazetteer is None:
+            # Share the caller's CityIndex so the uscities table is loaded and held only once
+            city_index = city_index if city_index is not None else CityIndex()
+            gazetteer = CityGazetteer(city_index.records)
+        self.gazetteer = gazetteer
+        # CityIndex for "weather in 83702", and the CityRecord used when no place is named
+        self.city_index = city_index
+        self.home_city = home_city
+        self.confidence_threshold = confidence_threshold
+        self.attempts = 0
+        self.hits = 0
+        self.latency_saved = 0.0
+        self.llm_tool_latency = None
+
+    def normalize(self, transcript: str) -> str:
+        text = transcript.strip().rstrip('.!?').strip()
+        return self.FILLER_PATTERN.sub('', text).strip()
+
+    def match(self, transcript: str) -> Optional[IntentMatch]:
+        text = self.normalize(transcript)
+        if not text:
+            return None
+
+        if self.PAUSE_PATTERN.match(text):
+            return IntentMatch("pause_playback", {}, 1.0)
+        if self.RESUME_PATTERN.match(text):
+            return IntentMatch("start_playback", {}, 0.95)
+
+        if self.home_city is not None and self.HOME_WEATHER_PATTERN.match(text):
+            return IntentMatch("get_weather_information",
+                               {"city": self.home_city.city, "state": self.home_city.state_name}, 0.9)
+
+        weather = self.WEATHER_PATTERN.match(text)
+        if weather:
+            location = weather.group('location').strip()
+            if self.ZIP_PATTERN.match(location):
+                record = self.city_index.lookup_zip(location) if self.city_index is not None else None
+                if record is None:
+                    return None
+                return IntentMatch("get_weather_information", {"city": record.city, "state": record.state_name}, 1.0)
+            resolved = self.gazetteer.resolve(location)
+            if resolved:
+                city, state, confidence = resolved
+                return IntentMatch("get_weather_information", {"city": city, "state": state}, confidence)
+            return None
+
+        play = self.PLAY_PATTERN.match(text)
+        if play and not self.AMBIGUOUS_PLAY_PATTERN.search(play.group('song')):
+            parameters = {"song_name": play.group('song').strip()}
+            if play.group('artist'):
+                parameters["artist_name"] = play.group('artist').strip()
+                return IntentMatch("search_and_play_song", parameters, 0.9)
+            return IntentMatch("search_and_play_song", parameters, 0.7)
+
+        return None
+
+    @staticmethod
+    def confirmation_for(intent: IntentMatch, result: Any) -> str:
+        if intent.function_name == "get_weather_information":
+            return result["weather_tool_response_needing_interpretation"]
+        if intent.function_name == "search_and_play_song":
+            if result.get("status") == "Playing successfully":
+                return f"Playing {result['song_name']} by {result['artist_name']}."
+            return f"Sorry, I couldn't find {intent.parameters['song_name']}."
+        if intent.function_name == "pause_playback":
+            return "Paused." if result.get("status", "").startswith("Successfully") else "Sorry, I couldn't pause the music."
+        return "Resuming." if result.get("status", "").startswith("Successfully") else "Sorry, I couldn't resume the music."
+
+    async def dispatch(self, transcript: str, assistant, tts_synthesizer,
+                       run_function: Callable[..., Awaitable[Any]]) -> bool:
+        """
+        Handles the transcript locally if it is a confident match.
+
+        Parameters:
+        - transcript: The user transcript.
+        - assistant: The GPTAssistant whose history should record the exchange.
+        - tts_synthesizer: The AsyncAudioSynthesizer used for the spoken confirmation.
+        - run_function: The tool dispatcher, called as run_function(name, parameters, query, stream=True).
+
+        Returns:
+        - True if the command was handled, False if it should go to the LLM.
+        """
+        start_time = time.perf_counter()
+        self.attempts += 1
+        intent = self.match(transcript)
+        if intent is None or intent.confidence < self.confidence_threshold:
+            return False
+
+        routing_time = time.perf_counter() - start_time
+        self.hits += 1
+        self.latency_saved += max(0.0, self.estimated_llm_latency() - routing_time)
+
+        if intent.function_name == "get_weather_information":
+            tts_synthesizer.enqueue_sentence("On it!")
+        result = await run_function(intent.function_name, intent.parameters, transcript, stream=True)
+        if isinstance(result, dict) and "weather_tool_response_stream" in result:
+            confirmation = await tts_synthesizer.speak_stream(result["weather_tool_response_stream"])
+            if not confirmation:
+                confirmation = "That is currently unavailable."
+                tts_synthesizer.enqueue_sentence(confirmation)
+        else:
+            confirmation = self.confirmation_for(intent, result)
+            tts_synthesizer.enqueue_sentence(confirmation)
+
+        await assistant.append_message("user", transcript)
+        await assistant.append_message("assistant", confirmation)
+        print(f"Routed locally to {intent.function_name} in {routing_time * 1000:.2f} ms "
+              f"(hit rate {self.hit_rate():.0%}, {self.latency_saved:.2f}s saved so far)")
+        return True
+
+    def record_llm_latency(self, seconds: float, smoothing: float = 0.2):
+        """Feeds back how long the LLM took to produce a tool call, to estimate time saved by local hits."""
+        if self.llm_tool_latency is None:
+            self.llm_tool_latency = seconds
+        else:
+            self.llm_tool_latency = (1 - smoothing) * self.llm_tool_latency + smoothing * seconds
+
+    def estimated_llm_latency(self) -> float:
+        return self.llm_tool_latency if self.llm_tool_latency is not None else DEFAULT_LLM_TOOL_LATENCY
+
+    def hit_rate(self) -> float:
+        return self.hits / self.attempts if self.attempts else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "attempts": self.attempts,
+            "hits": self.hits,
+            "hit_rate": self.hit_rate(),
+            "latency_saved_seconds": self.latency_saved,
+            "estimated_llm_tool_latency": self.estimated_llm_latency(),
+        }
+
+
+async def main():
+    city_index = CityIndex()
+    router = IntentRouter(city_index=city_index, home_city=city_index.nearest(43.6150, -116.2023))
+    transcripts = [
+        "Pause.",
+        "Resume the music.",
+        "Play Happiness by Ahssake.",
+        "What's the weather in Boise, Idaho?",
+        "Weather in 83702",
+        "What's the weather like today?",
+        "Weather for New York New York",
+        "Play some jazz",
+        "Tell me a joke.",
+    ]
+    for transcript in transcripts:
+        start_time = time.perf_counter()
+        intent = router.match(transcript)
+        print(f"{transcript!r} -> {intent} ({(time.perf_counter() - start_time) * 1e6:.0f} us)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
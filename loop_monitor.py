@@ -0,0 +1,246 @@
+#loop_monitor.py
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Dict, Optional
+
+# Set event loop policy on Windows for Python 3.8+
+if sys.platform.startswith('win'):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+
+class CallbackStats:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+
+class LoopMonitor:
+    """
+    Opt-in event loop instrumentation.
+
+    - A heartbeat coroutine measures scheduling lag: how late each sleep(interval) wakes up.
+    - A watchdog thread notices when the heartbeat is overdue by more than lag_threshold and
+      samples the loop thread's stack, attributing the stall to the innermost frame in this
+      project (e.g. play_from_queue calling stream.write).
+    - asyncio's Handle._run is wrapped to time every callback; ones slower than
+      slow_callback_threshold are aggregated per coroutine.
+
+    Summaries are printed every report_interval seconds and available from summary().
+    """
+
+    def __init__(self, interval: float = 0.05, lag_threshold: float = 0.1, slow_callback_threshold: float = 0.05,
+                 report_interval: float = 60.0, stack_depth: int = 6):
+        self.interval = interval
+        self.lag_threshold = lag_threshold
+        self.slow_callback_threshold = slow_callback_threshold
+        self.report_interval = report_interval
+        self.stack_depth = stack_depth
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id = None
+        self.last_beat = time.monotonic()
+        self.lags = deque(maxlen=10000)  # Lag samples since the last report
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.blocking_sites: Dict[str, int] = {}  # callsite -> stack samples taken while the loop was stuck there
+        self.blocking_stacks: Dict[str, str] = {}  # callsite -> last sampled stack, for the report
+        self.slow_callbacks: Dict[str, CallbackStats] = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.watchdog_thread = None
+        self.heartbeat_task = None
+        self.report_task = None
+        self.original_handle_run = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.install_callback_timer()
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+        if self.report_interval:
+            self.report_task = asyncio.create_task(self.report_periodically())
+        self.watchdog_thread = threading.Thread(target=self.watchdog, name="loop-monitor-watchdog", daemon=True)
+        self.watchdog_thread.start()
+        print(f"Loop monitor enabled (lag threshold {self.lag_threshold * 1000:.0f} ms)")
+
+    async def stop(self):
+        self.stopping.set()
+        for task in (self.heartbeat_task, self.report_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        if self.original_handle_run:
+            asyncio.events.Handle._run = self.original_handle_run
+            self.original_handle_run = None
+        if self.watchdog_thread:
+            self.watchdog_thread.join(timeout=1)
+        self.report()
+
+    async def heartbeat(self):
+        while True:
+            expected = self.loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, self.loop.time() - expected)
+            self.last_beat = time.monotonic()
+            with self.lock:
+                self.lags.append(lag)
+                self.max_lag = max(self.max_lag, lag)
+
+    def watchdog(self):
+        in_stall = False
+        while not self.stopping.wait(self.interval / 2):
+            overdue = time.monotonic() - self.last_beat - self.interval
+            if overdue < self.lag_threshold:
+                in_stall = False
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            # Drop the event loop's own frames (and our callback timer) so the sampled stack starts at the callback
+            stack = traceback.StackSummary.from_list(
+                [entry for entry in traceback.extract_stack(frame)
+                 if not entry.filename.startswith(ASYNCIO_DIR) and entry.name != 'timed_run'])
+            site = self.callsite(stack)
+            with self.lock:
+                if not in_stall:
+                    self.stalls += 1
+                self.blocking_sites[site] = self.blocking_sites.get(site, 0) + 1
+                self.blocking_stacks[site] = ''.join(traceback.format_list(stack[-self.stack_depth:]))
+            in_stall = True
+
+    @staticmethod
+    def callsite(stack: traceback.StackSummary) -> str:
+        # The innermost frame of our own code names the blocking call better than the library internals below it
+        for frame in reversed(stack):
+            if frame.filename.startswith(PROJECT_DIR) and not frame.filename.endswith('loop_monitor.py'):
+                return f"{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}: {frame.line}"
+        frame = stack[-1]
+        return f"{frame.filename}:{frame.lineno} in {frame.name}"
+
+    @staticmethod
+    def describe_callback(handle) -> str:
+        callback = handle._callback
+        # Task steps and wakeups are bound to the task; name them after the coroutine it runs
+        owner = getattr(callback, '__self__', None)
+        if isinstance(owner, asyncio.Task):
+            coroutine = owner.get_coro()
+            return getattr(coroutine, '__qualname__', repr(coroutine))
+        return getattr(callback, '__qualname__', repr(callback))
+
+    def install_callback_timer(self):
+        if self.original_handle_run:
+            return
+        original_run = self.original_handle_run = asyncio.events.Handle._run
+        monitor = self
+
+        def timed_run(handle):
+            start_time = time.perf_counter()
+            try:
+                return original_run(handle)
+            finally:
+                elapsed = time.perf_counter() - start_time
+                if elapsed >= monitor.slow_callback_threshold:
+                    name = monitor.describe_callback(handle)
+                    with monitor.lock:
+                        monitor.slow_callbacks.setdefault(name, CallbackStats()).add(elapsed)
+
+        asyncio.events.Handle._run = timed_run
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            lags = sorted(self.lags)
+            percentile = lambda pct: lags[min(len(lags) - 1, int(pct / 100 * len(lags)))] * 1000 if lags else 0.0
+            return {
+                "lag_samples": len(lags),
+                "lag_p50_ms": percentile(50),
+                "lag_p99_ms": percentile(99),
+                "lag_max_ms": self.max_lag * 1000,
+                "stalls": self.stalls,
+                "blocking_sites": dict(sorted(self.blocking_sites.items(), key=lambda item: item[1], reverse=True)),
+                "slow_callbacks": {
+                    name: {"count": stats.count, "total_ms": stats.total * 1000, "max_ms": stats.max * 1000}
+                    for name, stats in sorted(self.slow_callbacks.items(), key=lambda item: item[1].total, reverse=True)
+                },
+            }
+
+    def report(self):
+        summary = self.summary()
+        print(f"Loop lag: p50 {summary['lag_p50_ms']:.1f} ms, p99 {summary['lag_p99_ms']:.1f} ms, "
+              f"max {summary['lag_max_ms']:.1f} ms, {summary['stalls']} stalls over {self.lag_threshold * 1000:.0f} ms")
+        for site, samples in list(summary["blocking_sites"].items())[:5]:
+            print(f"  blocked ~{samples * self.interval / 2 * 1000:.0f} ms at {site}")
+            print('    ' + self.blocking_stacks[site].rstrip().replace('\n', '\n    '))
+        for name, stats in list(summary["slow_callbacks"].items())[:10]:
+            print(f"  slow callback {name}: {stats['count']}x, {stats['total_ms']:.0f} ms total, {stats['max_ms']:.0f} ms max")
+
+    def reset(self):
+        with self.lock:
+            self.lags.clear()
+            self.max_lag = 0.0
+            self.stalls = 0
+            self.blocking_sites.clear()
+            self.blocking_stacks.clear()
+            self.slow_callbacks.clear()
+
+    async def report_periodically(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.report()
+            self.reset()
+
+
+def start_from_environment() -> Optional[LoopMonitor]:
+    """
+    Starts a LoopMonitor on the running loop if ASSISTANT_LOOP_MONITOR is set, e.g.
+    ASSISTANT_LOOP_MONITOR=1 LOOP_MONITOR_LAG_MS=100 LOOP_MONITOR_REPORT_SECONDS=60.
+    """
+    if os.environ.get("ASSISTANT_LOOP_MONITOR", "").lower() not in ("1", "true", "yes"):
+        return None
+    monitor = LoopMonitor(
+        lag_threshold=float(os.environ.get("LOOP_MONITOR_LAG_MS", "100")) / 1000,
+        slow_callback_threshold=float(os.environ.get("LOOP_MONITOR_SLOW_CALLBACK_MS", "50")) / 1000,
+        report_interval=float(os.environ.get("LOOP_MONITOR_REPORT_SECONDS", "60")),
+    )
+    monitor.start()
+    return monitor
+
+
+async def main():
+    monitor = LoopMonitor(report_interval=0)
+    monitor.start()
+
+    async def blocking_worker():
+        for _ in range(3):
+            time.sleep(0.3)  # Deliberately blocks the loop
+            await asyncio.sleep(0.2)
+
+    async def well_behaved_worker():
+        for _ in range(3):
+            await asyncio.to_thread(time.sleep, 0.3)
+            await asyncio.sleep(0.2)
+
+    await asyncio.gather(blocking_worker(), well_behaved_worker())
+    await monitor.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
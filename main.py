@@ -1,6 +1,7 @@
 #main.py
 
 import asyncio
+import os
 from typing import Any, Dict
 import time
 from transcription import AzureSpeechRecognizer
@@ -11,6 +12,12 @@ from weather import WeatherAPI
 from async_spotify import AsyncSpotifyClient
 from async_synthesizer import AsyncAudioSynthesizer
 from wake import AsyncWakeWordDetector
+from intent_router import IntentRouter
+from forecast_prefetch import ForecastPrefetcher
+from loop_monitor import start_from_environment as start_loop_monitor
+from rate_limiter import scheduler
+from usage import SessionUsage, end_session, track_turn
+from tool_selector import tool_selector
 # Set event loop policy for Windows to prevent potential compatibility issues
 if sys.platform.startswith('win'):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -58,6 +65,7 @@ async def enqueue_sentences(tts_queue: asyncio.Queue, text: str):
 
 
 async def main(weather_api: WeatherAPI, spotify_client: AsyncSpotifyClient):
+    loop_monitor = start_loop_monitor()  # Only when ASSISTANT_LOOP_MONITOR is set
     await spotify_client.async_init()
     tts_synthesizer = AsyncAudioSynthesizer()
     assistant = GPTAssistant(ai_model="gpt-4-turbo-preview")
@@ -66,6 +74,10 @@ async def main(weather_api: WeatherAPI, spotify_client: AsyncSpotifyClient):
     
     detector = AsyncWakeWordDetector(model_path=model_path)
     speech_recognizer = AzureSpeechRecognizer()
+    intent_router = IntentRouter(city_index=await weather_api.get_city_index(), home_city=await weather_api.home_city())
+    prefetcher = ForecastPrefetcher(weather_api)
+    prefetcher.start()
+    session_usage = SessionUsage()
 
     async def check_and_clear_messages():
         while True:
@@ -77,42 +89,105 @@ async def main(weather_api: WeatherAPI, spotify_client: AsyncSpotifyClient):
                 assistant.messages = [assistant.messages[0]] if len(assistant.messages) > 1 else assistant.messages
                 print("Messages cleared due to inactivity.")
 
+    async def run_turn(transcript: str):
+        with track_turn(session_usage) as turn_usage:
+            checkpoint = assistant.checkpoint()
+            try:
+                # Background forecast refreshes hold off until the turn is over
+                async with prefetcher.foreground():
+                    if await intent_router.dispatch(transcript, assistant, tts_synthesizer, run_function_async):
+                        turn_usage.label = "intent"
+                    else:
+                        turn_usage.label = "assistant"
+                        print("Assistant: ", end="", flush=True)
+                        assistant_response = await process_query_with_assistant(assistant, transcript, tts_synthesizer, intent_router)
+
+                        if not assistant_response:
+                            print("No response or further action required.")
+            except asyncio.CancelledError:
+                # Barge-in: forget the half-finished exchange so the history stays consistent
+                assistant.rollback(checkpoint)
+                raise
+            # Let the queued sentences reach TTS so their characters and audio count towards this turn
+            await tts_synthesizer.sentence_queue.join()
+
     message_check_task = asyncio.create_task(check_and_clear_messages())
+    current_turn = None
 
     try:
         while True:
+            # The detector keeps listening while a turn is streaming or playing, so the user can barge in
             detected = await detector.detect_wake_word()
             if detected:
+                if (current_turn and not current_turn.done()) or tts_synthesizer.is_busy():
+                    await interrupt_turn(current_turn, tts_synthesizer)
+                    print("Barge-in: previous turn cancelled.")
                 print("Wake word detected, action can be initiated.")
                 print("Listening for user input...")
-                transcript = await asyncio.to_thread(speech_recognizer.recognize_speech_from_microphone)
+                transcript = await speech_recognizer.recognize()
+                detector.clear_buffer()
                 
                 if transcript:
                     if "exit" in transcript.lower() and len(transcript) <= 5:
                         break
 
                     print(f"User: {transcript}")
-                    print("Assistant: ", end="", flush=True)
-                    assistant_response = await process_query_with_assistant(assistant, transcript, tts_synthesizer)
-                    
-                    if not assistant_response:
-                        print("No response or further action required.")
+                    current_turn = asyncio.create_task(run_turn(transcript))
             else:
                 await asyncio.sleep(0.1)
                 
     finally:
+        if current_turn and not current_turn.done():
+            await interrupt_turn(current_turn, tts_synthesizer)
         message_check_task.cancel()
         try:
             await message_check_task
         except asyncio.CancelledError:
             pass
+        await prefetcher.stop()
+        if loop_monitor:
+            await loop_monitor.stop()
         print("Session ended and resources have been cleaned up.")
         await weather_api.close()
+        print(f"Forecast prefetcher: {prefetcher.stats()}")
+        print(f"Speech synthesis: {tts_synthesizer.stats()}")
+        print(f"API scheduler: {scheduler.stats()}")
+        print(f"Weather interpretation: {weather_api.interpreter.stats()}")
+        print(f"Local weather answers: {weather_api.answer_engine.stats()}")
+        print(f"Weather interpretation cache: {weather_api.interpretations.stats()}")
+        print(f"Intent router: {intent_router.stats()}")
+        print(f"Tool selection: {tool_selector.stats()}")
+        print(f"Speech recognition: {speech_recognizer.stats()}")
+        print(f"API usage: {session_usage.totals.snapshot()}")
+        end_session(session_usage)
         print(assistant.messages)
 
 
+async def interrupt_turn(turn_task: asyncio.Task, tts_synthesizer: AsyncAudioSynthesizer):
+    """
+    Stops everything the current turn is doing: playback and queued synthesis first, so the
+    speaker goes quiet immediately, then the turn task itself (which closes the OpenAI stream
+    and cancels any in-flight tool call).
+    
+    Parameters:
+    - turn_task: The task running the turn, or None if only audio is still playing.
+    - tts_synthesizer: The AsyncAudioSynthesizer to flush.
+    """
+    tts_synthesizer.interrupt()
+    if turn_task and not turn_task.done():
+        turn_task.cancel()
+        try:
+            await turn_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Interrupted turn failed: {e}")
+    # The turn may have queued more sentences between the flush and its cancellation
+    tts_synthesizer.interrupt()
 
-async def process_query_with_assistant(assistant: GPTAssistant, query: str, tts_synthesizer: AsyncAudioSynthesizer) -> None:
+
+async def process_query_with_assistant(assistant: GPTAssistant, query: str, tts_synthesizer: AsyncAudioSynthesizer,
+                                       intent_router: IntentRouter = None) -> None:
     """
     Processes a user query with the GPTAssistant and manages tool calls if necessary,
     enqueueing responses to the TTS queue.
@@ -121,14 +196,16 @@ async def process_query_with_assistant(assistant: GPTAssistant, query: str, tts_
     - assistant: The GPTAssistant instance for processing queries.
     - query: The user query string.
     - tts_queue: The asyncio.Queue instance for the TTS module.
+    - intent_router: Optional IntentRouter that is told how long the LLM took to produce a tool call.
     """
     tts_synthesizer.done_flag=False
     response_accumulator = ""
     assistant_response=""
     sentence_accumulator = ""
     start_time = time.perf_counter()
+    turn = assistant.new_turn()
 
-    async for chunk in assistant.process_transcript(query):
+    async for chunk in assistant.process_transcript(query, turn):
         #print(chunk, end="", flush=True)
         response_accumulator += chunk
         sentence_accumulator+=chunk
@@ -146,13 +223,15 @@ async def process_query_with_assistant(assistant: GPTAssistant, query: str, tts_
             tts_synthesizer.enqueue_sentence(sentence)
 
     # Determine the next steps based on assistant's response and tool calls
-    if not response_accumulator and not assistant.is_tool_called:
+    if not response_accumulator and not turn.is_tool_called:
         return "No responses received. Please check the query or the assistant's configuration."
     
-    if not response_accumulator and assistant.is_tool_called:
+    if not response_accumulator and turn.is_tool_called:
+        if intent_router:
+            intent_router.record_llm_latency(time.perf_counter() - start_time)
         tts_synthesizer.enqueue_sentence("On it!")
         further_processing_required = await handle_tool_calls(
-            assistant.tools_called["calls"], query, assistant
+            turn.tools_called["calls"], query, assistant, tts_synthesizer
         )
         
         if further_processing_required:
@@ -174,17 +253,15 @@ async def process_query_with_assistant(assistant: GPTAssistant, query: str, tts_
                 for sentence in sentences:
                     tts_synthesizer.enqueue_sentence(sentence)
         else:
-            #print(assistant.messages[-1]['content'])
-            # sentences = split_into_sentences(assistant.messages[-1]['content'])
-            # for sentence in sentences:
-            tts_synthesizer.enqueue_sentence(assistant.messages[-1]['content'])
+            # The single weather answer has already been spoken as it streamed in
             tts_synthesizer.done_flag=False
                 
     print(f"--- Processed in {time.perf_counter() - start_time} seconds ---")
     tts_synthesizer.done_flag=True
     return assistant_response
 
-async def handle_tool_calls(tool_calls: Dict[str, Any], query: str, assistant: GPTAssistant) -> bool:
+async def handle_tool_calls(tool_calls: Dict[str, Any], query: str, assistant: GPTAssistant,
+                            tts_synthesizer: AsyncAudioSynthesizer) -> bool:
     """
     Handles asynchronous calls to external tools based on the assistant's requirements.
     
@@ -192,30 +269,42 @@ async def handle_tool_calls(tool_calls: Dict[str, Any], query: str, assistant: G
     - tool_calls: A dictionary of the tool calls to be processed.
     - query: The original query string for context.
     - assistant: The GPTAssistant instance.
+    - tts_synthesizer: Speaks a single weather answer as it streams in.
     
     Returns:
     - A boolean indicating if further processing is required after handling tool calls.
     """
     if len(tool_calls) == 1 and tool_calls[0]['function_name'] == "get_weather_information":
         # Process a single tool call, specifically for weather information
-        await process_single_tool_call(tool_calls[0], query, assistant)
+        await process_single_tool_call(tool_calls[0], query, assistant, tts_synthesizer)
         return False
     else:
         # Process multiple tool calls concurrently
         await process_multiple_tool_calls(tool_calls, assistant)
         return True
 
-async def process_single_tool_call(tool_call: Dict[str, Any], query: str, assistant: GPTAssistant):
+async def process_single_tool_call(tool_call: Dict[str, Any], query: str, assistant: GPTAssistant,
+                                   tts_synthesizer: AsyncAudioSynthesizer):
     """
-    Specialized handling for a single tool call, appending the result directly to the assistant's messages.
+    Specialized handling for a single tool call: speaks the answer (sentence by sentence as it streams
+    in, when it comes from the LLM) and then appends it to the assistant's messages.
     
     Parameters:
     - tool_call: The specific tool call to process.
     - query: The original query string for context.
     - assistant: The GPTAssistant instance.
+    - tts_synthesizer: The AsyncAudioSynthesizer the answer is spoken through.
     """
-    result = await run_function_async(tool_call['function_name'], tool_call['parameters'], query)
-    await assistant.append_message("assistant", result["weather_tool_response_needing_interpretation"])
+    result = await run_function_async(tool_call['function_name'], tool_call['parameters'], query, stream=True)
+    if "weather_tool_response_stream" in result:
+        answer = await tts_synthesizer.speak_stream(result["weather_tool_response_stream"])
+        if not answer:
+            answer = "That is currently unavailable."
+            tts_synthesizer.enqueue_sentence(answer)
+    else:
+        answer = result["weather_tool_response_needing_interpretation"]
+        tts_synthesizer.enqueue_sentence(answer)
+    await assistant.append_message("assistant", answer)
 
 async def process_multiple_tool_calls(tool_calls: Dict[str, Any], assistant: GPTAssistant):
     """
@@ -236,7 +325,24 @@ async def process_multiple_tool_calls(tool_calls: Dict[str, Any], assistant: GPT
             "content": f"Tool Response: {response}",
         })
 
-async def run_function_async(function_name: str, arguments: Dict[str, Any], query: str) -> Any:
+# Tool name -> coroutine function, filled in by register_tools so main() and server mode share one set of clients
+tool_registry: Dict[str, Any] = {}
+
+def register_tools(weather_api: WeatherAPI, spotify_client: AsyncSpotifyClient):
+    """
+    Registers the tool functions that run_function_async dispatches to.
+    
+    Parameters:
+    - weather_api: The shared WeatherAPI instance.
+    - spotify_client: The shared AsyncSpotifyClient instance, or None to run without Spotify.
+    """
+    tool_registry["get_weather_information"] = weather_api.process_weather_query
+    if spotify_client is not None:
+        tool_registry["search_and_play_song"] = spotify_client.search_and_play_song
+        tool_registry["pause_playback"] = spotify_client.pause_playback
+        tool_registry["start_playback"] = spotify_client.start_playback
+
+async def run_function_async(function_name: str, arguments: Dict[str, Any], query: str, stream: bool = False) -> Any:
     """
     Dispatches asynchronous function calls based on the provided function name and arguments.
     
@@ -244,31 +350,26 @@ async def run_function_async(function_name: str, arguments: Dict[str, Any], quer
     - function_name: The name of the function to call.
     - arguments: The arguments to pass to the function.
     - query: The original query string for context, if applicable.
+    - stream: Ask the weather tool for a streamed answer (see WeatherAPI.process_weather_query).
     
     Returns:
     - The result of the function call.
     """
-    function_map = {
-        "get_weather_information": weather_api.process_weather_query,
-        "search_and_play_song": spotify_client.search_and_play_song,
-        "pause_playback": spotify_client.pause_playback,
-        "start_playback": spotify_client.start_playback,
-    }
-
-    if function_name not in function_map:
+    if function_name not in tool_registry:
         raise ValueError(f"Function {function_name} is not supported.")
     
     # For functions that do not require arguments
     if function_name in ["pause_playback", "start_playback"]:
-        return await function_map[function_name]()
+        return await tool_registry[function_name]()
     elif function_name == "get_weather_information":
-        return await function_map[function_name](query=query, **arguments)
+        return await tool_registry[function_name](query=query, stream=stream, **arguments)
     else:
-        return await function_map[function_name](**arguments)
+        return await tool_registry[function_name](**arguments)
 
 
 if __name__ == "__main__":
     weather_api = WeatherAPI()
     spotify_client = AsyncSpotifyClient()
+    register_tools(weather_api, spotify_client)
     
     asyncio.run(main(weather_api, spotify_client))
\ No newline at end of file
@@ -0,0 +1,319 @@
+#rate_limiter.py
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import re
+import sys
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import aiohttp
+from openai import APIConnectionError, APIStatusError
+import usage
+
+# Set event loop policy on Windows for Python 3.8+
+if sys.platform.startswith('win'):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Priority for requests made from the current task; background work such as the forecast prefetcher sets BACKGROUND
+request_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """Parses x-ratelimit-reset-* values such as '20ms', '1s' or '6m0s' into seconds."""
+    parts = DURATION_PATTERN.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class QueueDelayStats:
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def summary(self) -> Dict[str, float]:
+        recent = sorted(self.recent)
+        p95 = recent[min(len(recent) - 1, int(0.95 * len(recent)))] if recent else 0.0
+        return {"requests": self.count, "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+                "p95_ms": p95 * 1000, "max_ms": self.max * 1000}
+
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of recent traffic: every first attempt deposits `ratio`, every
+    retry withdraws one. A provider that is failing outright stops being retried into.
+    """
+
+    def __init__(self, ratio: float = 0.2, reserve: float = 5.0, capacity: float = 20.0):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.balance = reserve
+
+    def deposit(self):
+        self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+class ProviderLimiter:
+    """
+    Token bucket for one provider, fed by rate-limit headers: requests queue by priority, a
+    `Retry-After` or an exhausted `x-ratelimit-remaining-*` blocks the bucket until the reset, and a
+    nearly exhausted allowance paces the remaining requests over the reset window.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.rate = rate  # Requests per second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.paced_rate = None  # Slower rate derived from headers, until paced_until
+        self.paced_until = 0.0
+        self.waiters = []  # Heap of (priority, sequence, future)
+        self.sequence = itertools.count()
+        self.wakeup_handle = None
+        self.queue_delays = {priority: QueueDelayStats() for priority in PRIORITY_NAMES}
+        self.throttled = 0
+        self.retries = 0
+        self.budget = RetryBudget()
+
+    def current_rate(self, now: float) -> float:
+        if self.paced_rate is not None and now < self.paced_until:
+            return min(self.rate, self.paced_rate)
+        return self.rate
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.current_rate(now))
+        self.updated = now
+
+    def time_until_available(self) -> float:
+        now = time.monotonic()
+        self.refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.current_rate(now))
+        return wait
+
+    async def acquire(self, priority: int = INTERACTIVE):
+        start_time = time.monotonic()
+        if not self.waiters and self.time_until_available() == 0:
+            self.tokens -= 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+            self.grant_waiters()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self.tokens += 1  # Granted just as we were cancelled; hand the token back
+                    self.grant_waiters()
+                raise
+        self.queue_delays[priority].add(time.monotonic() - start_time)
+
+    def grant_waiters(self):
+        if self.wakeup_handle:
+            self.wakeup_handle.cancel()
+            self.wakeup_handle = None
+        while self.waiters:
+            future = self.waiters[0][2]
+            if future.done():  # Cancelled while queued
+                heapq.heappop(self.waiters)
+                continue
+            wait = self.time_until_available()
+            if wait > 0:
+                self.wakeup_handle = asyncio.get_running_loop().call_later(wait, self.grant_waiters)
+                return
+            heapq.heappop(self.waiters)
+            self.tokens -= 1
+            future.set_result(None)
+
+    def update_from_headers(self, headers):
+        now = time.monotonic()
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+        if retry_after is not None:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if remaining is None or reset is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            if remaining <= 0:
+                self.blocked_until = max(self.blocked_until, now + reset)
+            elif kind == "requests" and reset > 0 and remaining / reset < self.rate:
+                # Spread what is left of the window instead of spending it in a burst and hitting 429
+                self.paced_rate = remaining / reset
+                self.paced_until = now + reset
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_delay": {PRIORITY_NAMES[priority]: delays.summary() for priority, delays in self.queue_delays.items()},
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "retry_budget": round(self.budget.balance, 2),
+        }
+
+
+class ClientScheduler:
+    """
+    Shared scheduler for outbound API calls. Every call waits for its provider's token bucket
+    (interactive turns ahead of background work), feeds the response's rate-limit headers back
+    into the bucket, and retries transient failures with full-jitter backoff while the
+    provider's retry budget allows.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, float]]] = None, max_attempts: int = 3,
+                 base_delay: float = 0.25, max_delay: float = 8.0):
+        self.limiters: Dict[str, ProviderLimiter] = {}
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        for name, (rate, burst) in (limits or {}).items():
+            self.configure(name, rate, burst)
+
+    def configure(self, name: str, rate: float, burst: float) -> ProviderLimiter:
+        self.limiters[name] = ProviderLimiter(name, rate, burst)
+        return self.limiters[name]
+
+    def limiter(self, name: str) -> ProviderLimiter:
+        if name not in self.limiters:
+            self.configure(name, rate=5.0, burst=5.0)
+        return self.limiters[name]
+
+    @staticmethod
+    def classify(error: Exception) -> Tuple[bool, Optional[int], Optional[Any]]:
+        """Returns (retryable, status, headers) for an exception raised by a client call."""
+        if isinstance(error, APIStatusError):
+            return error.status_code in RETRYABLE_STATUSES, error.status_code, error.response.headers
+        if isinstance(error, aiohttp.ClientResponseError):
+            return error.status in RETRYABLE_STATUSES, error.status, error.headers
+        if isinstance(error, (APIConnectionError, aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+            return True, None, None
+        return False, None, None
+
+    async def call(self, provider: str, send: Callable[[], Awaitable[Any]], priority: Optional[int] = None):
+        """
+        Runs send() under the provider's limits and retry policy.
+
+        Parameters:
+        - provider: Limiter name, e.g. "openai", "groq" or "nws".
+        - send: Makes one attempt. If the result has `.headers` (an OpenAI raw response), they update the limiter.
+        - priority: INTERACTIVE or BACKGROUND; defaults to the current task's request_priority.
+        """
+        priority = request_priority.get() if priority is None else priority
+        limiter = self.limiter(provider)
+        attempt = 0
+        while True:
+            attempt += 1
+            await limiter.acquire(priority)
+            if attempt == 1:
+                limiter.budget.deposit()
+            usage.record(provider, calls=1)  # Every attempt is an HTTP call, retries included
+            try:
+                result = await send()
+            except Exception as error:
+                retryable, status, headers = self.classify(error)
+                if headers is not None:
+                    limiter.update_from_headers(headers)
+                if status == 429:
+                    limiter.throttled += 1
+                if not retryable or attempt >= self.max_attempts or not limiter.budget.withdraw():
+                    raise
+                limiter.retries += 1
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                print(f"{provider} request failed ({status or type(error).__name__}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)  # A Retry-After is enforced by the limiter on the next acquire
+                continue
+
+            headers = getattr(result, "headers", None)
+            if headers is not None:
+                limiter.update_from_headers(headers)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+
+def limits_from_environment(defaults: Dict[str, Tuple[float, float]]) -> Dict[str, Tuple[float, float]]:
+    """Applies overrides such as GROQ_RATE_LIMIT="0.5,5" (requests per second, burst)."""
+    limits = dict(defaults)
+    for name in defaults:
+        value = os.environ.get(f"{name.upper()}_RATE_LIMIT")
+        if value:
+            rate, _, burst = value.partition(",")
+            limits[name] = (float(rate), float(burst or rate))
+    return limits
+
+
+# Client-side ceilings; the providers' headers tighten these at runtime
+scheduler = ClientScheduler(limits_from_environment({
+    "openai": (5.0, 10.0),
+    "groq": (0.5, 5.0),
+    "nws": (5.0, 5.0),
+}))
+
+
+async def main():
+    demo = ClientScheduler({"demo": (5.0, 2.0)})
+    completed = []
+
+    async def send(label):
+        completed.append(label)
+
+    async def request(label, priority):
+        await demo.call("demo", lambda: send(label), priority)
+
+    # Background work queued first still yields to interactive requests once the burst is spent
+    await asyncio.gather(*[request(f"background-{index}", BACKGROUND) for index in range(4)],
+                         *[request(f"interactive-{index}", INTERACTIVE) for index in range(4)])
+    print(completed)
+    print(demo.stats())
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,212 @@
+#server.py
+
+import asyncio
+import base64
+import itertools
+import json
+import os
+import sys
+from typing import Any, Dict, Optional
+from openai import AsyncOpenAI
+from assistant_gpt import GPTAssistant
+from forecast_prefetch import ForecastPrefetcher
+from async_spotify import AsyncSpotifyClient
+from async_synthesizer import AsyncAudioSynthesizer, create_tts_client
+from city_index import CityIndex
+from intent_router import IntentRouter
+from loop_monitor import start_from_environment as start_loop_monitor
+from main import process_query_with_assistant, register_tools, run_function_async
+from transcription import AzureSpeechRecognizer
+from weather import WeatherAPI
+import cassette
+from usage import SessionUsage, end_session, track_turn
+
+# Set event loop policy on Windows for Python 3.8+
+if sys.platform.startswith('win'):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+# Base64 audio makes for long lines; the asyncio default of 64 KiB is far too small
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+
+class AssistantSession:
+    """
+    One connected endpoint. Owns its own conversation history, turn state and TTS queues,
+    while borrowing the pooled clients held by the AssistantServer.
+
+    Messages are newline-delimited JSON objects. Clients send
+    {"type": "text", "text": ...}, {"type": "audio", "data": <base64 16 kHz 16-bit mono PCM>}
+    or {"type": "reset"}; the server answers with "transcript", "audio", "turn_end" and "error" messages.
+    Audio messages name their "encoding": LINEAR16 PCM, or OGG_OPUS / MP3 passed through still compressed.
+    """
+
+    def __init__(self, session_id: int, server: "AssistantServer", reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.session_id = session_id
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.assistant = GPTAssistant(ai_model=server.ai_model, openai_client=server.openai_client)
+        self.tts_synthesizer = AsyncAudioSynthesizer(tts_client=server.tts_client, play_audio=False)
+        self.write_lock = asyncio.Lock()
+        self.usage = SessionUsage(session_id)
+        self.forwarding_task = asyncio.create_task(self.forward_audio())
+
+    async def send(self, message: Dict[str, Any]):
+        async with self.write_lock:
+            self.writer.write(json.dumps(message).encode() + b"\n")
+            await self.writer.drain()
+
+    async def forward_audio(self):
+        while True:
+            audio_content = await self.tts_synthesizer.audio_queue.get()
+            try:
+                await self.send({
+                    "type": "audio",
+                    "encoding": self.tts_synthesizer.audio_encoding,
+                    "sample_rate": self.tts_synthesizer.rate,
+                    "data": base64.b64encode(audio_content).decode("ascii"),
+                })
+            except ConnectionError as e:
+                print(f"Session {self.session_id}: failed to send audio: {e}")
+            finally:
+                self.tts_synthesizer.audio_queue.task_done()
+
+    async def handle_turn(self, transcript: str):
+        await self.send({"type": "transcript", "text": transcript})
+        with track_turn(self.usage, label="intent") as turn_usage:
+            async with self.server.prefetcher.foreground():
+                if not await self.server.intent_router.dispatch(transcript, self.assistant, self.tts_synthesizer, run_function_async):
+                    turn_usage.label = "assistant"
+                    await process_query_with_assistant(self.assistant, transcript, self.tts_synthesizer, self.server.intent_router)
+
+            await self.tts_synthesizer.sentence_queue.join()
+            await self.tts_synthesizer.audio_queue.join()
+        await self.send({"type": "turn_end"})
+
+    async def handle_message(self, message: Dict[str, Any]):
+        message_type = message.get("type")
+        if message_type == "text":
+            await self.handle_turn(message["text"])
+        elif message_type == "audio":
+            audio_data = base64.b64decode(message["data"])
+            transcript = await asyncio.to_thread(self.server.speech_recognizer.recognize_speech_from_audio,
+                                                 audio_data, message.get("sample_rate", 16000))
+            if transcript:
+                await self.handle_turn(transcript)
+            else:
+                await self.send({"type": "error", "error": "No speech could be recognized"})
+        elif message_type == "reset":
+            self.assistant.messages = [self.assistant.messages[0]]
+            await self.send({"type": "turn_end"})
+        else:
+            await self.send({"type": "error", "error": f"Unsupported message type: {message_type}"})
+
+    async def run(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                await self.send({"type": "error", "error": "Messages must be one JSON object per line"})
+                continue
+
+            try:
+                await self.handle_message(message)
+            except Exception as e:
+                print(f"Session {self.session_id}: error handling message: {e}")
+                await self.send({"type": "error", "error": str(e)})
+
+    def close(self):
+        end_session(self.usage)
+        self.forwarding_task.cancel()
+        self.tts_synthesizer.close()
+        self.writer.close()
+
+
+class AssistantServer:
+    """
+    Serves many thin endpoints from one process. Every session gets isolated conversation
+    and turn state; the OpenAI, TTS, speech, weather and Spotify clients (and their
+    connection pools and caches) are created once and shared.
+    """
+
+    def __init__(self, ai_model: str = "gpt-4-turbo-preview", max_sessions: int = 64, enable_spotify: bool = True):
+        self.ai_model = ai_model
+        self.max_sessions = max_sessions
+        self.enable_spotify = enable_spotify
+        self.openai_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=cassette.http_client("openai"))
+        self.tts_client = create_tts_client()
+        self.speech_recognizer = AzureSpeechRecognizer(use_default_microphone=False)
+        # One CityIndex serves both the intent router's gazetteer and the weather API
+        city_index = CityIndex()
+        self.intent_router = IntentRouter(city_index=city_index)
+        self.weather_api = WeatherAPI(city_index=city_index)
+        self.prefetcher = ForecastPrefetcher(self.weather_api)
+        self.spotify_client: Optional[AsyncSpotifyClient] = None
+        self.sessions: Dict[int, AssistantSession] = {}
+        self.session_ids = itertools.count(1)
+
+    async def start(self):
+        if self.enable_spotify:
+            self.spotify_client = AsyncSpotifyClient()
+            await self.spotify_client.async_init()
+        register_tools(self.weather_api, self.spotify_client)
+        self.prefetcher.start()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if len(self.sessions) >= self.max_sessions:
+            writer.write(json.dumps({"type": "error", "error": "Server is at capacity"}).encode() + b"\n")
+            await writer.drain()
+            writer.close()
+            return
+
+        session = AssistantSession(next(self.session_ids), self, reader, writer)
+        self.sessions[session.session_id] = session
+        print(f"Session {session.session_id} connected ({len(self.sessions)} active)")
+        try:
+            await session.run()
+        except ConnectionError:
+            pass
+        finally:
+            session.close()
+            del self.sessions[session.session_id]
+            print(f"Session {session.session_id} disconnected ({len(self.sessions)} active)")
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, socket_path: Optional[str] = None):
+        loop_monitor = start_loop_monitor()  # Only when ASSISTANT_LOOP_MONITOR is set
+        await self.start()
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle_connection, path=socket_path, limit=MAX_MESSAGE_SIZE)
+            print(f"Assistant server listening on {socket_path}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_MESSAGE_SIZE)
+            print(f"Assistant server listening on {host}:{port}")
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for session in list(self.sessions.values()):
+                session.close()
+            await self.prefetcher.stop()
+            if loop_monitor:
+                await loop_monitor.stop()
+            await self.weather_api.close()
+
+
+async def main():
+    server = AssistantServer(
+        ai_model=os.environ.get("ASSISTANT_MODEL", "gpt-4-turbo-preview"),
+        max_sessions=int(os.environ.get("ASSISTANT_MAX_SESSIONS", "64")),
+        enable_spotify=bool(os.environ.get("SPOTIFY_CLIENT_ID")),
+    )
+    await server.serve(
+        host=os.environ.get("ASSISTANT_SERVER_HOST", "127.0.0.1"),
+        port=int(os.environ.get("ASSISTANT_SERVER_PORT", "8765")),
+        socket_path=os.environ.get("ASSISTANT_SERVER_SOCKET"),
+    )
+
+if __name__ == "__main__":
+    asyncio.run(main())
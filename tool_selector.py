@@ -0,0 +1,113 @@
+#tool_selector.py
+
+import json
+import os
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, Pattern, Tuple
+from configure import tools
+
+# TOOL_SELECTION=0 sends every tool with every request, as before
+TOOL_SELECTION = os.environ.get("TOOL_SELECTION", "1") != "0"
+
+# Tools that are offered together, and the words that make them relevant
+TOOL_FAMILIES: Dict[str, Tuple[Tuple[str, ...], Pattern]] = {
+    "weather": (
+        ("get_weather_information",),
+        re.compile(r"\b(?:weather|forecast|rain\w*|snow\w*|storm\w*|wind\w*|temperature|degrees|hot|cold|warm|"
+                   r"sunny|cloudy|umbrella|jacket|humid\w*|freez\w*|outside|nice out)\b", re.IGNORECASE),
+    ),
+    "music": (
+        ("search_and_play_song", "pause_playback", "start_playback"),
+        re.compile(r"\b(?:play\w*|song|songs|music|track|album|artist|spotify|pause|resume|unpause|skip|"
+                   r"listen\w*|playlist|put on|next|previous)\b", re.IGNORECASE),
+    ),
+}
+
+# Turns made only of these phrases can't need a tool; any other turn that matches no family gets every tool
+CHIT_CHAT_PATTERN = re.compile(
+    r"(?:\W*\b(?:(?:hi|hello|hey) there|hi|hello|hey|yo|thanks|thank you|thank you so much|cheers|ok|okay|cool|great|nice|awesome|yes|yeah|no|nope|"
+    r"sure|bye|goodbye|see you|good (?:morning|afternoon|evening|night)|how are you(?: doing)?|how's it going|what's up|"
+    r"who are you|what's your name|what is your name|tell me a joke|never ?mind|that's all|i'm good|i'm fine|"
+    r"you too|me too|sounds good|got it)\b)+\W*",
+    re.IGNORECASE,
+)
+
+
+class ToolSelector:
+    """
+    Picks the tool schemas worth sending with a request from the words of the user's turn.
+
+    A conversation's tool set only grows: once a tool has been offered it stays until the history is
+    cleared, so tool results and follow-ups ("and tomorrow?") keep their tool, and the tools block at
+    the front of the prompt stays byte-identical across turns for provider-side prompt caching.
+    Tools with no family are always offered, so a newly added tool is never hidden. Before any
+    family has been offered, only turns that are clearly chit-chat go out without one: a turn that
+    matches no family and isn't chit-chat could still need a tool ("Can you put on some Drake"), so
+    it gets the full set. Once a family is offered, unmatched turns keep the current set.
+    """
+
+    def __init__(self, tool_schemas: List[Dict[str, Any]], families: Dict[str, Tuple[Tuple[str, ...], Pattern]] = TOOL_FAMILIES,
+                 enabled: bool = TOOL_SELECTION, chit_chat: Pattern = CHIT_CHAT_PATTERN):
+        self.tool_schemas = tool_schemas
+        self.order = [schema["function"]["name"] for schema in tool_schemas]
+        available = set(self.order)
+        self.families = {name: (frozenset(members) & available, pattern) for name, (members, pattern) in families.items()}
+        family_members = frozenset().union(*(members for members, _ in self.families.values()))
+        self.always = frozenset(self.order) - family_members
+        self.enabled = enabled
+        self.chit_chat = chit_chat
+        self.subsets: Dict[FrozenSet[str], Tuple[List[Dict[str, Any]], int]] = {}  # Names -> (schemas, serialized size)
+        self.full_size = len(json.dumps(tool_schemas))
+        self.requests = 0
+        self.tools_sent = 0
+        self.bytes_sent = 0
+
+    def select(self, text: str, current: Iterable[str] = ()) -> FrozenSet[str]:
+        """Returns the current tool set plus whatever the new user text calls for."""
+        text = text or ""
+        if not self.enabled:
+            return frozenset(self.order)
+        selected = set(current) | self.always
+        matched = False
+        for members, pattern in self.families.values():
+            if pattern.search(text):
+                selected |= members
+                matched = True
+        if not matched and not (selected - self.always) and not self.chit_chat.fullmatch(text):
+            return frozenset(self.order)  # Nothing offered yet and unsure, so offer everything; cached like any other
+        return frozenset(selected)
+
+    def schemas(self, names: FrozenSet[str]) -> List[Dict[str, Any]]:
+        """The schemas for names in configure's order, built once per distinct set and then reused."""
+        if names not in self.subsets:
+            subset = [schema for schema in self.tool_schemas if schema["function"]["name"] in names]
+            self.subsets[names] = (subset, len(json.dumps(subset)) if subset else 0)
+        subset, size = self.subsets[names]
+        self.requests += 1
+        self.tools_sent += len(subset)
+        self.bytes_sent += size
+        return subset
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "tools_per_request": self.tools_sent / self.requests if self.requests else 0.0,
+            "schema_bytes_per_request": self.bytes_sent / self.requests if self.requests else 0.0,
+            "full_schema_bytes": self.full_size,
+            "distinct_subsets": len(self.subsets),
+        }
+
+
+tool_selector = ToolSelector(tools)
+
+
+def main():
+    selected = frozenset()
+    for text in ["How are you doing?", "What's the weather like in Boise?", "And tomorrow?", "What about Saturday?",
+                 "Thanks!", "Play something by Ahssake."]:
+        selected = tool_selector.select(text, selected)
+        print(f"{text!r}: {[schema['function']['name'] for schema in tool_selector.schemas(selected)]}")
+    print(tool_selector.stats())
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,67 @@
-from typing import Optional
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+import asyncio
+import json
 import os
+import time
 import azure.cognitiveservices.speech as speechsdk
 
+# SPEECH_ADAPTIVE_SILENCE=0 keeps the fixed end-of-speech timeout below
+SPEECH_ADAPTIVE_SILENCE = os.environ.get("SPEECH_ADAPTIVE_SILENCE", "1") != "0"
+FIXED_SILENCE_TIMEOUT_MS = 2000
+TICKS_PER_SECOND = 10_000_000  # Result offsets and durations are in 100 ns ticks
+# Recognition started while Connection.open is still in progress fails, so a turn waits this long for it
+CONNECT_TIMEOUT = 3.0
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class AdaptiveSilenceTimeout:
+    """
+    End-of-speech silence timeout learned from the pauses between the user's words.
+
+    The fixed 2000 ms waits two seconds after every utterance before the transcript arrives. This
+    instead tracks the gaps between recognized words and uses 1.5 times their 95th percentile plus
+    a margin, kept between min_ms and max_ms. It starts at initial_ms until min_samples gaps are seen.
+    """
+
+    def __init__(self, initial_ms: int = 1200, min_ms: int = 500, max_ms: int = FIXED_SILENCE_TIMEOUT_MS,
+                 margin_ms: int = 250, step_ms: int = 100, min_samples: int = 20, window: int = 300) -> None:
+        self.initial_ms = initial_ms
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.margin_ms = margin_ms
+        self.step_ms = step_ms  # Rounded to steps so small changes don't force a reconnection
+        self.min_samples = min_samples
+        self.gaps: Deque[float] = deque(maxlen=window)
+
+    def observe(self, result: speechsdk.SpeechRecognitionResult) -> None:
+        """Records the pauses between words of a detailed recognition result."""
+        try:
+            words = json.loads(result.json)["NBest"][0]["Words"]
+        except (KeyError, IndexError, TypeError, ValueError):
+            return
+        for previous, word in zip(words, words[1:]):
+            gap = (word["Offset"] - previous["Offset"] - previous["Duration"]) * 1000 / TICKS_PER_SECOND
+            if gap > 0:
+                self.gaps.append(gap)
+
+    @property
+    def trained(self) -> bool:
+        return len(self.gaps) >= self.min_samples
+
+    def current_ms(self) -> int:
+        if not self.trained:
+            return self.initial_ms
+        target = 1.5 * percentile(list(self.gaps), 95) + self.margin_ms
+        target = round(target / self.step_ms) * self.step_ms
+        return int(min(self.max_ms, max(self.min_ms, target)))
+
 class AzureSpeechRecognizer:
     """
     A class to interface with Azure's Cognitive Speech Services for speech recognition.
@@ -9,11 +69,19 @@ class AzureSpeechRecognizer:
     creates a speech recognizer, and provides a method to recognize speech from the microphone.
     """
     
-    def __init__(self) -> None:
+    def __init__(self, use_default_microphone: bool = True, warm_session: bool = True,
+                 adaptive_silence: bool = SPEECH_ADAPTIVE_SILENCE) -> None:
         """
         Initializes the AzureSpeechRecognizer instance by setting up the speech service configuration
         and creating a speech recognizer with the default microphone as the audio source.
         
+        Args:
+            use_default_microphone (bool): Whether to open the local microphone. Server mode passes False
+                and only recognizes audio sent by clients through recognize_speech_from_audio.
+            warm_session (bool): Keep the service connection open between turns for recognize().
+                False closes it after every turn, as the per-turn recognize_once did.
+            adaptive_silence (bool): Learn the end-of-speech silence timeout instead of a fixed 2000 ms.
+        
         Raises:
             EnvironmentError: If either the SPEECH_KEY or SPEECH_REGION environment variables are not set.
         """
@@ -28,17 +96,41 @@ class AzureSpeechRecognizer:
         # Initialize speech configuration with the provided credentials
         self.speech_config: speechsdk.SpeechConfig = speechsdk.SpeechConfig(subscription=self.speech_key, region=self.speech_region)
         
-        # Set additional service properties if needed
-        self.speech_config.set_service_property(
-            "speechsdk.PropertyId.Speech_SegmentationSilenceTimeoutMs",
-            "2000",  # Increase the segmentation silence timeout to 2000ms
-            speechsdk.ServicePropertyChannel.UriQueryParameter)
-        
-        # Setup the audio configuration to use the default microphone
-        self.audio_config: speechsdk.audio.AudioConfig = speechsdk.audio.AudioConfig(use_default_microphone=True)
-        
-        # Create the speech recognizer with the configured setting
-        self.speech_recognizer: speechsdk.SpeechRecognizer = self.create_speech_recognizer()
+        # End-of-speech silence timeout. This is a PropertyId; passing its name as a service property
+        # string only added an unknown query parameter, so the service default was in effect.
+        self.speech_config.set_property(speechsdk.PropertyId.Speech_SegmentationSilenceTimeoutMs,
+                                        str(FIXED_SILENCE_TIMEOUT_MS))
+        # Word timings feed the adaptive silence timeout
+        self.speech_config.output_format = speechsdk.OutputFormat.Detailed
+        self.speech_config.request_word_level_timestamps()
+
+        self.warm_session = warm_session
+        self.silence_timeout = AdaptiveSilenceTimeout() if adaptive_silence else None
+        self.applied_timeout_ms = FIXED_SILENCE_TIMEOUT_MS
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.pending: Optional[asyncio.Future] = None  # Resolved by the recognized/canceled callbacks
+        self.pending_result = None  # The SDK's ResultFuture, kept alive but never waited on
+        self.turn_started = 0.0
+        self.session_started_at: Optional[float] = None
+        self.connected = False
+        self.opening = False  # Connection.open called, neither connected nor disconnected yet
+        self.connection_ready: Optional[asyncio.Future] = None
+        self.reconnects = 0
+        self.start_latencies: Deque[float] = deque(maxlen=200)  # recognize() call to session start
+        self.final_latencies: Deque[float] = deque(maxlen=200)  # End of speech to final transcript
+
+        self.audio_config: Optional[speechsdk.audio.AudioConfig] = None
+        self.speech_recognizer: Optional[speechsdk.SpeechRecognizer] = None
+        self.connection: Optional[speechsdk.Connection] = None
+        if use_default_microphone:
+            # Setup the audio configuration to use the default microphone
+            self.audio_config = speechsdk.audio.AudioConfig(use_default_microphone=True)
+            
+            # Create the speech recognizer with the configured setting
+            self.speech_recognizer = self.create_speech_recognizer()
+            self.connect_events()
+            if self.warm_session:
+                self.open_connection()
 
     def create_speech_recognizer(self) -> speechsdk.SpeechRecognizer:
         """
@@ -49,6 +141,124 @@ class AzureSpeechRecognizer:
         """
         return speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=self.audio_config)
 
+    def connect_events(self) -> None:
+        """
+        Subscribes once to the recognizer and connection events. They fire on SDK threads, so each
+        callback only hands its event to the event loop.
+        """
+        self.speech_recognizer.recognized.connect(lambda evt: self.call_in_loop(self.resolve, evt.result))
+        self.speech_recognizer.canceled.connect(lambda evt: self.call_in_loop(self.resolve, evt.result))
+        self.speech_recognizer.session_started.connect(lambda evt: self.call_in_loop(self.on_session_started))
+        self.connection = speechsdk.Connection.from_recognizer(self.speech_recognizer)
+        self.connection.connected.connect(lambda evt: self.on_connection_change(True))
+        self.connection.disconnected.connect(lambda evt: self.on_connection_change(False))
+
+    def call_in_loop(self, callback, *args) -> None:
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_connection_change(self, connected: bool) -> None:
+        self.connected = connected
+        self.opening = False
+        self.call_in_loop(self.on_connection_settled)
+
+    def on_connection_settled(self) -> None:
+        if self.connection_ready is not None and not self.connection_ready.done():
+            self.connection_ready.set_result(self.connected)
+
+    async def wait_for_connection(self) -> None:
+        if not self.opening:
+            return
+        # A connection event arriving from now on is delivered to this future through the loop
+        self.connection_ready = self.loop.create_future()
+        try:
+            await asyncio.wait_for(self.connection_ready, CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Give up on the warm connection for this turn and let the recognizer connect on its own
+            self.connection.close()
+            self.opening = False
+        finally:
+            self.connection_ready = None
+
+    def on_session_started(self) -> None:
+        self.session_started_at = time.perf_counter()
+
+    def resolve(self, result: speechsdk.SpeechRecognitionResult) -> None:
+        if self.pending is not None and not self.pending.done():
+            self.pending.set_result(result)
+
+    def open_connection(self) -> None:
+        """Sets up the service connection ahead of the next utterance; returns before it is ready."""
+        if self.silence_timeout is not None:
+            # The timeout is sent when the connection is made, so it is applied here
+            self.applied_timeout_ms = self.silence_timeout.current_ms()
+            self.speech_recognizer.properties.set_property(speechsdk.PropertyId.Speech_SegmentationSilenceTimeoutMs,
+                                                           str(self.applied_timeout_ms))
+        self.opening = True
+        self.connection.open(False)  # Single-shot recognition
+
+    def refresh_connection(self) -> None:
+        """After a turn: reconnect if the learned timeout moved, otherwise just make sure the connection is up."""
+        if not self.warm_session:
+            self.connection.close()
+            return
+        timeout_changed = self.silence_timeout is not None and self.silence_timeout.current_ms() != self.applied_timeout_ms
+        if timeout_changed:
+            self.connection.close()
+        if timeout_changed or not self.connected:
+            self.reconnects += 1
+            self.open_connection()
+
+    async def recognize(self) -> Optional[str]:
+        """
+        Listens for a single utterance from the default microphone without parking a thread: the
+        result arrives through the recognizer's events on a warm connection.
+        
+        Returns:
+            Optional[str]: The recognized text if speech was recognized, otherwise None.
+        """
+        print("Listening...")
+        self.loop = asyncio.get_running_loop()
+        await self.wait_for_connection()
+        self.pending = self.loop.create_future()
+        self.session_started_at = None
+        self.turn_started = time.perf_counter()
+        self.pending_result = self.speech_recognizer.recognize_once_async()
+        try:
+            result = await self.pending
+        finally:
+            self.pending = None
+            self.pending_result = None
+        self.record_latency(result)
+        if self.silence_timeout is not None and result.reason == speechsdk.ResultReason.RecognizedSpeech:
+            self.silence_timeout.observe(result)
+        # Off the critical path: the user is now waiting on the reply, not on us
+        self.refresh_connection()
+        return self.handle_recognition_result(result)
+
+    def record_latency(self, result: speechsdk.SpeechRecognitionResult) -> None:
+        """Time to session start, and from the end of speech (audio time since session start) to the transcript."""
+        now = time.perf_counter()
+        if self.session_started_at is None:
+            return
+        self.start_latencies.append(self.session_started_at - self.turn_started)
+        if result.reason == speechsdk.ResultReason.RecognizedSpeech:
+            speech_end = self.session_started_at + (result.offset + result.duration) / TICKS_PER_SECOND
+            self.final_latencies.append(max(0.0, now - speech_end))
+
+    def stats(self) -> Dict[str, Any]:
+        def summary(values: Deque[float]) -> Dict[str, Optional[float]]:
+            p50, p90 = percentile(list(values), 50), percentile(list(values), 90)
+            return {"count": len(values), "p50_ms": p50 and p50 * 1000, "p90_ms": p90 and p90 * 1000}
+
+        return {
+            "warm_session": self.warm_session,
+            "silence_timeout_ms": self.applied_timeout_ms,
+            "reconnects": self.reconnects,
+            "session_start": summary(self.start_latencies),
+            "end_of_speech_to_transcript": summary(self.final_latencies),
+        }
+
     def recognize_speech_from_microphone(self) -> Optional[str]:
         """
         Listens for a single utterance from the default microphone and attempts to recognize speech.
@@ -62,7 +272,45 @@ class AzureSpeechRecognizer:
 
         # Perform speech recognition
         result = self.speech_recognizer.recognize_once_async().get()
+        return self.handle_recognition_result(result)
+
+    def recognize_speech_from_audio(self, audio_data: bytes, sample_rate: int = 16000) -> Optional[str]:
+        """
+        Recognizes a single utterance from raw 16-bit mono PCM audio supplied by a remote client.
+        
+        Args:
+            audio_data (bytes): The PCM audio of the utterance.
+            sample_rate (int): The sample rate of the audio in Hz.
+        
+        Returns:
+            Optional[str]: The recognized text if speech was recognized, otherwise None.
+        """
+        stream_format = speechsdk.audio.AudioStreamFormat(samples_per_second=sample_rate, bits_per_sample=16, channels=1)
+        push_stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+        push_stream.write(audio_data)
+        push_stream.close()
+
+        recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config,
+                                                audio_config=speechsdk.audio.AudioConfig(stream=push_stream))
+        # Until enough pauses have been seen, the config's fixed timeout applies rather than initial_ms
+        if self.silence_timeout is not None and self.silence_timeout.trained:
+            recognizer.properties.set_property(speechsdk.PropertyId.Speech_SegmentationSilenceTimeoutMs,
+                                               str(self.silence_timeout.current_ms()))
+        result = recognizer.recognize_once_async().get()
+        if self.silence_timeout is not None and result.reason == speechsdk.ResultReason.RecognizedSpeech:
+            self.silence_timeout.observe(result)
+        return self.handle_recognition_result(result)
 
+    def handle_recognition_result(self, result: speechsdk.SpeechRecognitionResult) -> Optional[str]:
+        """
+        Returns the text of a recognition result, printing the reason when nothing was recognized.
+        
+        Args:
+            result (SpeechRecognitionResult): The result returned by the speech SDK.
+        
+        Returns:
+            Optional[str]: The recognized text if speech was recognized, otherwise None.
+        """
         # Handle the recognition result based on its reason
         if result.reason == speechsdk.ResultReason.RecognizedSpeech:
             #print(f"Recognized: {result.text}")
@@ -78,14 +326,26 @@ class AzureSpeechRecognizer:
         return None
 
 
-# Usage example with loop
-if __name__ == "__main__":
-    recognizer = AzureSpeechRecognizer()
-    for _ in range(3):  # Run the speech recognition 3 times
+async def main(turns: int, baseline: bool) -> None:
+    # The baseline reconnects every turn and keeps the fixed 2000 ms timeout, for comparing latencies
+    recognizer = AzureSpeechRecognizer(warm_session=not baseline, adaptive_silence=not baseline)
+    for _ in range(turns):
         print("\nStarting new speech recognition...")
-        transcript = recognizer.recognize_speech_from_microphone()
+        transcript = await recognizer.recognize()
         print(f"Transcript: {transcript}")
         print("Speech recognition cycle completed.\n")
+    print(recognizer.stats())
+
+
+# Usage example with loop
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Recognize a few utterances and report recognition latency")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--baseline", action="store_true", help="Cold connection per turn and fixed 2000 ms timeout")
+    args = parser.parse_args()
+    asyncio.run(main(args.turns, args.baseline))
 
 
 
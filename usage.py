@@ -0,0 +1,152 @@
+#usage.py
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# Where per-turn and per-session usage lines are appended; empty disables the log
+USAGE_LOG_PATH = os.environ.get("USAGE_LOG_PATH", "usage.jsonl")
+
+COUNTERS = ("calls", "prompt_tokens", "completion_tokens", "characters", "bytes", "audio_bytes")
+
+
+class UsageCounters:
+    """Per-provider counters. Spotify and TTS record from worker threads, hence the lock."""
+
+    def __init__(self, label: str = ""):
+        self.label = label  # For turns: which path answered it, e.g. "intent" or "assistant"
+        self.providers: Dict[str, Dict[str, int]] = {}
+        self.lock = threading.Lock()
+
+    def add(self, provider: str, **amounts: int):
+        with self.lock:
+            counters = self.providers.setdefault(provider, dict.fromkeys(COUNTERS, 0))
+            for name, amount in amounts.items():
+                counters[name] += amount or 0
+
+    def merge(self, other: "UsageCounters"):
+        for provider, counters in other.snapshot().items():
+            self.add(provider, **counters)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """Non-zero counters only, to keep the log compact."""
+        with self.lock:
+            return {provider: {name: value for name, value in counters.items() if value}
+                    for provider, counters in self.providers.items()}
+
+
+class SessionUsage:
+    def __init__(self, session_id: Any = "local"):
+        self.session_id = session_id
+        self.started = time.time()
+        self.turns = 0
+        self.totals = UsageCounters()
+
+
+class UsageLog:
+    """Appends one JSON line per finished turn and session."""
+
+    def __init__(self, path: str = USAGE_LOG_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, entry: Dict[str, Any]):
+        if not self.path:
+            return
+        line = json.dumps(entry, separators=(",", ":"))
+        with self.lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+usage_log = UsageLog()
+# Usage made outside any turn, e.g. forecast prefetching and startup calls
+background_usage = UsageCounters()
+# The turn the current task is working for; asyncio tasks and to_thread calls inherit it
+current_turn: contextvars.ContextVar[Optional[UsageCounters]] = contextvars.ContextVar("current_turn", default=None)
+
+
+def current() -> Optional[UsageCounters]:
+    return current_turn.get()
+
+
+def record(provider: str, target: Optional[UsageCounters] = None, **amounts: int):
+    """
+    Adds to the current turn's counters (or target, or the background counters outside a turn).
+
+    Amounts: calls, prompt_tokens, completion_tokens, characters, bytes (response payload), audio_bytes.
+    """
+    (target or current_turn.get() or background_usage).add(provider, **amounts)
+
+
+def record_tokens(provider: str, usage: Any, target: Optional[UsageCounters] = None):
+    """Records an OpenAI-style usage object or dict (prompt_tokens / completion_tokens)."""
+    if usage is None:
+        return
+    if not isinstance(usage, dict):
+        usage = {"prompt_tokens": getattr(usage, "prompt_tokens", 0), "completion_tokens": getattr(usage, "completion_tokens", 0)}
+    record(provider, target, prompt_tokens=usage.get("prompt_tokens") or 0,
+           completion_tokens=usage.get("completion_tokens") or 0)
+
+
+def record_stream_chunk(provider: str, chunk: Any):
+    """
+    Picks up token usage from a streamed chunk: OpenAI sends it on a final chunk with no choices
+    when stream_options.include_usage is set, Groq under x_groq on the last chunk.
+    """
+    usage = getattr(chunk, "usage", None)
+    if usage is None:
+        x_groq = getattr(chunk, "x_groq", None)
+        usage = x_groq.get("usage") if isinstance(x_groq, dict) else None
+    record_tokens(provider, usage)
+
+
+@contextmanager
+def track_turn(session: SessionUsage, label: str = ""):
+    """Collects everything the enclosed turn uses, then logs it and adds it to the session."""
+    counters = UsageCounters(label)
+    token = current_turn.set(counters)
+    session.turns += 1
+    turn_number = session.turns
+    start_time = time.time()
+    try:
+        yield counters
+    finally:
+        current_turn.reset(token)
+        session.totals.merge(counters)
+        usage_log.write({"type": "turn", "session": session.session_id, "turn": turn_number, "label": counters.label,
+                         "at": round(start_time, 3), "seconds": round(time.time() - start_time, 3),
+                         "usage": counters.snapshot()})
+
+
+def end_session(session: SessionUsage):
+    usage_log.write({"type": "session", "session": session.session_id, "turns": session.turns,
+                     "seconds": round(time.time() - session.started, 3), "usage": session.totals.snapshot(),
+                     "background": background_usage.snapshot()})
+
+
+def summarize(path: str = USAGE_LOG_PATH) -> Dict[str, Dict[str, int]]:
+    """Totals per provider and turn label across a usage log, to see which features drive cost."""
+    totals: Dict[str, UsageCounters] = {}
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry["type"] != "turn":
+                continue
+            counters = totals.setdefault(entry.get("label") or "turn", UsageCounters())
+            for provider, amounts in entry["usage"].items():
+                counters.add(provider, **amounts)
+    return {label: counters.snapshot() for label, counters in totals.items()}
+
+
+def main():
+    for label, providers in summarize().items():
+        print(label)
+        for provider, counters in providers.items():
+            print(f"  {provider:<14} " + ", ".join(f"{name} {value}" for name, value in counters.items()))
+
+if __name__ == "__main__":
+    main()
@@ -21,10 +21,22 @@ class AsyncWakeWordDetector:
                                                 rate=self.rate, input=True, frames_per_buffer=self.chunk_size)
         self.owwModel = Model(wakeword_models=[model_path], inference_framework=inference_framework)
         self.audio_queue = Queue()
+        self.audio_thread = None
 
     def start_listening(self):
-        audio_thread = Thread(target=self.capture_audio, daemon=True)
-        audio_thread.start()
+        # The capture thread keeps running across detections so barge-in can listen during playback
+        if self.audio_thread is None:
+            self.audio_thread = Thread(target=self.capture_audio, daemon=True)
+            self.audio_thread.start()
+
+    def clear_buffer(self):
+        """
+        Drops audio captured while nobody was polling for the wake word (e.g. during transcription),
+        so stale speech can't trigger a detection.
+        """
+        while not self.audio_queue.empty():
+            self.audio_queue.get_nowait()
+        self.owwModel.reset()
 
     def capture_audio(self):
         while True:
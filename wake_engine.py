@@ -0,0 +1,309 @@
+#wake_engine.py
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from multiprocessing import shared_memory
+from threading import Thread
+from typing import Dict, List, Optional
+import numpy as np
+import pyaudio
+from openwakeword.model import Model
+
+# Set event loop policy on Windows for Python 3.8+
+if sys.platform.startswith('win'):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+
+class FrameRing:
+    """
+    Single-producer ring of fixed-size int16 frames in shared memory. The first 8 bytes hold
+    the total number of frames ever written; readers keep their own position and detect
+    overruns when the writer laps them.
+    """
+
+    HEADER_BYTES = 8
+
+    def __init__(self, shm: shared_memory.SharedMemory, slots: int, chunk_size: int, owner: bool):
+        self.shm = shm
+        self.slots = slots
+        self.chunk_size = chunk_size
+        self.owner = owner
+        self.counter = np.ndarray((1,), dtype=np.int64, buffer=shm.buf[:self.HEADER_BYTES])
+        self.frames = np.ndarray((slots, chunk_size), dtype=np.int16, buffer=shm.buf[self.HEADER_BYTES:])
+
+    @classmethod
+    def create(cls, slots: int, chunk_size: int) -> "FrameRing":
+        size = cls.HEADER_BYTES + slots * chunk_size * np.dtype(np.int16).itemsize
+        ring = cls(shared_memory.SharedMemory(create=True, size=size), slots, chunk_size, owner=True)
+        ring.counter[0] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name: str, slots: int, chunk_size: int) -> "FrameRing":
+        return cls(shared_memory.SharedMemory(name=name), slots, chunk_size, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, frame: np.ndarray):
+        position = int(self.counter[0])
+        self.frames[position % self.slots] = frame
+        # Publish the frame only after its samples are in place
+        self.counter[0] = position + 1
+
+    def written(self) -> int:
+        return int(self.counter[0])
+
+    def read(self, position: int) -> Optional[np.ndarray]:
+        """Copies the frame at position, or returns None if the writer may have overwritten it meanwhile."""
+        frame = self.frames[position % self.slots].copy()
+        # The writer starts on this slot again once frame position + slots is due, i.e. at counter == position + slots
+        if self.written() >= position + self.slots:
+            return None
+        return frame
+
+    def close(self):
+        # Drop the numpy views before closing, otherwise the buffer is still exported
+        del self.counter, self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class WakeWordEvent:
+    def __init__(self, stream_id: int, model_name: str, score: float, timestamp: float):
+        self.stream_id = stream_id
+        self.model_name = model_name
+        self.score = score
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"WakeWordEvent(stream_id={self.stream_id}, model_name={self.model_name!r}, score={self.score:.2f})"
+
+
+def _inference_worker(worker_id, assignments, model_path, inference_framework, threshold,
+                      slots, chunk_size, event_queue, stop_event, stats_interval=1.0):
+    """
+    Runs in a worker process. Owns one openwakeword Model per assigned stream (the model keeps
+    per-stream feature state) and polls the streams' rings for new frames.
+    """
+    rings = {stream_id: FrameRing.attach(name, slots, chunk_size) for stream_id, name in assignments}
+    models = {stream_id: Model(wakeword_models=[model_path], inference_framework=inference_framework)
+              for stream_id in rings}
+    positions = {stream_id: ring.written() for stream_id, ring in rings.items()}
+    event_queue.put(("ready", worker_id))
+    processed = dropped = max_backlog = 0
+    busy_time = 0.0
+    last_report = time.perf_counter()
+
+    try:
+        while not stop_event.is_set():
+            did_work = False
+            for stream_id, ring in rings.items():
+                written = ring.written()
+                backlog = written - positions[stream_id]
+                if backlog <= 0:
+                    continue
+                max_backlog = max(max_backlog, backlog)
+                if backlog > slots - 2:
+                    # The capture side lapped us; skip ahead, keeping a slot of headroom between us and the writer
+                    dropped += backlog - slots + 2
+                    positions[stream_id] = written - slots + 2
+
+                frame = ring.read(positions[stream_id])
+                positions[stream_id] += 1
+                did_work = True
+                if frame is None:
+                    dropped += 1  # Torn by the writer while copying
+                    continue
+
+                start_time = time.perf_counter()
+                model = models[stream_id]
+                model.predict(frame)
+                for mdl, scores in model.prediction_buffer.items():
+                    if scores[-1] > threshold:
+                        model.reset()
+                        event_queue.put(("detection", stream_id, mdl, float(scores[-1]), time.time()))
+                        break
+                busy_time += time.perf_counter() - start_time
+                processed += 1
+
+            now = time.perf_counter()
+            if now - last_report >= stats_interval:
+                event_queue.put(("stats", worker_id, processed, dropped, max_backlog, busy_time))
+                last_report = now
+            if not did_work:
+                time.sleep(0.002)
+    finally:
+        event_queue.put(("stats", worker_id, processed, dropped, max_backlog, busy_time))
+        for ring in rings.values():
+            ring.close()
+
+
+class MultiStreamWakeWordEngine:
+    """
+    Wake word detection for many input streams at once. Capture threads write 80 ms frames
+    into per-stream shared-memory rings; a pool of worker processes runs inference outside
+    the GIL of the event loop process, and detections come back as WakeWordEvent objects
+    tagged with the source stream.
+    """
+
+    def __init__(self, model_path, input_devices: Optional[List[Optional[int]]] = None, num_streams: Optional[int] = None,
+                 num_workers: Optional[int] = None, inference_framework='tflite', threshold=0.7, ring_slots=64):
+        self.model_path = model_path
+        self.inference_framework = inference_framework
+        self.threshold = threshold
+        self.input_devices = input_devices or []
+        # Streams without a device are fed by the caller through feed(), e.g. remote endpoints or benchmarks
+        self.num_streams = num_streams if num_streams is not None else len(self.input_devices)
+        self.num_workers = max(1, min(num_workers or os.cpu_count() or 1, self.num_streams))
+        self.ring_slots = ring_slots
+        self.audio_format = pyaudio.paInt16
+        self.channels = 1
+        self.rate = 16000
+        self.chunk_size = 1280
+        self.rings: List[FrameRing] = []
+        self.workers: List[multiprocessing.Process] = []
+        self.worker_stats: Dict[int, tuple] = {}
+        self.ready_workers = 0
+        self.frames_written = 0
+        self.events: Optional[asyncio.Queue] = None
+        self.audio_interface = None
+        self.streams = []
+        self.capture_threads: List[Thread] = []
+        self.running = False
+        self.capturing = False  # Cleared first on stop, so no frame is written into a ring being closed
+        self.context = multiprocessing.get_context('spawn')
+        self.event_queue = self.context.Queue()
+        self.stop_event = self.context.Event()
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue()
+        self.rings = [FrameRing.create(self.ring_slots, self.chunk_size) for _ in range(self.num_streams)]
+        self.running = True
+        self.capturing = True
+
+        for worker_id in range(self.num_workers):
+            assignments = [(stream_id, ring.name) for stream_id, ring in enumerate(self.rings)
+                           if stream_id % self.num_workers == worker_id]
+            worker = self.context.Process(
+                target=_inference_worker,
+                args=(worker_id, assignments, self.model_path, self.inference_framework, self.threshold,
+                      self.ring_slots, self.chunk_size, self.event_queue, self.stop_event),
+                daemon=True,
+            )
+            worker.start()
+            self.workers.append(worker)
+
+        Thread(target=self.bridge_events, args=(loop,), daemon=True).start()
+
+        if self.input_devices:
+            self.audio_interface = pyaudio.PyAudio()
+            for stream_id, device_index in enumerate(self.input_devices):
+                stream = self.audio_interface.open(format=self.audio_format, channels=self.channels, rate=self.rate,
+                                                   input=True, frames_per_buffer=self.chunk_size,
+                                                   input_device_index=device_index)
+                self.streams.append(stream)
+                thread = Thread(target=self.capture_audio, args=(stream_id, stream), daemon=True)
+                thread.start()
+                self.capture_threads.append(thread)
+
+    def capture_audio(self, stream_id: int, stream):
+        while self.capturing:
+            try:
+                data = stream.read(self.chunk_size, exception_on_overflow=False)
+                self.feed(stream_id, np.frombuffer(data, dtype=np.int16))
+            except OSError as e:
+                print(f"Stream {stream_id} error encountered: {e}.")
+                time.sleep(0.1)
+
+    def feed(self, stream_id: int, frame: np.ndarray):
+        if self.capturing:
+            self.rings[stream_id].write(frame)
+
+    def bridge_events(self, loop: asyncio.AbstractEventLoop):
+        while self.running or not self.event_queue.empty():
+            try:
+                message = self.event_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if message[0] == "ready":
+                self.ready_workers += 1
+            elif message[0] == "detection":
+                _, stream_id, model_name, score, timestamp = message
+                event = WakeWordEvent(stream_id, model_name, score, timestamp)
+                loop.call_soon_threadsafe(self.events.put_nowait, event)
+            else:
+                _, worker_id, processed, dropped, max_backlog, busy_time = message
+                self.worker_stats[worker_id] = (processed, dropped, max_backlog, busy_time)
+
+    async def wait_until_ready(self, poll_interval=0.05):
+        """Waits until every worker has loaded its models, so early frames aren't counted as overruns."""
+        while self.ready_workers < len(self.workers):
+            await asyncio.sleep(poll_interval)
+
+    async def detections(self):
+        while True:
+            yield await self.events.get()
+
+    async def wait_for_wake_word(self, stream_id: Optional[int] = None) -> WakeWordEvent:
+        while True:
+            event = await self.events.get()
+            if stream_id is None or event.stream_id == stream_id:
+                return event
+
+    def stats(self) -> Dict[str, float]:
+        processed = sum(stat[0] for stat in self.worker_stats.values())
+        dropped = sum(stat[1] for stat in self.worker_stats.values())
+        max_backlog = max((stat[2] for stat in self.worker_stats.values()), default=0)
+        busy_time = sum(stat[3] for stat in self.worker_stats.values())
+        written = sum(ring.written() for ring in self.rings) if self.rings else self.frames_written
+        return {"frames_written": written, "frames_processed": processed, "frames_dropped": dropped,
+                "max_backlog_frames": max_backlog, "inference_seconds": busy_time}
+
+    async def stop(self):
+        # Capture threads may be inside stream.read; let them finish before the streams and rings close
+        self.capturing = False
+        await asyncio.gather(*(asyncio.to_thread(thread.join, 1) for thread in self.capture_threads))
+        self.capture_threads = []
+        self.stop_event.set()
+        # Joining blocks, so it runs in a thread to keep the event loop responsive
+        await asyncio.gather(*(asyncio.to_thread(worker.join, 5) for worker in self.workers))
+        self.running = False
+        for stream in self.streams:
+            stream.stop_stream()
+            stream.close()
+        if self.audio_interface:
+            self.audio_interface.terminate()
+        # Give the bridge a moment to collect the workers' final stats
+        await asyncio.sleep(0.2)
+        self.frames_written = sum(ring.written() for ring in self.rings)
+        for ring in self.rings:
+            ring.close()
+        self.rings = []
+        self.workers = []
+
+
+# Example usage
+async def main():
+    # Replace the model path with an environment variable
+    model_path = os.environ.get("WAKE_WORD_MODEL_PATH")
+    # Comma-separated PyAudio input device indices, one per room
+    devices = [int(index) for index in os.environ.get("WAKE_WORD_INPUT_DEVICES", "0").split(",")]
+    engine = MultiStreamWakeWordEngine(model_path=model_path, input_devices=devices)
+    engine.start()
+
+    try:
+        async for event in engine.detections():
+            print(f"Wake word detected on stream {event.stream_id}: {event}")
+    finally:
+        await engine.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
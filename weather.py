@@ -3,29 +3,153 @@
 import aiohttp
 import asyncio
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import time
 import os
+import json
+import re
+from collections import OrderedDict
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import text as sa_text
 from openai import AsyncOpenAI
 from configure import custom_weather_prompt_template
+from city_index import CityIndex
+from rate_limiter import scheduler
+from hedging import Endpoint, HedgedCaller
+from weather_answers import WeatherAnswerEngine
+import usage
+import cassette
 
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")  # Redacted and replaced with os.environ.get
 WEATHER_API_KEY = os.environ.get("WEATHER_API_KEY")  # Redacted and replaced with os.environ.get
+# Base URL overrides let benchmarks and tests point the client at local stand-ins
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+NWS_BASE_URL = os.environ.get("NWS_BASE_URL", "https://api.weather.gov")
+WEATHER_MODEL = os.environ.get("WEATHER_MODEL", "mixtral-8x7b-32768")
+# Opt-in hedging of the interpretation call: a second base URL and/or model that gets the same prompt
+# when the first hasn't answered within its usual (90th percentile) latency
+WEATHER_HEDGE_BASE_URL = os.environ.get("WEATHER_HEDGE_BASE_URL")
+WEATHER_HEDGE_MODEL = os.environ.get("WEATHER_HEDGE_MODEL")
+WEATHER_HEDGE_API_KEY = os.environ.get("WEATHER_HEDGE_API_KEY", GROQ_API_KEY)
+# The device's home location, used when a question names no place
+HOME_LATITUDE = os.environ.get("HOME_LATITUDE")
+HOME_LONGITUDE = os.environ.get("HOME_LONGITUDE")
 
 if sys.platform.startswith('win'):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+class CachedForecast:
+    """An hourly forecast for one NWS grid point, with the freshness NWS advertised for it."""
+    def __init__(self, grid, data, update_time, expires_at):
+        self.grid = grid  # (gridId, gridX, gridY)
+        self.data = data
+        self.update_time = update_time  # The forecast's own updateTime, e.g. '2024-04-01T15:32:05+00:00'
+        self.expires_at = expires_at  # Epoch seconds
+        self.fetched_at = time.time()
+
+    def is_fresh(self):
+        return time.time() < self.expires_at
+
+class InterpretationCache:
+    """
+    LLM answers to weather questions, keyed by (grid, forecast updateTime, city, normalized question).
+    A new forecast for a grid point changes the key, and invalidate() drops the older answers.
+    Bounded, evicting the least recently used; entries also age out after max_age seconds since
+    "this afternoon" stops meaning the same thing even if NWS hasn't republished.
+    """
+    FILLER_PATTERN = re.compile(r"\b(?:hey|ok|okay|jarvis|please|can you|could you|would you|tell me|let me know|"
+                                r"right now|currently|the|a|an)\b")
+    CONTRACTIONS = {"what's": "what is", "how's": "how is", "it's": "it is", "will it be": "will it"}
+
+    def __init__(self, max_entries=256, max_age=3600):
+        self.entries = OrderedDict()  # key -> (answer, stored_at)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @classmethod
+    def normalize(cls, question):
+        text = question.lower()
+        for contraction, expansion in cls.CONTRACTIONS.items():
+            text = text.replace(contraction, expansion)
+        text = re.sub(r"[^a-z0-9 ]+", " ", text)
+        return " ".join(cls.FILLER_PATTERN.sub(" ", text).split())
+
+    def key(self, forecast, city, question):
+        return (forecast.grid, forecast.update_time, city.lower(), self.normalize(question))
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry[1] > self.max_age:
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, answer):
+        self.entries[key] = (answer, time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, grid, update_time):
+        """Drops answers for grid that were based on a forecast other than update_time."""
+        stale = [key for key in self.entries if key[0] == grid and key[1] != update_time]
+        for key in stale:
+            del self.entries[key]
+        self.invalidations += len(stale)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+
 class WeatherAPI:
-    WEATHER_BASE_URL = 'https://api.weather.gov/points/'
+    WEATHER_BASE_URL = f'{NWS_BASE_URL}/points/'
 
-    def __init__(self, db_url='sqlite+aiosqlite:///uscities.db', api_key=WEATHER_API_KEY):
+    def __init__(self, db_url='sqlite+aiosqlite:///uscities.db', api_key=WEATHER_API_KEY,
+                 groq_base_url=GROQ_BASE_URL, nws_base_url=NWS_BASE_URL, city_index=None, db_path='uscities.db',
+                 hedge_base_url=WEATHER_HEDGE_BASE_URL, hedge_model=WEATHER_HEDGE_MODEL):
         self.engine = create_async_engine(db_url, echo=False, pool_pre_ping=True)
         self.Session = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
         self.api_key = api_key
-        self.gpt_client = AsyncOpenAI(api_key=GROQ_API_KEY, base_url='https://api.groq.com/openai/v1',)#using groq for speed up
+        self.nws_base_url = nws_base_url.rstrip('/')
+        # Retries are left to the shared scheduler, which honours Groq's rate-limit headers
+        self.gpt_client = AsyncOpenAI(api_key=GROQ_API_KEY, base_url=groq_base_url, max_retries=0,
+                                      http_client=cassette.http_client("groq"))#using groq for speed up
+        hedge_client = None
+        if hedge_base_url or hedge_model:
+            hedge_client = (AsyncOpenAI(api_key=WEATHER_HEDGE_API_KEY, base_url=hedge_base_url, max_retries=0,
+                                        http_client=cassette.http_client("weather-hedge"))
+                            if hedge_base_url else self.gpt_client)
+
+        def build_interpreter():
+            secondary = None
+            if hedge_client:
+                secondary = Endpoint("hedge", hedge_client, hedge_model or WEATHER_MODEL,
+                                     "weather-hedge" if hedge_base_url else "groq")
+            return HedgedCaller(Endpoint("groq", self.gpt_client, WEATHER_MODEL, "groq"), secondary)
+
+        # Separate latency histograms: whole completions, and time to the first streamed token
+        self.interpreter = build_interpreter()
+        self.stream_interpreter = build_interpreter()
+        self.db_path = db_path
+        self.city_index = city_index  # Built on first use by get_city_index
+        self.grid_cache = {}  # (latitude, longitude) -> NWS grid point; these never change
+        self.forecast_cache = {}  # grid -> CachedForecast
+        self.pending_requests = {}  # ('points' | 'forecast', key) -> in-flight download task, shared by concurrent askers
+        self.prefetcher = None  # Set by ForecastPrefetcher to learn which locations are asked about
+        self.answer_engine = WeatherAnswerEngine()  # Closed-form questions are answered without the LLM
+        self.interpretations = InterpretationCache()  # Repeat questions against an unchanged forecast skip the LLM
 
     async def __aenter__(self):
         return self
@@ -34,6 +158,11 @@ class WeatherAPI:
         await self.close()
         return False
 
+    async def init_client_session(self):
+        # One aiohttp session (and connection pool) for every NWS request made by this instance
+        if not hasattr(self, 'client_session') or self.client_session.closed:
+            self.client_session = cassette.client_session("nws", aiohttp.ClientSession())
+
     async def close(self):
         if hasattr(self, 'client_session'):
             await self.client_session.close()
@@ -55,25 +184,132 @@ class WeatherAPI:
             print(f"An error occurred: {e}")
             return None
 
-    async def fetch_weather_by_coords(self, latitude, longitude):
-        try:
-            # Step 1: Get gridId, gridX, and gridY
-            point_url = f'https://api.weather.gov/points/{latitude},{longitude}'
+    async def get_city_index(self):
+        if self.city_index is None:
+            self.city_index = await asyncio.to_thread(CityIndex, self.db_path)
+        return self.city_index
+
+    async def home_city(self):
+        """Returns the city nearest the configured HOME_LATITUDE/HOME_LONGITUDE, or None if unset."""
+        if HOME_LATITUDE is None or HOME_LONGITUDE is None:
+            return None
+        city_index = await self.get_city_index()
+        return city_index.nearest(float(HOME_LATITUDE), float(HOME_LONGITUDE))
+
+    async def resolve_location(self, city, state):
+        """
+        Resolves the tool's city/state arguments to (city, state, coords). Besides a city and
+        state this accepts a ZIP code in either argument, or no city at all for the home location.
+        """
+        city, state = (city or '').strip(), (state or '').strip()
+        zip_code = next((value for value in (city, state) if value[:5].isdigit() and len(value) in (5, 10)), None)
+        if zip_code:
+            record = (await self.get_city_index()).lookup_zip(zip_code)
+        elif not city:
+            record = await self.home_city()
+        else:
+            return city, state, await self.fetch_lat_lng_by_city_state(city, state)
+
+        if record is None:
+            return city, state, None
+        return record.city, record.state_name, record.coords()
+
+    async def download_grid_point(self, key):
+        # Step 1: Get gridId, gridX, and gridY
+        point_url = f'{self.nws_base_url}/points/{key[0]},{key[1]}'
+
+        async def send():
             async with self.client_session.get(point_url, headers={"User-Agent": "MyWeatherApp"}, timeout=7) as response:
                 response.raise_for_status()
-                grid_data = await response.json()
-                gridId = grid_data['properties']['gridId']
-                gridX = grid_data['properties']['gridX']
-                gridY = grid_data['properties']['gridY']
-
-                # Step 2: Construct URL for hourly forecast using gridId, gridX, gridY
-                forecast_hourly_url = f'https://api.weather.gov/gridpoints/{gridId}/{gridX},{gridY}/forecast/hourly'
-
-                # Step 3: Fetch the hourly forecast data
-                async with self.client_session.get(forecast_hourly_url, headers={"User-Agent": "MyWeatherApp"}, timeout=10) as forecast_response:
-                    forecast_response.raise_for_status()
-                    weather_data = await forecast_response.json()
-                    return self.clean_weather_data(weather_data)
+                body = await response.read()
+                usage.record("nws", bytes=len(body))
+                return json.loads(body)
+
+        grid_data = await scheduler.call("nws", send)
+        self.grid_cache[key] = (grid_data['properties']['gridId'],
+                                grid_data['properties']['gridX'],
+                                grid_data['properties']['gridY'])
+        return self.grid_cache[key]
+
+    async def coalesced(self, key, download):
+        """Runs download() once per key at a time; concurrent callers await the same task."""
+        if key not in self.pending_requests:
+            task = asyncio.create_task(download())
+            self.pending_requests[key] = task
+            task.add_done_callback(lambda _: self.pending_requests.pop(key, None))
+        # Shielded so one caller being cancelled doesn't abort the download for the others
+        return await asyncio.shield(self.pending_requests[key])
+
+    async def fetch_grid_point(self, latitude, longitude):
+        key = (round(latitude, 4), round(longitude, 4))
+        if key in self.grid_cache:
+            return self.grid_cache[key]
+        return await self.coalesced(('points', key), lambda: self.download_grid_point(key))
+
+    @staticmethod
+    def forecast_expiry(headers, weather_data):
+        """
+        Works out when a forecast goes stale: the Expires header if NWS sent one, then
+        Cache-Control max-age, then an hour after the forecast's updateTime.
+        """
+        if headers.get('Expires'):
+            try:
+                return parsedate_to_datetime(headers['Expires']).timestamp()
+            except (TypeError, ValueError):
+                pass
+        for directive in headers.get('Cache-Control', '').split(','):
+            name, _, value = directive.strip().partition('=')
+            if name == 'max-age' and value.isdigit():
+                return time.time() + int(value)
+        update_time = weather_data['properties'].get('updateTime')
+        if update_time:
+            return datetime.fromisoformat(update_time).astimezone(timezone.utc).timestamp() + 3600
+        return time.time() + 600
+
+    async def download_forecast(self, grid):
+        gridId, gridX, gridY = grid
+        # Step 2: Construct URL for hourly forecast using gridId, gridX, gridY
+        forecast_hourly_url = f'{self.nws_base_url}/gridpoints/{gridId}/{gridX},{gridY}/forecast/hourly'
+
+        # Step 3: Fetch the hourly forecast data
+        async def send():
+            async with self.client_session.get(forecast_hourly_url, headers={"User-Agent": "MyWeatherApp"}, timeout=10) as forecast_response:
+                forecast_response.raise_for_status()
+                body = await forecast_response.read()
+                usage.record("nws", bytes=len(body))
+                weather_data = json.loads(body)
+                return CachedForecast(grid, weather_data, weather_data['properties'].get('updateTime'),
+                                      self.forecast_expiry(forecast_response.headers, weather_data))
+
+        forecast = await scheduler.call("nws", send)
+        self.forecast_cache[grid] = forecast
+        self.interpretations.invalidate(grid, forecast.update_time)
+        return forecast
+
+    async def fetch_forecast(self, latitude, longitude, force=False):
+        """
+        Returns the CachedForecast for a location, downloading it only if the cached copy has
+        expired (or force is set). Concurrent callers for the same grid point share one request.
+        """
+        await self.init_client_session()
+        grid = await self.fetch_grid_point(latitude, longitude)
+        cached = self.forecast_cache.get(grid)
+        if cached and cached.is_fresh() and not force:
+            return cached
+
+        return await self.coalesced(('forecast', grid), lambda: self.download_forecast(grid))
+
+    async def answer_locally(self, query, city, coords):
+        try:
+            forecast = await self.fetch_forecast(**coords)
+        except Exception:
+            return None  # fetch_weather_by_coords reports the error on the LLM path
+        return self.answer_engine.answer(query, forecast.data, city)
+
+    async def fetch_weather_by_coords(self, latitude, longitude):
+        try:
+            forecast = await self.fetch_forecast(latitude, longitude)
+            return self.clean_weather_data(forecast.data)
         except Exception as e:
             return {'error': str(e)}
 
@@ -94,8 +330,8 @@ class WeatherAPI:
                 end_time_obj = datetime.fromisoformat(end_time_iso[:-6])
 
                 start_date_formatted = start_time_obj.strftime('%d %B, %Y')
-                start_time_formatted = f"{start_time_obj.strftime('%I %p').lstrip('0')} on {WeatherDataProcessor.ordinal_date(start_time_obj)}"
-                end_time_formatted = f"{end_time_obj.strftime('%I %p').lstrip('0')} on {WeatherDataProcessor.ordinal_date(end_time_obj)}"
+                start_time_formatted = f"{start_time_obj.strftime('%I %p').lstrip('0')} on {WeatherAPI.ordinal_date(start_time_obj)}"
+                end_time_formatted = f"{end_time_obj.strftime('%I %p').lstrip('0')} on {WeatherAPI.ordinal_date(end_time_obj)}"
 
                 day_of_week = start_time_obj.strftime('%A')
                 is_daytime = period['isDaytime']
@@ -136,29 +372,114 @@ class WeatherAPI:
         custom_prompt = custom_weather_prompt_template.format(query=query)
         return f"{weather_info} {custom_prompt}"
 
-    async def process_weather_query(self, city, state, query):
+    @staticmethod
+    async def close_stream(endpoint, stream):
+        await stream.response.aclose()
+        usage.record(endpoint.provider, bytes=stream.response.num_bytes_downloaded)
+
+    async def interpret_stream(self, prompt, cache_key=None):
+        """
+        Streams the interpretation text chunk by chunk. Hedging races the endpoints to their first
+        token; the losing stream is closed. A stream read to the end is stored under cache_key.
+        """
+        answer = ""
+        async def send(endpoint):
+            async def attempt():
+                return await endpoint.client.chat.completions.with_raw_response.create(
+                    model=endpoint.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.5,
+                    stream=True,
+                    # Token usage arrives on the final chunk (Groq also reports it under x_groq)
+                    extra_body={"stream_options": {"include_usage": True}},
+                )
+            stream = (await scheduler.call(endpoint.provider, attempt)).parse()
+            chunks = stream.__aiter__()
+            try:
+                async for chunk in chunks:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        return endpoint, stream, chunks, chunk.choices[0].delta.content
+                return endpoint, stream, chunks, ""
+            except BaseException:
+                await self.close_stream(endpoint, stream)
+                raise
+
+        def close(result):
+            asyncio.ensure_future(self.close_stream(result[0], result[1]))
+
+        endpoint, stream, chunks, first_chunk = await self.stream_interpreter.call(send, discard=close)
+        try:
+            if first_chunk:
+                answer += first_chunk
+                yield first_chunk
+            async for chunk in chunks:
+                usage.record_stream_chunk(endpoint.provider, chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    answer += chunk.choices[0].delta.content
+                    yield chunk.choices[0].delta.content
+        finally:
+            await self.close_stream(endpoint, stream)
+        # Only reached when the stream ran to completion, so an interrupted answer is never cached
+        if cache_key and answer:
+            self.interpretations.put(cache_key, answer)
+
+    async def process_weather_query(self, city, state, query, stream=False):
+        """
+        With stream=True, an answer that needs the LLM comes back as an async iterator of text chunks
+        under "weather_tool_response_stream" instead of the finished text, so it can be spoken as it arrives.
+        """
         await self.init_client_session()  
-        coords = await self.fetch_lat_lng_by_city_state(city, state)
+        city, state, coords = await self.resolve_location(city, state)
 
         if coords:
+            if self.prefetcher:
+                self.prefetcher.record_query(city, state, coords)
+            local_answer = await self.answer_locally(query, city, coords)
+            if local_answer:
+                print(f"Answered locally: {local_answer}")
+                return {"weather_query": query, "weather_tool_response_needing_interpretation": local_answer}
+
             location_directive = ''.join([" Currently: looking at ", city, ", ", state, "->"])
             weather_data = await self.fetch_weather_by_coords(**coords)
+            cache_key = None
+            if isinstance(weather_data, str):  # A dict here carries a download error
+                grid = self.grid_cache.get((round(coords['latitude'], 4), round(coords['longitude'], 4)))
+                forecast = self.forecast_cache.get(grid)
+                if forecast is not None:
+                    cache_key = self.interpretations.key(forecast, city, query)
+                    cached_answer = self.interpretations.get(cache_key)
+                    if cached_answer:
+                        print(f"Answered from cache: {cached_answer}")
+                        return {"weather_query": query, "weather_tool_response_needing_interpretation": cached_answer}
             prompt = await self.generate_custom_weather_prompt(weather_info=location_directive + str(weather_data), query=query)
+            if stream:
+                return {"weather_query": query, "weather_tool_response_stream": self.interpret_stream(prompt, cache_key)}
 
             start_time = asyncio.get_event_loop().time()  
 
-            response = await self.gpt_client.chat.completions.create(
-                model="mixtral-8x7b-32768",
-                messages=[{"role": "user", "content": prompt}], 
-                temperature=0.5,
-                stream=False,
-            )
+            async def send(endpoint):
+                async def attempt():
+                    return await endpoint.client.chat.completions.with_raw_response.create(
+                        model=endpoint.model,
+                        messages=[{"role": "user", "content": prompt}], 
+                        temperature=0.5,
+                        stream=False,
+                    )
+                raw_response = await scheduler.call(endpoint.provider, attempt)
+                usage.record(endpoint.provider, bytes=len(raw_response.content))
+                response = raw_response.parse()
+                usage.record_tokens(endpoint.provider, response.usage)
+                return response
+
+            response = await self.interpreter.call(send)
 
             end_time = asyncio.get_event_loop().time()  
             print(f"OpenAI API call took {end_time - start_time:.2f} seconds")  
 
             if response.choices:
                 print(response.choices[0].message.content)
+                if cache_key and response.choices[0].message.content:
+                    self.interpretations.put(cache_key, response.choices[0].message.content)
                 result = {"weather_query": query, "weather_tool_response_needing_interpretation": response.choices[0].message.content}
             else:
                 result = {"weather_query": query, "weather_tool_response_needing_interpretation": "That is currently unavailable."}
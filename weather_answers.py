@@ -0,0 +1,332 @@
+#weather_answers.py
+
+import random
+import re
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+import numpy as np
+
+WIND_DIRECTIONS = {
+    'N': 'north', 'NNE': 'north north east', 'NE': 'north east', 'ENE': 'east north east',
+    'E': 'east', 'ESE': 'east south east', 'SE': 'south east', 'SSE': 'south south east',
+    'S': 'south', 'SSW': 'south south west', 'SW': 'south west', 'WSW': 'west south west',
+    'W': 'west', 'WNW': 'west north west', 'NW': 'north west', 'NNW': 'north north west',
+}
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+WIND_SPEED_PATTERN = re.compile(r"\d+")
+
+
+def parse_wind_speed(value: str) -> float:
+    """'10 mph' -> 10, '5 to 15 mph' -> 15."""
+    speeds = [int(speed) for speed in WIND_SPEED_PATTERN.findall(value or '')]
+    return float(max(speeds)) if speeds else 0.0
+
+
+class ForecastArrays:
+    """The hourly periods of an NWS forecast from `now` onwards, as numpy arrays plus per-day boundaries."""
+
+    def __init__(self, periods: List[Dict], now: Optional[datetime] = None):
+        end_times = [datetime.fromisoformat(period['endTime']) for period in periods]
+        if now is None and end_times:
+            now = datetime.now(end_times[0].tzinfo)
+        first = next((index for index, end_time in enumerate(end_times) if end_time > now), len(periods))
+        periods = periods[first:]
+
+        self.start_times = [datetime.fromisoformat(period['startTime']) for period in periods]
+        self.temperature = np.array([period['temperature'] for period in periods], dtype=float)
+        self.unit = periods[0].get('temperatureUnit', 'F') if periods else 'F'
+        self.precipitation = np.array([(period.get('probabilityOfPrecipitation') or {}).get('value') or 0
+                                       for period in periods], dtype=float)
+        self.wind_speed = np.array([parse_wind_speed(period.get('windSpeed')) for period in periods], dtype=float)
+        self.wind_direction = [period.get('windDirection', '') for period in periods]
+        self.short_forecast = [period.get('shortForecast', '') for period in periods]
+        self.hours = np.array([start_time.hour for start_time in self.start_times], dtype=int)
+        self.ordinals = np.array([start_time.date().toordinal() for start_time in self.start_times], dtype=int)
+        self.today = self.start_times[0].date() if periods else None
+        self.unit_asked = False  # Whether the question named a unit, so the answer should too
+
+    def __len__(self):
+        return len(self.start_times)
+
+    def convert(self, unit: str):
+        """Converts the temperatures to 'C' or 'F' in place."""
+        self.unit_asked = True
+        if unit == self.unit:
+            return
+        if unit == 'C':
+            self.temperature = (self.temperature - 32) * 5 / 9
+        else:
+            self.temperature = self.temperature * 9 / 5 + 32
+        self.unit = unit
+
+    def days(self, mask: np.ndarray):
+        """Splits the masked periods by calendar day: (indices, day start offsets, dates)."""
+        indices = np.flatnonzero(mask)
+        ordinals = self.ordinals[indices]
+        starts = np.flatnonzero(np.r_[True, ordinals[1:] != ordinals[:-1]]) if len(indices) else np.array([], dtype=int)
+        return indices, starts, [date.fromordinal(int(ordinal)) for ordinal in ordinals[starts]]
+
+    def full_days(self, mask: np.ndarray, min_periods: int) -> np.ndarray:
+        """The masked periods of days with at least min_periods hours, so a partial day isn't compared with full ones."""
+        ordinals, counts = np.unique(self.ordinals[mask], return_counts=True)
+        return mask & np.isin(self.ordinals, ordinals[counts >= min_periods])
+
+
+class WeatherAnswerEngine:
+    """
+    Answers the common, closed-form weather questions (coldest or warmest day, umbrella, current
+    temperature, wind) straight from the hourly forecast. Anything open-ended, or asking about more
+    than one of these at once, returns None and goes to the LLM as before.
+    """
+
+    EXTREMES_PATTERN = re.compile(r"\b(coldest|coolest|chilliest|warmest|hottest)\b", re.IGNORECASE)
+    RAIN_PATTERN = re.compile(r"\b(umbrella|rain\w*|shower\w*|drizzle|wet)\b", re.IGNORECASE)
+    WIND_PATTERN = re.compile(r"\b(wind\w*|breez\w*|gust\w*)\b", re.IGNORECASE)
+    TEMPERATURE_PATTERN = re.compile(r"\b(temperature|temp|degrees|hot|cold|warm|chilly)\b", re.IGNORECASE)
+    OPEN_ENDED_PATTERN = re.compile(
+        r"\b(why|should|wear|plan|compare|explain|summar\w*|describe|overview|forecast|like|good day|humid\w*)\b",
+        re.IGNORECASE,
+    )
+    # probabilityOfPrecipitation doesn't say what falls, so these go to the LLM with the full forecast
+    PRECIPITATION_TYPE_PATTERN = re.compile(
+        r"\b(snow\w*|storm\w*|thunder\w*|lightning|hail\w*|sleet\w*|ic[ey]|flurr\w*|blizzard\w*|precipitation)\b",
+        re.IGNORECASE,
+    )
+    UNIT_PATTERN = re.compile(r"\b(celsius|centigrade|fahrenheit)\b", re.IGNORECASE)
+    # A clock time or part of a day needs the hourly values themselves, which the LLM reads from the forecast
+    TIME_OF_DAY_PATTERN = re.compile(
+        r"\b(at \d+|\d+(?::\d\d)? ?(?:am|pm|a\.m\.|p\.m\.|o'clock)|noon|midnight|morning|afternoon|evening|"
+        r"later|next week|this week|hours?|minutes?)\b",
+        re.IGNORECASE,
+    )
+    RAIN_TIMING_PATTERN = re.compile(r"\b(when|stop\w*|start\w*|until|let up)\b", re.IGNORECASE)
+    NOW_PATTERN = re.compile(r"\b(now|currently|current|at the moment)\b", re.IGNORECASE)
+    NEXT_HOUR_PATTERN = re.compile(r"\b(next hour|in an hour|within the hour)\b", re.IGNORECASE)
+    FULL_DAY_PERIODS = 18  # Hourly periods a day needs before its high, low or extremes mean the whole day
+    RAIN_LIKELY = 50  # Percent chance at which we say to take an umbrella
+    RAIN_POSSIBLE = 30
+
+    def __init__(self):
+        self.answered = 0
+        self.fallbacks = 0
+
+    def answer(self, question: str, forecast_data: Dict, location: str = '', now: Optional[datetime] = None) -> Optional[str]:
+        """
+        Parameters:
+        - question: The user's weather question.
+        - forecast_data: The NWS hourly forecast JSON (CachedForecast.data).
+        - location: Spoken place name, e.g. "Boise".
+        - now: Reference time; defaults to the current time in the forecast's timezone.
+
+        Returns:
+        - A sentence ready to be spoken, or None if the question needs the LLM.
+        """
+        intent = self.classify(question)
+        if intent is None:
+            self.fallbacks += 1
+            return None
+        arrays = ForecastArrays(forecast_data['properties']['periods'], now)
+        if not len(arrays):
+            self.fallbacks += 1
+            return None
+        scope = self.scope(question, arrays)
+        if scope is None or not scope[0].any():
+            self.fallbacks += 1
+            return None
+        mask, scope_name = scope
+        unit = self.UNIT_PATTERN.search(question)
+        if unit:
+            arrays.convert('F' if unit.group(1).lower() == 'fahrenheit' else 'C')
+        answer = getattr(self, f"answer_{intent}")(question, arrays, mask, scope_name, location)
+        if answer is None:
+            self.fallbacks += 1
+        else:
+            self.answered += 1
+        return answer
+
+    def classify(self, question: str) -> Optional[str]:
+        if self.OPEN_ENDED_PATTERN.search(question) or self.PRECIPITATION_TYPE_PATTERN.search(question):
+            return None
+        # "next hour" is scoped to the first periods; any other time of day goes to the LLM
+        if self.TIME_OF_DAY_PATTERN.search(self.NEXT_HOUR_PATTERN.sub('', question)):
+            return None
+        intents = [intent for intent, pattern in (("extremes", self.EXTREMES_PATTERN), ("rain", self.RAIN_PATTERN),
+                                                  ("wind", self.WIND_PATTERN)) if pattern.search(question)]
+        if not intents and self.TEMPERATURE_PATTERN.search(question):
+            intents = ["temperature"]
+        if intents == ["rain"] and self.RAIN_TIMING_PATTERN.search(question):
+            return None  # "When will it stop raining?" asks for a time, not a chance
+        return intents[0] if len(intents) == 1 else None
+
+    def scope(self, question: str, arrays: ForecastArrays):
+        """
+        Returns (period mask, spoken name), or None if the time asked about isn't fully covered.
+        The name is "right now" or "in the next hour" for the first periods, and None for the whole forecast.
+        """
+        text = question.lower()
+        ordinals = arrays.ordinals
+        today = arrays.today.toordinal()
+        first_periods = np.arange(len(arrays))
+        if self.NEXT_HOUR_PATTERN.search(text):
+            return first_periods < 2, "in the next hour"
+        if self.NOW_PATTERN.search(text):
+            return first_periods < 1, "right now"
+        if 'tonight' in text:
+            hours_from_today = (ordinals - today) * 24 + arrays.hours
+            return (hours_from_today >= 18) & (hours_from_today < 30), "tonight"
+        if 'today' in text:
+            mask = ordinals == today
+            return mask, "today" if mask.sum() >= self.FULL_DAY_PERIODS else "for the rest of today"
+        if 'tomorrow' in text:
+            return self.full_day(arrays, today + 1)
+        if 'weekend' in text:
+            weekend = [ordinal for ordinal in np.unique(ordinals) if date.fromordinal(int(ordinal)).weekday() >= 5][:2]
+            mask = arrays.full_days(np.isin(ordinals, weekend), self.FULL_DAY_PERIODS)
+            return (mask, "this weekend") if mask.any() else None
+        for weekday, name in enumerate(WEEKDAYS):
+            if re.search(rf"\b{name}\b", text):
+                offset = (weekday - arrays.today.weekday()) % 7
+                # Today's weekday by name, or "next Friday", means the coming week's
+                if offset == 0:
+                    offset = 7
+                elif re.search(rf"\bnext {name}\b", text):
+                    offset += 7
+                return self.full_day(arrays, today + offset)
+        return np.ones(len(arrays), dtype=bool), None
+
+    def full_day(self, arrays: ForecastArrays, ordinal: int):
+        """Scope for one day after today, or None if the forecast doesn't cover (nearly) all of it."""
+        mask = arrays.ordinals == ordinal
+        if mask.sum() < self.FULL_DAY_PERIODS:
+            return None
+        return mask, self.day_name(arrays, date.fromordinal(ordinal))
+
+    @staticmethod
+    def day_name(arrays: ForecastArrays, day: date) -> str:
+        offset = (day - arrays.today).days
+        if offset == 0:
+            return "today"
+        if offset == 1:
+            return "tomorrow"
+        return day.strftime('%A')
+
+    @staticmethod
+    def hour_name(start_time: datetime) -> str:
+        return start_time.strftime('%I %p').lstrip('0')
+
+    @staticmethod
+    def degrees(arrays: ForecastArrays, value: float) -> str:
+        if arrays.unit == 'C':
+            return f"{value:.0f} degrees Celsius"
+        return f"{value:.0f} degrees" + (" Fahrenheit" if arrays.unit_asked else "")
+
+    @staticmethod
+    def join(names: List[str]) -> str:
+        return names[0] if len(names) == 1 else f"{', '.join(names[:-1])} and {names[-1]}"
+
+    def answer_extremes(self, question, arrays, mask, scope_name, location):
+        mask = arrays.full_days(mask, self.FULL_DAY_PERIODS)
+        if not mask.any():
+            return None
+        indices, starts, days = arrays.days(mask)
+        lows = np.minimum.reduceat(arrays.temperature[indices], starts)
+        highs = np.maximum.reduceat(arrays.temperature[indices], starts)
+        wants = {word.lower() for word in self.EXTREMES_PATTERN.findall(question)}
+        sentences = []
+        if wants & {'coldest', 'coolest', 'chilliest'}:
+            coldest = int(np.argmin(lows))
+            sentences.append(f"The coldest day looks like {self.day_name(arrays, days[coldest])}, "
+                             f"with a low of {self.degrees(arrays, lows[coldest])}.")
+        if wants & {'warmest', 'hottest'}:
+            warmest = int(np.argmax(highs))
+            sentences.append(f"The warmest day looks like {self.day_name(arrays, days[warmest])}, "
+                             f"with a high of {self.degrees(arrays, highs[warmest])}.")
+        return ' '.join(sentences)
+
+    def answer_rain(self, question, arrays, mask, scope_name, location):
+        indices, starts, days = arrays.days(mask)
+        chances = arrays.precipitation[indices]
+        daily_peaks = np.maximum.reduceat(chances, starts)
+        peak = int(np.argmax(chances))
+        peak_time = arrays.start_times[indices[peak]]
+        peak_when = f"{self.day_name(arrays, peak_time.date())} around {self.hour_name(peak_time)}"
+
+        if scope_name in ("right now", "in the next hour"):
+            if chances[peak] >= self.RAIN_LIKELY:
+                return f"Yes, there's a {chances[peak]:.0f} percent chance of rain {scope_name}, so take an umbrella."
+            if chances[peak] >= self.RAIN_POSSIBLE:
+                return f"Maybe. There's a {chances[peak]:.0f} percent chance of rain {scope_name}."
+            return f"No, the chance of rain is only {chances[peak]:.0f} percent {scope_name}."
+
+        if len(days) == 1:
+            if chances[peak] >= self.RAIN_LIKELY:
+                return f"Yes, there's a {chances[peak]:.0f} percent chance of rain {peak_when}, so take an umbrella."
+            if chances[peak] >= self.RAIN_POSSIBLE:
+                return f"Maybe. The chance of rain peaks at {chances[peak]:.0f} percent {peak_when}."
+            return f"No, the chance of rain stays at or below {chances[peak]:.0f} percent {scope_name or self.day_name(arrays, days[0])}."
+
+        wet_days = [self.day_name(arrays, day) for day, day_peak in zip(days, daily_peaks) if day_peak >= self.RAIN_LIKELY]
+        if wet_days:
+            return (f"You'll likely need an umbrella {self.join(wet_days)}. "
+                    f"The highest chance of rain is {chances[peak]:.0f} percent {peak_when}.")
+        return (f"You probably won't need an umbrella. The chance of rain stays at or below "
+                f"{chances[peak]:.0f} percent through {self.day_name(arrays, days[-1])}.")
+
+    def answer_temperature(self, question, arrays, mask, scope_name, location):
+        place = f" in {location}" if location else ""
+        if scope_name is None:
+            return None  # "How cold will it get?" names no time, so the current reading would be the wrong answer
+        if scope_name == "right now":
+            condition = arrays.short_forecast[0].lower()
+            sentence = f"It's {self.degrees(arrays, arrays.temperature[0])}{place} right now."
+            return f"{sentence} The forecast says {condition}." if condition else sentence
+        temperatures = arrays.temperature[mask]
+        high, low = round(temperatures.max()), round(temperatures.min())
+        if high == low:
+            return f"{scope_name.capitalize()}{place}, expect about {self.degrees(arrays, high)} throughout."
+        return f"{scope_name.capitalize()}{place}, expect a high of {high} and a low of {self.degrees(arrays, low)}."
+
+    def answer_wind(self, question, arrays, mask, scope_name, location):
+        indices = np.flatnonzero(mask)
+        speeds = arrays.wind_speed[indices]
+        strongest = int(np.argmax(speeds))
+        strongest_time = arrays.start_times[indices[strongest]]
+        strongest_when = f"{self.day_name(arrays, strongest_time.date())} around {self.hour_name(strongest_time)}"
+        if scope_name in (None, "right now"):
+            direction = WIND_DIRECTIONS.get(arrays.wind_direction[0], arrays.wind_direction[0])
+            sentence = f"Winds are {arrays.wind_speed[0]:.0f} miles per hour from the {direction} right now"
+            if speeds[strongest] >= arrays.wind_speed[0] + 5:
+                return f"{sentence}, picking up to {speeds[strongest]:.0f} {strongest_when}."
+            return f"{sentence}."
+        return (f"{scope_name.capitalize()}, winds average {speeds.mean():.0f} miles per hour, "
+                f"strongest at {speeds[strongest]:.0f} {strongest_when}.")
+
+    def stats(self):
+        total = self.answered + self.fallbacks
+        return {"answered_locally": self.answered, "fell_back_to_llm": self.fallbacks,
+                "local_rate": self.answered / total if total else 0.0}
+
+
+def main():
+    start = datetime.now().astimezone().replace(minute=0, second=0, microsecond=0)
+    periods = []
+    for hour in range(156):
+        start_time = start + timedelta(hours=hour)
+        periods.append({
+            "startTime": start_time.isoformat(), "endTime": (start_time + timedelta(hours=1)).isoformat(),
+            "temperature": 45 + random.randint(0, 10) + (15 if 11 <= start_time.hour < 18 else 0),
+            "temperatureUnit": "F", "probabilityOfPrecipitation": {"value": random.choice([0, 10, 20, 40, 70])},
+            "windSpeed": f"{random.randint(0, 20)} mph", "windDirection": random.choice(list(WIND_DIRECTIONS)),
+            "shortForecast": random.choice(["Sunny", "Mostly Cloudy", "Chance Rain Showers"]),
+        })
+    forecast = {"properties": {"periods": periods}}
+
+    engine = WeatherAnswerEngine()
+    for question in ["When is the coldest and warmest day?", "On what days am I likely to need my umbrella?",
+                     "what's the temperature right now?", "Will it rain tomorrow?", "How windy is it?",
+                     "How cold will it get tonight?", "Is it raining right now?", "What should I wear on Saturday?"]:
+        print(f"{question!r} -> {engine.answer(question, forecast, 'Boise')}")
+    print(engine.stats())
+
+if __name__ == "__main__":
+    main()